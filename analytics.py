@@ -0,0 +1,337 @@
+"""Registro binario delle risposte e statistiche aggregate per domanda.
+
+Ogni risposta diventa un record a lunghezza fissa (qid, opzione scelta, esito,
+latenza, istante) accodato in memoria: il percorso del click fa solo un
+append. Un thread in background scrive i record in coda al file
+.cache/events/eventi.bin (solo append) e periodicamente li aggrega nei
+contatori per domanda di .cache/events/rollup.npz, elaborando solo i record
+arrivati dopo l'ultimo rollup. L'aggregazione è fatta con np.unique e
+np.bincount, quindi milioni di eventi richiedono pochi secondi.
+
+Le pagine di statistiche leggono soltanto il rollup.
+
+Uso batch:  python analytics.py   (rollup immediato e domande più difficili)
+"""
+import atexit
+import os
+import sys
+import threading
+import time
+
+import numpy as np
+
+CARTELLA = os.path.join('.cache', 'events')
+FILE_EVENTI = 'eventi.bin'
+FILE_ROLLUP = 'rollup.npz'
+INTERVALLO_SCRITTURA = 1.0
+INTERVALLO_ROLLUP = 30.0
+# Colonne dei conteggi per opzione: A, B, C, D e salto
+N_SCELTE = 5
+SALTO = -1
+# Tentativi "virtuali" con cui la media dell'utente ammorbidisce le domande poco viste
+PESO_PRIOR = 5.0
+
+EVENTO = np.dtype([
+    ('qid', '<u8'),
+    ('scelta', 'i1'),
+    ('esatta', 'u1'),
+    ('ms', '<u4'),
+    ('istante', '<f8'),
+])
+
+
+def qid_numerica(qid):
+    """La qid (16 cifre esadecimali) come intero a 64 bit."""
+    return int(qid, 16)
+
+
+class Rollup:
+    """Contatori per domanda, ordinati per qid numerica."""
+
+    __slots__ = ('qid', 'tentativi', 'esatte', 'somma_ms', 'scelte', 'offset', 'aggiornato')
+
+    def __init__(self, qid=None, tentativi=None, esatte=None, somma_ms=None, scelte=None, offset=0, aggiornato=0.0):
+        self.qid = np.zeros(0, dtype=np.uint64) if qid is None else qid
+        self.tentativi = np.zeros(0, dtype=np.int64) if tentativi is None else tentativi
+        self.esatte = np.zeros(0, dtype=np.int64) if esatte is None else esatte
+        self.somma_ms = np.zeros(0, dtype=np.int64) if somma_ms is None else somma_ms
+        self.scelte = np.zeros((0, N_SCELTE), dtype=np.int64) if scelte is None else scelte
+        self.offset = offset            # byte del registro già aggregati
+        self.aggiornato = aggiornato
+
+    def __len__(self):
+        return len(self.qid)
+
+    def unisci(self, eventi):
+        """Nuovo rollup con gli eventi aggiunti (aggregazione vettoriale)."""
+        risposte = eventi[eventi['scelta'] != SALTO]
+        qid = np.concatenate([self.qid, eventi['qid']])
+        unici, inversa = np.unique(qid, return_inverse=True)
+        n = len(unici)
+        vecchi, nuovi = inversa[:len(self.qid)], inversa[len(self.qid):]
+        nuovi_risposte = nuovi[eventi['scelta'] != SALTO]
+
+        tentativi = np.bincount(vecchi, weights=self.tentativi, minlength=n) + np.bincount(nuovi_risposte, minlength=n)
+        esatte = np.bincount(vecchi, weights=self.esatte, minlength=n) \
+            + np.bincount(nuovi_risposte, weights=risposte['esatta'], minlength=n)
+        somma_ms = np.bincount(vecchi, weights=self.somma_ms, minlength=n) \
+            + np.bincount(nuovi_risposte, weights=risposte['ms'], minlength=n)
+
+        colonna = np.where(eventi['scelta'] == SALTO, N_SCELTE - 1, eventi['scelta']).astype(np.int64)
+        scelte = np.zeros((n, N_SCELTE), dtype=np.int64)
+        scelte[vecchi] += self.scelte
+        np.add.at(scelte, (nuovi, np.clip(colonna, 0, N_SCELTE - 1)), 1)
+
+        return Rollup(
+            unici, tentativi.astype(np.int64), esatte.astype(np.int64), somma_ms.astype(np.int64),
+            scelte, self.offset + eventi.nbytes, time.time(),
+        )
+
+    def cerca(self, qid_numeriche):
+        """Indici nel rollup delle qid date, -1 per quelle mai viste."""
+        qid_numeriche = np.asarray(qid_numeriche, dtype=np.uint64)
+        if not len(self.qid):
+            return np.full(len(qid_numeriche), -1, dtype=np.int64)
+        pos = np.minimum(np.searchsorted(self.qid, qid_numeriche), len(self.qid) - 1)
+        return np.where(self.qid[pos] == qid_numeriche, pos, -1)
+
+    def salva(self, percorso):
+        temporaneo = f"{percorso}.{os.getpid()}.tmp.npz"
+        np.savez(
+            temporaneo, qid=self.qid, tentativi=self.tentativi, esatte=self.esatte,
+            somma_ms=self.somma_ms, scelte=self.scelte,
+            meta=np.array([self.offset, self.aggiornato], dtype=np.float64),
+        )
+        os.replace(temporaneo, percorso)
+
+    @classmethod
+    def carica(cls, percorso):
+        try:
+            with np.load(percorso) as dati:
+                offset, aggiornato = dati['meta']
+                return cls(
+                    dati['qid'], dati['tentativi'], dati['esatte'], dati['somma_ms'], dati['scelte'],
+                    int(offset), float(aggiornato),
+                )
+        except (OSError, KeyError, ValueError):
+            return cls()
+
+
+class EventLog:
+    """Registro append-only degli eventi di risposta con rollup periodico."""
+
+    def __init__(self, cartella=CARTELLA, intervallo_rollup=INTERVALLO_ROLLUP):
+        self.cartella = cartella
+        self.percorso_eventi = os.path.join(cartella, FILE_EVENTI)
+        self.percorso_rollup = os.path.join(cartella, FILE_ROLLUP)
+        self.intervallo_rollup = intervallo_rollup
+        os.makedirs(cartella, exist_ok=True)
+        self._buffer = []
+        self._lock = threading.Lock()
+        self._rollup_lock = threading.Lock()
+        self._sveglia = threading.Event()
+        self._chiuso = False
+        self.rollup = Rollup.carica(self.percorso_rollup)
+        self.stats = {'eventi': 0, 'rollup': 0, 'durata_rollup': 0.0}
+        self._thread = threading.Thread(target=self._ciclo, name='event-log', daemon=True)
+        self._thread.start()
+        atexit.register(self.chiudi)
+
+    def registra(self, qid, scelta, esatta, ms):
+        """Accoda una risposta (scelta = indice originale, SALTO se saltata)."""
+        evento = (qid_numerica(qid), SALTO if scelta is None else scelta, int(bool(esatta)), int(ms), time.time())
+        with self._lock:
+            self._buffer.append(evento)
+
+    def scrivi(self):
+        """Scrive in coda al registro gli eventi accodati."""
+        with self._lock:
+            buffer, self._buffer = self._buffer, []
+        if buffer:
+            with open(self.percorso_eventi, 'ab') as f:
+                f.write(np.array(buffer, dtype=EVENTO).tobytes())
+            self.stats['eventi'] += len(buffer)
+
+    def aggrega(self):
+        """Aggrega nel rollup gli eventi scritti dopo l'ultimo rollup."""
+        self.scrivi()
+        with self._rollup_lock:
+            inizio = time.perf_counter()
+            try:
+                dimensione = os.path.getsize(self.percorso_eventi)
+            except OSError:
+                return self.rollup
+            dimensione -= (dimensione - self.rollup.offset) % EVENTO.itemsize
+            if dimensione <= self.rollup.offset:
+                return self.rollup
+            eventi = np.fromfile(
+                self.percorso_eventi, dtype=EVENTO,
+                count=(dimensione - self.rollup.offset) // EVENTO.itemsize, offset=self.rollup.offset,
+            )
+            rollup = self.rollup.unisci(eventi)
+            rollup.salva(self.percorso_rollup)
+            self.rollup = rollup
+            self.stats['rollup'] += 1
+            self.stats['durata_rollup'] = time.perf_counter() - inizio
+            return rollup
+
+    def _ciclo(self):
+        ultimo_rollup = time.monotonic()
+        while not self._chiuso:
+            self._sveglia.wait(INTERVALLO_SCRITTURA)
+            self._sveglia.clear()
+            try:
+                self.scrivi()
+                if time.monotonic() - ultimo_rollup >= self.intervallo_rollup:
+                    self.aggrega()
+                    ultimo_rollup = time.monotonic()
+            except OSError:
+                pass
+
+    def chiudi(self):
+        if self._chiuso:
+            return
+        self._chiuso = True
+        self._sveglia.set()
+        self._thread.join(5)
+        try:
+            self.scrivi()
+        except OSError:
+            pass
+
+
+_registri = {}
+_registri_lock = threading.Lock()
+
+
+def get_event_log():
+    """Registro eventi condiviso dal processo per la cartella di lavoro corrente."""
+    chiave = os.getcwd()
+    with _registri_lock:
+        registro = _registri.get(chiave)
+        if registro is None:
+            registro = _registri[chiave] = EventLog()
+        return registro
+
+
+_qid_banche = {}            # (sha, righe) -> qid numeriche
+_qid_canonica = None        # oggetto di `canonica` per cui valgono i valori in cache
+_qid_lock = threading.Lock()
+
+
+def qid_banca(banca, canonica=lambda qid: qid):
+    """qid numeriche (canoniche) delle domande di una banca, calcolate una volta per banca.
+
+    La cache è per contenuto (sha della banca e righe lette) e vale per una
+    sola deduplica: cambiata la mappa degli alias si riparte da zero. Una
+    vista su più banche concatena i valori delle sue banche; una banca senza
+    sha non viene messa in cache.
+    """
+    banche = getattr(banca, 'banche', None)
+    if banche is not None:
+        if not banche:
+            return np.zeros(0, dtype=np.uint64)
+        return np.concatenate([qid_banca(b, canonica) for b in banche])
+    sha = getattr(banca, 'sha', None)
+    if sha is None:
+        return _qid_numeriche(banca, canonica)
+    global _qid_canonica
+    proprietario = getattr(canonica, '__self__', canonica)
+    chiave = (sha, len(banca))
+    with _qid_lock:
+        if proprietario is not _qid_canonica:
+            _qid_banche.clear()
+            _qid_canonica = proprietario
+        valori = _qid_banche.get(chiave)
+    if valori is None:
+        valori = _qid_numeriche(banca, canonica)
+        with _qid_lock:
+            if _qid_canonica is proprietario:
+                if len(_qid_banche) > 256:
+                    _qid_banche.clear()
+                _qid_banche[chiave] = valori
+    return valori
+
+
+def _qid_numeriche(banca, canonica):
+    return np.fromiter(
+        (qid_numerica(canonica(q.qid)) for q in banca.domande), dtype=np.uint64, count=len(banca)
+    )
+
+
+def difficolta(rollup, qid_numeriche):
+    """(tentativi, tasso di errore, ms medi, conteggi per scelta) per ogni qid."""
+    pos = rollup.cerca(qid_numeriche)
+    vista = pos >= 0
+    n = len(pos)
+    tentativi = np.zeros(n, dtype=np.int64)
+    esatte = np.zeros(n, dtype=np.int64)
+    somma_ms = np.zeros(n, dtype=np.int64)
+    scelte = np.zeros((n, N_SCELTE), dtype=np.int64)
+    tentativi[vista] = rollup.tentativi[pos[vista]]
+    esatte[vista] = rollup.esatte[pos[vista]]
+    somma_ms[vista] = rollup.somma_ms[pos[vista]]
+    scelte[vista] = rollup.scelte[pos[vista]]
+    with np.errstate(invalid='ignore', divide='ignore'):
+        errore = np.where(tentativi > 0, 1 - esatte / tentativi, np.nan)
+        ms = np.where(tentativi > 0, somma_ms / tentativi, np.nan)
+    return tentativi, errore, ms, scelte
+
+
+def probabilita_esatte(rollup, qid_numeriche, corrette, sbagliate, viste=None):
+    """Probabilità di rispondere bene a ogni domanda, None senza domande viste.
+
+    È l'accuratezza storica della domanda, ammorbidita verso quella
+    dell'utente (PESO_PRIOR tentativi virtuali) e riscalata dal rapporto tra
+    l'utente e la media delle domande della banca. Come nel voto stimato di
+    sempre, l'accuratezza dell'utente è sulle domande viste: una saltata conta
+    come tentativo non esatto (viste=None: solo giuste e sbagliate).
+    """
+    viste = corrette + sbagliate if viste is None else viste
+    if viste == 0 or len(qid_numeriche) == 0:
+        return None
+    p_utente = corrette / viste
+    pos = rollup.cerca(qid_numeriche)
+    vista = pos >= 0
+    tentativi = np.zeros(len(pos))
+    esatte = np.zeros(len(pos))
+    tentativi[vista] = rollup.tentativi[pos[vista]]
+    esatte[vista] = rollup.esatte[pos[vista]]
+    p = (esatte + PESO_PRIOR * p_utente) / (tentativi + PESO_PRIOR)
+    # Bravura relativa: utente contro la media storica della banca
+    media = p.mean()
+    if media > 0:
+        p = np.clip(p * (p_utente / media), 0, 1)
+    return p
+
+
+def voto_stimato(rollup, qid_numeriche, corrette, sbagliate, viste=None, n_domande=33, penalita=0.33):
+    """Voto atteso su un esame estratto dalla banca (None senza domande viste).
+
+    Le domande non esatte sono sbagliate nella proporzione dell'utente e
+    saltate (0 punti) per il resto: con lo storico uniforme è
+    (corrette - penalita * sbagliate) / viste per domanda.
+
+    >>> qids = np.arange(5, dtype=np.uint64)
+    >>> round(voto_stimato(Rollup(), qids, 6, 3, viste=10), 3)  # 33 * (6 - 0.33 * 3) / 10
+    16.533
+    >>> voto_stimato(Rollup(), qids, 0, 0, viste=4)
+    0.0
+    """
+    viste = corrette + sbagliate if viste is None else viste
+    p = probabilita_esatte(rollup, qid_numeriche, corrette, sbagliate, viste)
+    if p is None:
+        return None
+    quota_sbagliate = sbagliate / (viste - corrette) if viste > corrette else 0.0
+    return float(n_domande * np.mean(p - (1 - p) * quota_sbagliate * penalita))
+
+
+if __name__ == '__main__':
+    registro = get_event_log()
+    rollup = registro.aggrega()
+    print(f"{len(rollup)} domande, {registro.stats}")
+    if len(rollup):
+        errore = 1 - rollup.esatte / np.maximum(rollup.tentativi, 1)
+        for i in np.argsort(-errore)[:int(sys.argv[1]) if len(sys.argv) > 1 else 10]:
+            print(f"{rollup.qid[i]:016x}  {rollup.tentativi[i]:6d} tentativi  {errore[i]:.0%} errate")
+    registro.chiudi()
@@ -1,152 +1,235 @@
 import streamlit as st
-import pandas as pd
-import random
+import functools
+import logging
 import os
-import re
+import random
+import time
+import uuid
+import numpy as np
 import streamlit.components.v1 as components # <--- AGGIUNGI QUESTO
+from streamlit.errors import StreamlitAPIException
+from streamlit.runtime.scriptrunner import get_script_run_ctx
+
+from analytics import (
+    SALTO, difficolta, get_event_log, probabilita_esatte, qid_banca, qid_numerica, voto_stimato,
+)
+from bank import (
+    MultiBankView, QuestionBank, QuestionView, StreamingBank, banca_completa, banca_per_sha, elenco_righe, load_bank,
+    risolvi,
+)
+from catalog import build_cheatsheet_categories, get_catalog, parse_cheatsheet_category
+from cheatsheet import MIN_PARTI, SOGLIA_SEZIONI, sezioni_markdown
+from dedup import deduplica_disponibile, identica
+from engine import ESAME_RICOMINCIATO, FINE_ESAME, FINE_PRATICA, VERIFICATO, QuizSession
+from exam import genera_esame, pesi_da_errori, quote_proporzionali
+from linking import collegamenti_disponibili, get_collegamenti
+from perf import Rerun, cache_misurata, cache_stats, get_registro_rerun, memoria_sessione
+from prerender import disponibile as prerender_disponibile, html_markdown, stats as prerender_stats
+from prewarm import get_prewarm
+from progress import RegistroUtente, WrongAnswerStore, get_progress_store
+from quiz_client import PREFETCH, prepara_domande, quiz_client
+from simulator import N_ESAMI_INTERATTIVI, probabilita_argomenti, probabilita_domande, simula_esami
+from search import get_indice
+from uploads import Caricamento, carica as carica_upload, contenuto as contenuto_caricato
+
 # --- CONFIGURAZIONE ---
 st.set_page_config(page_title="Dynamic Quiz Loader", page_icon="🚽", layout="wide")
 
+# --- MISURE (perf.py) ---
+# Ogni esecuzione cronometra le sue fasi; ferma() sostituisce st.stop() per
+# registrarle, quelle interrotte da st.rerun() si chiudono all'esecuzione dopo
+MISURE_IN_SESSIONE = 20
+# Esecuzioni tra due misure della memoria di sessione
+RERUN_MEMORIA = 10
+
+def registra_misure(misure, **extra):
+    """Chiude le misure (una sola volta) e le manda al registro JSON e al pannello di debug."""
+    if misure is None or misure.chiuso:
+        return
+    record = misure.chiudi(**extra)
+    get_registro_rerun().registra(record)
+    ultime = st.session_state.setdefault('misure_ultime', [])
+    ultime.append(record)
+    del ultime[:-MISURE_IN_SESSIONE]
+
+def inizia_misure(tipo):
+    registra_misure(st.session_state.get('misure'), interrotta=True)
+    st.session_state.misure = Rerun(tipo)
+    return st.session_state.misure
+
+def ferma():
+    """st.stop() dopo aver registrato i tempi dell'esecuzione."""
+    registra_misure(st.session_state.get('misure'))
+    st.stop()
+
+def solo_fragment():
+    """L'esecuzione corrente è il rerun di un fragment, non dello script."""
+    ctx = get_script_run_ctx()
+    return bool(ctx is not None and getattr(ctx, 'fragment_ids_this_run', None))
+
+def misurato(nome):
+    """Fase `nome` dello script; nei rerun del solo fragment è un'esecuzione a sé."""
+    def avvolgi(funzione):
+        @functools.wraps(funzione)
+        def misurata(*args, **kwargs):
+            if not solo_fragment():
+                st.session_state.misure.fase(nome)
+                return funzione(*args, **kwargs)
+            misure = inizia_misure('fragment')
+            misure.fase(nome)
+            try:
+                return funzione(*args, **kwargs)
+            finally:
+                registra_misure(misure)
+        return misurata
+    return avvolgi
+
+misure = inizia_misure('script')
+misure.fase('sessione')
+
 # --- COSTANTI GLOBALI ---
 MAX_DOMANDE_ESAME = 33
+BANCA_UNITA = "🔀 Tutte le banche (senza duplicati)"
 
 # --- 1. FUNZIONI UTILITY ---
 
-def crea_csv_esempio_se_mancano():
-    """Crea un file di test in csv/ se non ci sono quiz disponibili."""
-    csv_dir = 'csv'
-    os.makedirs(csv_dir, exist_ok=True)
-    files_csv = [f for f in os.listdir(csv_dir) if f.endswith('.csv')]
-    
-    if not files_csv:
-        data_demo = {
-            'domanda': ['Quanto fa 1+1?', 'Il cielo è?'],
-            'opzioneA': ['1', 'Verde'],
-            'opzioneB': ['2', 'Blu'],
-            'opzioneC': ['3', 'Giallo'],
-            'opzioneD': ['4', 'Viola'],
-            'soluzione': ['B', 'B'], 
-            'motivazione': ['Matematica base.', 'Rayleigh scattering.']
-        }
-        pd.DataFrame(data_demo).to_csv(os.path.join(csv_dir, 'Quiz_Demo.csv'), index=False)
-
 def get_lista_quiz():
-    """Scansiona csv/ e md/ e restituisce home, quizzes e cheatsheets."""
-    crea_csv_esempio_se_mancano()
-    csv_dir = 'csv'
-    md_dir = 'md'
-    os.makedirs(csv_dir, exist_ok=True)
-    os.makedirs(md_dir, exist_ok=True)
-
-    quizzes = {}
-    cheatsheets = {}
-
-    if os.path.isdir(csv_dir):
-        for f in os.listdir(csv_dir):
-            if f.endswith('.csv'):
-                nome_pulito = f.replace('.csv', '').replace('_', ' ').title()
-                quizzes[nome_pulito] = os.path.join(csv_dir, f)
-
-    if os.path.isdir(md_dir):
-        for root, dirs, files in os.walk(md_dir):
-            for f in files:
-                if f.endswith('.md'):
-                    rel_path = os.path.relpath(root, md_dir)
-                    if rel_path == '.':
-                        category = 'OTHER'
-                    else:
-                        category = rel_path.upper()
-                    nome_pulito = f.replace('.md', '').replace('_', ' ')
-                    label = f"{category} {nome_pulito}"
-                    cheatsheets[label] = os.path.join(root, f)
-
-    readme_item = 'README.md' if os.path.exists('README.md') else None
-    return readme_item, quizzes, cheatsheets
-
-
-def parse_cheatsheet_category(label):
-    """Estrae categoria e ordine numerico da un nome di cheatsheet."""
-    if label.startswith("📤 "):
-        label = label[2:]
-    label = label.strip()
-    parts = label.split()
-    if not parts:
-        return "Other", 999, label
-
-    category = parts[0].upper()
-    order = None
-    if len(parts) > 1:
-        match = re.match(r'^(\d+)', parts[1])
-        if match:
-            order = int(match.group(1))
-
-    if order is None:
-        match = re.search(r'(\d+)', label)
-        if match:
-            order = int(match.group(1))
-
-    # Compute display
-    display = ' '.join(parts[1:]) if len(parts) > 1 else label
-    if display and display[0].isdigit():
-        space_index = display.find(' ')
-        if space_index != -1:
-            display = display[:space_index] + '. ' + display[space_index+1:]
-
-    return category, order if order is not None else 999, display
-
-
-def build_cheatsheet_categories(cheatsheet_map):
-    categories = {}
-    for label, item in cheatsheet_map.items():
-        category, order, display = parse_cheatsheet_category(label)
-        categories.setdefault(category, []).append((order, display, item))
-
-    for cat, items in categories.items():
-        items.sort(key=lambda x: (x[0], x[1]))
-        categories[cat] = items
-
-    return dict(sorted(categories.items(), key=lambda x: x[0]))
+    """Restituisce home, quizzes e cheatsheets dal catalogo condiviso del processo."""
+    return get_catalog().snapshot()
 
 # --- 2. GESTIONE RESET E STATO ---
 
+def id_utente():
+    """ID dell'utente dal parametro ?utente= dell'URL, creato alla prima visita.
+
+    Resta nell'URL, quindi un refresh della pagina ritrova gli stessi progressi.
+    """
+    utente = st.query_params.get('utente')
+    if not utente:
+        utente = uuid.uuid4().hex[:16]
+        st.query_params['utente'] = utente
+    return utente
+
 # Inizializza le variabili di session state critiche
-if 'wrong_answers' not in st.session_state:
-    st.session_state.wrong_answers = []
+if 'sessione' not in st.session_state:
+    # Sessione nuova (anche dopo un refresh o un riavvio): si riprendono i
+    # progressi salvati; le domande sbagliate restano riferimenti finché non servono
+    registro = RegistroUtente(get_progress_store(), id_utente())
+    voci, stato_salvato = registro.archivio.carica(registro.utente)
+    st.session_state.registro = registro
+    # Tutto lo stato del quiz sta nel motore (engine.py): l'app ne chiama i
+    # metodi dai callback e ne disegna lo stato
+    st.session_state.sessione = QuizSession(
+        WrongAnswerStore(voci, registro=registro)
+    )
+    # Risposte per domanda {qid numerica: [tentativi, esatte]}, per la simulazione d'esame
+    st.session_state.storico = {
+        qid_numerica(qid): [tentativi, esatte]
+        for qid, (tentativi, esatte) in registro.archivio.storico(registro.utente).items()
+    }
+    if stato_salvato:
+        st.session_state.ripristino = stato_salvato
 if 'practice_mode' not in st.session_state:
     st.session_state.practice_mode = False
-if 'correct_count' not in st.session_state:
-    st.session_state.correct_count = 0
-if 'wrong_count' not in st.session_state:
-    st.session_state.wrong_count = 0
-if 'answer_already_counted' not in st.session_state:
-    st.session_state.answer_already_counted = False
+sessione = st.session_state.sessione
 
 def reset_quiz_state():
     """Resetta completamente lo stato quando si cambia quiz."""
-    st.session_state.domanda_corrente = None
-    st.session_state.fase = 'selezione'
-    st.session_state.selezione_utente = None
-    st.session_state.opzioni_mix = []
-    st.session_state.answer_already_counted = False
-    # Reset contatore domande quando si cambia quiz
-    if 'domande_risposte_totali' in st.session_state:
-        st.session_state.domande_risposte_totali = 0
-    st.session_state.correct_count = 0
-    st.session_state.wrong_count = 0
+    st.session_state.sessione.azzera()
 
 def reset_wrong_answers():
     """Resetta la lista delle risposte sbagliate."""
-    st.session_state.wrong_answers = []
+    st.session_state.sessione.errori.svuota()
     st.session_state.practice_mode = False
 
+# Cache del processo riempite in background se QUIZ_PREWARM è impostata (prewarm.py)
+prewarm = get_prewarm()
+
 # --- 3. SIDEBAR DINAMICA ---
 
 st.sidebar.title("Libreria Quiz")
+if prewarm is not None and not prewarm.pronto:
+    stato_prewarm = prewarm.stato()
+    st.sidebar.caption(f"🔥 Preparazione cache: {stato_prewarm['fatti']}/{stato_prewarm['totale'] or '…'}")
+
+# Pannello nascosto con i tempi delle ultime esecuzioni: ?debug=1 nell'URL
+if st.query_params.get('debug') == '1':
+    with st.sidebar.expander("⏱️ Debug prestazioni", expanded=True):
+        ultime = st.session_state.get('misure_ultime', [])
+        if ultime:
+            st.caption("Ultime esecuzioni (ms)")
+            st.dataframe(
+                [{'tipo': r['tipo'], 'totale': r['totale_ms'], **r['fasi']} for r in reversed(ultime)],
+                hide_index=True,
+            )
+        if cache_stats:
+            st.caption("Cache Streamlit del processo")
+            st.dataframe(
+                [{'funzione': nome, 'hit': c - m, 'miss': m} for nome, (c, m) in sorted(cache_stats.items())],
+                hide_index=True,
+            )
+        if ultime and 'sessione_kb' in ultime[-1]:
+            st.caption(f"Stato di sessione: {ultime[-1]['sessione_kb']:.1f} KB")
+        st.caption(f"Catalogo: {get_catalog().stats}")
+        st.caption(f"Pre-render cheatsheet: {prerender_stats}")
+        st.caption(f"Registro {get_registro_rerun().percorso}: {get_registro_rerun().stats['righe']} righe")
 st.sidebar.write("Seleziona una sezione:")
 
+misure.fase('catalogo')
 readme_item, quiz_map, cheatsheet_map = get_lista_quiz()
 
+# --- RICERCA ---
+misure.fase('ricerca')
+
+def vai_a_risultato(tipo, etichetta, percorso, posizione):
+    """Apre la domanda o la sezione di cheatsheet di un risultato di ricerca."""
+    if tipo == 'quiz':
+        st.session_state.section_selection = "Quiz"
+        st.session_state.quiz_selection = etichetta
+        st.session_state.banche_combinate = []
+        st.session_state.practice_mode = False
+        st.session_state.domanda_richiesta = (percorso, posizione)
+    else:
+        categoria, _, display = parse_cheatsheet_category(etichetta)
+        st.session_state.section_selection = "Cheatsheets"
+        st.session_state.cheatsheet_category = categoria
+        st.session_state.cheatsheet_selection = display
+        st.session_state[f"sezione_{display}"] = posizione
+        st.session_state[f"tutto_{display}"] = False
+
+def richiedi_salto(*destinazione):
+    """Salto chiesto da dentro un frammento: si applica all'inizio del rerun completo."""
+    st.session_state.salto_richiesto = destinazione
+
+# Prima di creare i widget della sidebar, che il salto modifica
+if 'salto_richiesto' in st.session_state:
+    vai_a_risultato(*st.session_state.pop('salto_richiesto'))
+
+testo_ricerca = st.sidebar.text_input("🔍 Cerca", key="ricerca", placeholder="Domande e cheatsheet…")
+if testo_ricerca.strip():
+    indice_ricerca = get_indice()
+    indice_ricerca.aggiorna()
+    etichette = {percorso: label for label, percorso in {**quiz_map, **cheatsheet_map}.items()}
+    risultati = [r for r in indice_ricerca.cerca(testo_ricerca, k=8) if r.percorso in etichette]
+    for n, r in enumerate(risultati):
+        etichetta = etichette[r.percorso]
+        if r.tipo == 'quiz':
+            testo_bottone = f"❓ {etichetta}: {r.titolo}"
+        else:
+            testo_bottone = f"📘 {etichetta}" + (f" › {r.titolo}" if r.titolo else "")
+        st.sidebar.button(
+            testo_bottone,
+            key=f"risultato_{n}",
+            help=r.estratto,
+            use_container_width=True,
+            on_click=vai_a_risultato,
+            args=(r.tipo, etichetta, r.percorso, r.posizione)
+        )
+    if not risultati:
+        st.sidebar.caption("Nessun risultato.")
+
 # --- CARICA CSV PERSONALIZZATO ---
+misure.fase('upload')
 st.sidebar.markdown("---")
 st.sidebar.subheader("📤 Carica Quiz o Cheatsheet Markdown")
 
@@ -154,40 +237,57 @@ uploaded_file = st.sidebar.file_uploader("Scegli un file CSV o MD", type=['csv',
 
 if uploaded_file is not None:
     try:
-        uploaded_name = uploaded_file.name
-        if uploaded_name.lower().endswith('.md'):
-            raw_bytes = uploaded_file.getvalue()
-            try:
-                markdown_text = raw_bytes.decode('utf-8')
-            except UnicodeDecodeError:
-                markdown_text = raw_bytes.decode('latin-1')
-
-            nome_file = uploaded_name.replace('.md', '')
-            nome_pulito = nome_file.replace('_', ' ').title()
-            cheatsheet_map[f"📤 {nome_pulito}"] = {'type': 'md', 'content': markdown_text}
+        # Analizzato una sola volta per contenuto (uploads.py): qui resta solo un riferimento
+        caricamento = carica_upload(uploaded_file)
+        nome_file = caricamento.nome.rsplit('.', 1)[0]
+        nome_pulito = nome_file.replace('_', ' ').title()
+        if caricamento.tipo == 'md':
+            cheatsheet_map[f"📤 {nome_pulito}"] = caricamento
             st.sidebar.success("✅ Markdown caricato con successo!")
         else:
-            # Leggi il file caricato
-            uploaded_df = pd.read_csv(uploaded_file, encoding='utf-8-sig', sep=',')
-            uploaded_df.columns = [c.strip().replace('\ufeff', '') for c in uploaded_df.columns]
-            
-            # Valida le colonne richieste
-            colonne_richieste = ['domanda', 'opzioneA', 'opzioneB', 'opzioneC', 'soluzione']
-            if all(col in uploaded_df.columns for col in colonne_richieste):
-                nome_file = uploaded_name.replace('.csv', '')
-                nome_pulito = nome_file.replace('_', ' ').title()
-                quiz_map[f"📤 {nome_pulito}"] = uploaded_df
-                st.sidebar.success("✅ CSV caricato con successo!")
-            else:
-                st.sidebar.error(f"❌ Colonne mancanti. Richieste: {', '.join(colonne_richieste)}")
+            quiz_map[f"📤 {nome_pulito}"] = caricamento
+            st.sidebar.success("✅ CSV caricato con successo!")
+    except ValueError as e:
+        st.sidebar.error(f"❌ {e}")
     except Exception as e:
         st.sidebar.error(f"❌ Errore caricamento: {str(e)}")
 
 st.sidebar.markdown("---")
 
+# Banca virtuale con una sola copia di ogni domanda presente in più banche
+misure.fase('duplicati')
+deduplica = None
+if sum(1 for v in quiz_map.values() if isinstance(v, str)) > 1:
+    # Calcolata in un thread (dedup.py): la pagina non la aspetta mai
+    deduplica = deduplica_disponibile()
+    if deduplica is not None and (deduplica.alias or len(deduplica.gruppi) < len(deduplica.domande)):
+        quiz_map[BANCA_UNITA] = deduplica.banca_unita()
+# Risolta una volta per esecuzione e riassegnata al motore, come registra_evento;
+# finché la deduplica non è pronta ogni domanda è canonica di sé stessa
+canonica = deduplica.canonica if deduplica is not None else identica
+sessione.canonica = canonica
+
+def ripristina_selezioni(stato):
+    """Riporta sezione, quiz ed esame salvati, prima che i widget vengano creati."""
+    if stato.get('quiz_selection') not in quiz_map:
+        return
+    st.session_state.section_selection = "Quiz"
+    st.session_state.quiz_selection = stato['quiz_selection']
+    st.session_state.banche_combinate = [b for b in stato.get('banche_combinate', []) if b in quiz_map]
+    esame = stato.get('esame')
+    if esame:
+        st.session_state.modalita_esame = True
+        st.session_state.esame_seme_forzato = esame['seme']
+        st.session_state.esame_strati = esame['strati']
+        st.session_state.esame_pesi = esame['pesi']
+
+if 'ripristino' in st.session_state and sessione.banca is None:
+    ripristina_selezioni(st.session_state.ripristino)
+
+misure.fase('navigazione')
 if not quiz_map and not cheatsheet_map and readme_item is None:
     st.error("Nessun file CSV o MD trovato nella cartella!")
-    st.stop()
+    ferma()
 
 section_options = []
 if readme_item is not None:
@@ -196,6 +296,8 @@ if quiz_map:
     section_options.append("Quiz")
 if cheatsheet_map:
     section_options.append("Cheatsheets")
+if quiz_map:
+    section_options.append("Statistiche")
 
 selected_section = st.sidebar.radio(
     "Seleziona sezione:",
@@ -205,6 +307,10 @@ selected_section = st.sidebar.radio(
     key="section_selection"
 )
 
+def combina_tutte(etichette):
+    st.session_state.banche_combinate = list(etichette)
+    reset_quiz_state()
+
 scelta_utente = None
 file_selezionato = None
 if selected_section == "Home":
@@ -218,8 +324,36 @@ elif selected_section == "Quiz":
         key="quiz_selection"
     )
     file_selezionato = quiz_map[scelta_utente]
+
+    # Altre banche da unire a quella scelta in un'unica banca virtuale
+    altre_banche = [label for label in quiz_map if label not in (scelta_utente, BANCA_UNITA)]
+    if altre_banche:
+        if st.session_state.get('banche_combinate'):
+            st.session_state.banche_combinate = [
+                label for label in st.session_state.banche_combinate if label in altre_banche
+            ]
+        combinate = st.sidebar.multiselect(
+            "➕ Combina con:",
+            altre_banche,
+            on_change=reset_quiz_state,
+            key="banche_combinate"
+        )
+        st.sidebar.button(
+            "Tutte le banche",
+            use_container_width=True,
+            on_click=combina_tutte,
+            args=(altre_banche,)
+        )
+        if combinate:
+            scelta_utente = " + ".join([scelta_utente, *combinate])
+            file_selezionato = tuple(quiz_map[label] for label in [st.session_state.quiz_selection, *combinate])
+elif selected_section == "Statistiche":
+    scelta_utente = "Statistiche"
 else:
-    cheatsheet_categories = build_cheatsheet_categories(cheatsheet_map)
+    if any(label.startswith("📤 ") for label in cheatsheet_map):
+        cheatsheet_categories = build_cheatsheet_categories(cheatsheet_map)
+    else:
+        cheatsheet_categories = get_catalog().categorie()
     category_options = list(cheatsheet_categories.keys())
     selected_category = st.sidebar.selectbox(
         "Categoria Cheatsheets:",
@@ -241,30 +375,28 @@ else:
 
 # --- PRACTICE MODE TOGGLE ---
 st.sidebar.markdown("---")
-if st.session_state.wrong_answers or st.session_state.practice_mode:
-    if st.session_state.wrong_answers:
-        st.sidebar.write(f"❌ Risposte sbagliate: **{len(st.session_state.wrong_answers)}**")
+# Quante risposte sbagliate mostra la sidebar: se cambia serve un rerun completo
+st.session_state.errori_in_sidebar = len(sessione.errori)
+if sessione.errori or st.session_state.practice_mode:
+    if sessione.errori:
+        st.sidebar.write(f"❌ Risposte sbagliate: **{len(sessione.errori)}**")
     col1, col2 = st.sidebar.columns(2)
     with col1:
         # Toggle logic handles the rerun
         if st.button("🔄 Pratica" if not st.session_state.practice_mode else "⏸️ Esci Pratica", use_container_width=True):
+            # La banca (pratica o completa) viene reimpostata dal rerun
             st.session_state.practice_mode = not st.session_state.practice_mode
-            st.session_state.idx = 0
-            st.session_state.domanda_corrente = None
             reset_quiz_state()
             st.rerun()
     with col2:
         if st.button("🗑️ Cancella", use_container_width=True):
-            st.session_state.wrong_answers = []
-            st.session_state.practice_mode = False
+            reset_wrong_answers()
             st.rerun()
 
-@st.cache_data
+@cache_misurata(st.cache_data, 'load_markdown')
 def load_markdown(file_item):
-    """Carica il contenuto di un file Markdown locale o caricato."""
+    """Carica il contenuto di un file Markdown locale (gli upload passano da uploads.py)."""
     try:
-        if isinstance(file_item, dict) and file_item.get('type') == 'md':
-            return file_item.get('content', '')
         if isinstance(file_item, str):
             with open(file_item, 'r', encoding='utf-8') as f:
                 return f.read()
@@ -286,17 +418,136 @@ def load_markdown(file_item):
 
 
 def is_markdown_file(item):
-    if isinstance(item, dict) and item.get('type') == 'md':
-        return True
+    if isinstance(item, Caricamento):
+        return item.tipo == 'md'
     if isinstance(item, str) and item.lower().endswith('.md'):
         return True
     if hasattr(item, 'name') and isinstance(item.name, str) and item.name.lower().endswith('.md'):
         return True
     return False
 
+def tema_attivo():
+    """'light' o 'dark' dal tema scelto in Streamlit (o dalla configurazione); None se non è noto."""
+    tema = st.context.theme.type or st.get_option('theme.base')
+    return tema if tema in ('light', 'dark') else None
+
+def mostra_markdown(testo):
+    """Mostra Markdown già convertito in HTML lato server (vedi prerender.py), se possibile."""
+    if prerender_disponibile():
+        try:
+            st.html(html_markdown(testo, tema=tema_attivo()))
+            return
+        except Exception:
+            # Si ripiega su st.markdown, ma l'errore di rendering resta nel log
+            logging.getLogger(__name__).exception("Pre-render del cheatsheet non riuscito")
+    st.markdown(testo)
+
+
+def sposta_sezione(chiave, passo, totale):
+    st.session_state[chiave] = min(max(st.session_state.get(chiave, 0) + passo, 0), totale - 1)
+
+
+@st.fragment
+def mostra_sezioni(documento, chiave):
+    """Mostra un cheatsheet grande una sezione alla volta, con indice."""
+    parti = documento.parti
+    chiave_sezione = f"sezione_{chiave}"
+    if st.session_state.get(chiave_sezione, 0) >= len(parti):
+        st.session_state[chiave_sezione] = 0
+
+    with st.expander("📑 Indice"):
+        st.markdown('\n'.join(
+            f"{'    ' * livello}- {titolo}" for livello, titolo, _ in documento.indice()
+        ))
+
+    if st.toggle("📄 Mostra tutto il documento", key=f"tutto_{chiave}"):
+        mostra_markdown(documento.testo_completo())
+        return
+
+    col_prec, col_sel, col_succ = st.columns([1, 8, 1])
+    with col_sel:
+        scelta = st.selectbox(
+            "Sezione",
+            range(len(parti)),
+            format_func=lambda i: parti[i].titolo,
+            key=chiave_sezione,
+            label_visibility="collapsed"
+        )
+    with col_prec:
+        st.button("⬅️", key=f"prec_{chiave}", on_click=sposta_sezione,
+                  args=(chiave_sezione, -1, len(parti)), disabled=scelta == 0)
+    with col_succ:
+        st.button("➡️", key=f"succ_{chiave}", on_click=sposta_sezione,
+                  args=(chiave_sezione, 1, len(parti)), disabled=scelta == len(parti) - 1)
+
+    # Solo la sezione scelta arriva al browser
+    if scelta == 0 and documento.preambolo:
+        mostra_markdown(documento.preambolo)
+    mostra_markdown(parti[scelta].testo)
+
+# --- STATISTICHE PER DOMANDA ---
+# La pagina legge solo il rollup (analytics.py), mai il registro degli eventi
+
+def mostra_pagina_statistiche():
+    registro_eventi = get_event_log()
+    st.title("📈 Statistiche delle domande")
+    col1, col2 = st.columns([3, 1])
+    with col2:
+        if st.button("🔄 Aggiorna ora", use_container_width=True):
+            registro_eventi.aggrega()
+    rollup = registro_eventi.rollup
+    with col1:
+        if rollup.aggiornato:
+            st.caption(f"Aggiornate alle {time.strftime('%H:%M:%S', time.localtime(rollup.aggiornato))} · "
+                       f"{int(rollup.tentativi.sum())} risposte su {len(rollup)} domande")
+        else:
+            st.caption("Nessuna statistica ancora: le risposte vengono aggregate ogni 30 secondi.")
+
+    etichetta = st.selectbox("Banca:", list(quiz_map.keys()), key="statistiche_banca")
+    banca = load_data(quiz_map[etichetta])
+    if banca is None:
+        return
+    banca = banca_completa(banca)
+    domande = banca.domande
+    qids = qid_banca(banca, canonica)
+    tentativi, errore, ms, scelte = difficolta(rollup, qids)
+    # Le copie di una domanda duplicata condividono le statistiche: se ne mostra una
+    prime = np.zeros(len(qids), dtype=bool)
+    prime[np.unique(qids, return_index=True)[1]] = True
+    viste = (tentativi > 0) & prime
+
+    c1, c2, c3 = st.columns(3)
+    c1.metric("Domande con risposte", f"{int(viste.sum())}/{int(prime.sum())}")
+    c2.metric("Errore medio", f"{errore[viste].mean():.0%}" if viste.any() else "–")
+    c3.metric("Tempo medio", f"{ms[viste].mean() / 1000:.1f} s" if viste.any() else "–")
+
+    minimo = st.slider("Tentativi minimi", 1, 20, 3, key="statistiche_minimo")
+    candidati = np.flatnonzero((tentativi >= minimo) & prime)
+    ordine = candidati[np.lexsort((-tentativi[candidati], -errore[candidati]))][:50]
+    if not len(ordine):
+        st.info("Nessuna domanda con abbastanza risposte.")
+        return
+    lettere = "ABCD"
+    righe = {"Domanda": [], "Tentativi": [], "Errate": [], "Tempo medio (s)": [], "Errore più comune": []}
+    for i in ordine.tolist():
+        q = domande[i]
+        sbagliate = [(scelte[i, j], j) for j in range(len(q.opzioni)) if j != q.corretta]
+        n, j = max(sbagliate, default=(0, -1))
+        righe["Domanda"].append(q.testo)
+        righe["Tentativi"].append(int(tentativi[i]))
+        righe["Errate"].append(f"{errore[i]:.0%}")
+        righe["Tempo medio (s)"].append(round(float(ms[i]) / 1000, 1))
+        righe["Errore più comune"].append(f"{lettere[j]}) {q.opzioni[j]}" if n else "")
+    st.subheader("Le domande più difficili")
+    st.dataframe(righe, use_container_width=True, hide_index=True)
+
 # --- 4. CARICAMENTO DATI ---
 if is_markdown_file(file_selezionato):
-    markdown_content = load_markdown(file_selezionato)
+    misure.fase('markdown')
+    if isinstance(file_selezionato, Caricamento):
+        markdown_content = contenuto_caricato(file_selezionato) or ''
+    else:
+        markdown_content = load_markdown(file_selezionato)
     
     # 1. AGGIUNGI L'UI DEL PROGRESSO NELLA SIDEBAR
     st.sidebar.markdown("---")
@@ -407,33 +658,41 @@ if is_markdown_file(file_selezionato):
     
     st.title(scelta_utente)
     st.write("---")
-    st.markdown(markdown_content)
-    st.stop()
+    documento = sezioni_markdown(markdown_content)
+    if len(markdown_content) < SOGLIA_SEZIONI or len(documento.parti) < MIN_PARTI:
+        mostra_markdown(markdown_content)
+    else:
+        mostra_sezioni(documento, scelta_utente)
+    ferma()
+
+
+@cache_misurata(st.cache_resource(show_spinner=False), 'banca_condivisa')
+def banca_condivisa(percorso, mtime):
+    """Una sola copia immutabile di ogni banca per tutto il processo.
+
+    Un CSV mai compilato viene letto a blocchi: la prima domanda si mostra
+    subito e la banca cresce in background (bank.StreamingBank).
+    """
+    return load_bank(percorso, mtime=mtime, a_blocchi=True)
 
 
-@st.cache_data
 def load_data(filename):
     """
-    Carica un CSV di quiz in modo robusto.
-    Se filename è un DataFrame, lo restituisce direttamente.
+    Carica un quiz come QuestionBank compilata (vedi bank.py).
+    Se filename è già una banca (la banca unita) la restituisce direttamente, un
+    Caricamento viene risolto dalla cache degli upload;
+    una tupla di file/banche diventa una MultiBankView sulle banche condivise.
     """
     try:
-        # Se è già un DataFrame (caricato da file uploader), restituiscilo
-        if isinstance(filename, pd.DataFrame):
-            df = filename.copy()
-        else:
-            # Altrimenti carica da file
-            df = pd.read_csv(filename, encoding='utf-8-sig', sep=',')
-        
-        # Pulisce nomi colonne
-        df.columns = [c.strip().replace('\ufeff', '') for c in df.columns]
-        # NaN -> stringa vuota
-        df = df.fillna("")
-        # Forza stringhe
-        for col in ['opzioneA', 'opzioneB', 'opzioneC', 'opzioneD']:
-            if col in df.columns:
-                df[col] = df[col].astype(str)
-        return df
+        if isinstance(filename, tuple):
+            # Gli indici della vista unita richiedono banche complete
+            return MultiBankView(banca_completa(load_data(f)) for f in filename)
+        if isinstance(filename, Caricamento):
+            return contenuto_caricato(filename)
+        if isinstance(filename, QuestionBank):
+            return filename
+        # La banca è condivisa dal processo e riletta solo se il file cambia
+        return banca_condivisa(filename, get_catalog().mtime(filename))
     except Exception as e:
         st.error(f"Errore caricamento CSV: {e}")
         return None
@@ -441,15 +700,18 @@ def load_data(filename):
 
 def load_practice_data():
     """Carica i dati per la modalità pratica dalle risposte sbagliate."""
-    if st.session_state.wrong_answers:
-        df_practice = pd.DataFrame(st.session_state.wrong_answers)
-        if len(df_practice) > 0:
-            # Rimuovi la colonna original_index se esiste
-            if 'original_index' in df_practice.columns:
-                df_practice = df_practice.drop(columns=['original_index'])
-            return df_practice.sample(frac=1).reset_index(drop=True)
+    domande = [risolvi(rif) for rif in sessione.errori.riferimenti(canonica)]
+    domande = [d for d in domande if d is not None]
+    if domande:
+        return QuestionView(domande)
     return None
 
+if selected_section == "Statistiche":
+    misure.fase('statistiche')
+    mostra_pagina_statistiche()
+    ferma()
+
+misure.fase('load_data')
 if st.session_state.practice_mode:
     # Pratica modalità: usa solo risposte sbagliate
     df = load_practice_data()
@@ -461,139 +723,389 @@ else:
 
 if df is None:
     st.error(f"Errore nella lettura del file {file_selezionato}.")
-    st.stop()
+    ferma()
 
 # --- FIX APPLICATO QUI ---
+misure.fase('permutazione')
 # Abbiamo rimosso la logica che resettava le wrong_answers quando practice_mode era True
-if 'quiz_df' not in st.session_state or st.session_state.get('current_quiz_name') != scelta_utente or st.session_state.get('last_practice_mode') != st.session_state.practice_mode:
+if sessione.banca is None or st.session_state.get('current_quiz_name') != scelta_utente or st.session_state.get('last_practice_mode') != st.session_state.practice_mode:
     st.session_state.current_quiz_name = scelta_utente
     st.session_state.last_practice_mode = st.session_state.practice_mode
-    st.session_state.quiz_df = df.sample(frac=1).reset_index(drop=True)
-    st.session_state.idx = 0
-    reset_quiz_state()
-    st.session_state.domanda_corrente = None
+    # La sessione tiene solo la permutazione (int32) e il cursore; un esame in
+    # corso va ricomposto sulla nuova banca
+    sessione.imposta_banca(df, pratica=st.session_state.practice_mode)
     
     # !!! HO RIMOSSO QUESTE LINEE !!!
     # if st.session_state.practice_mode:
     #    reset_wrong_answers()
+    # I collegamenti "Approfondisci" si preparano in background dall'apertura del quiz
+    collegamenti_disponibili()
+else:
+    # Banca ancora in lettura: le domande arrivate entrano nella permutazione
+    sessione.estendi()
+
+non_valutabili = getattr(df, 'non_valutabili', ())
+if non_valutabili:
+    st.sidebar.warning(
+        f"⚠️ {len(non_valutabili)} domande con soluzione non riconosciuta "
+        f"(righe {elenco_righe(non_valutabili, 10)}): "
+        "le risposte non vengono conteggiate"
+    )
+
+if isinstance(df, StreamingBank) and not df.completa:
+    st.sidebar.caption(f"⏳ Caricamento del quiz: {len(df)} domande pronte…")
 
 colonne_richieste = ['domanda', 'opzioneA', 'opzioneB', 'opzioneC', 'soluzione']
-if not all(col in df.columns for col in colonne_richieste):
+banche_da_validare = df.banche if isinstance(df, MultiBankView) else [df]
+if any(
+    isinstance(b, (QuestionBank, StreamingBank)) and not all(col in b.columns for col in colonne_richieste)
+    for b in banche_da_validare
+):
     st.error(f"Il file {file_selezionato} non ha le colonne corrette (minimo: {colonne_richieste}).")
-    st.stop()
-
-ha_opzioneD = 'opzioneD' in df.columns
+    ferma()
 
 # --- 5. LOGICA QUIZ ---
+# Le transizioni sono del motore (engine.py): qui restano gli effetti sulla
+# pagina (avvisi, rerun) e la persistenza
 
-if 'domanda_corrente' not in st.session_state:
-    reset_quiz_state()
+def registra_evento(domanda, qid, scelta, esatta, ms):
+    """Risposte e salti verso registro eventi, archivio dei progressi e storico (in background)."""
+    get_event_log().registra(qid, SALTO if scelta is None else scelta, esatta, ms)
+    if scelta is None:
+        return
+    if 'registro' in st.session_state:
+        st.session_state.registro.risposta(qid, domanda.riferimento, esatta)
+    if 'storico' in st.session_state:
+        voce = st.session_state.storico.setdefault(qid_numerica(qid), [0, 0])
+        voce[0] += 1
+        voce[1] += int(esatta)
+
+# Riassegnata a ogni esecuzione: il motore chiama sempre la versione corrente
+sessione.registra = registra_evento
+
+def fine_domande():
+    """Nessuna domanda da mostrare: fine della pratica o del quiz."""
+    if sessione.esito == FINE_PRATICA:
+        st.success("🎉 Pratica finita! Torno alla modalità normale.")
+        st.session_state.practice_mode = False
+        st.rerun()
+    st.warning("Hai completato tutte le domande di questo quiz!")
+    ferma()
 
 def nuova_domanda():
-    if st.session_state.idx >= len(st.session_state.quiz_df):
-        st.warning("Hai completato tutte le domande di questo quiz!")
-        if st.session_state.practice_mode:
-             st.success("🎉 Pratica finita! Torno alla modalità normale.")
-             st.session_state.practice_mode = False
-             st.session_state.idx = 0
-             reset_quiz_state()
-             st.rerun()
-        st.stop()
-
-    row = st.session_state.quiz_df.iloc[st.session_state.idx]
-    st.session_state.idx += 1
-    
-    if ha_opzioneD:
-        opts = [row['opzioneA'], row['opzioneB'], row['opzioneC'], row['opzioneD']]
-    else:
-        opts = [row['opzioneA'], row['opzioneB'], row['opzioneC']]
-    
-    random.shuffle(opts)
-    
-    st.session_state.domanda_corrente = row
-    st.session_state.opzioni_mix = opts
-    st.session_state.selezione_utente = None
-    st.session_state.fase = 'selezione'
-
-def gestisci_click(risposta_cliccata):
-    st.session_state.selezione_utente = risposta_cliccata
-    st.session_state.fase = 'verificato'
-    if 'domande_risposte_totali' in st.session_state:
-        st.session_state.domande_risposte_totali += 1
-
-def track_wrong_answer():
-    """Traccia una risposta sbagliata aggiungendola alla lista."""
-    if str(st.session_state.selezione_utente).strip().lower() != str(corretta).strip().lower():
-        # Aggiungi solo se non è già stato tracciato per questa domanda
-        current_q_index = st.session_state.idx - 1
-        if current_q_index not in [item.get('original_index', -1) for item in st.session_state.wrong_answers]:
-            wrong_item = st.session_state.domanda_corrente.to_dict()
-            wrong_item['original_index'] = current_q_index
-            st.session_state.wrong_answers.append(wrong_item)
-        st.session_state.wrong_count += 1
-    else:
-        st.session_state.correct_count += 1
-
-def remove_correct_from_wrong_list():
-    """Rimuove una domanda dalla lista di risposte sbagliate se risposta correttamente."""
-    if (str(st.session_state.selezione_utente).strip().lower() == str(corretta).strip().lower() and st.session_state.practice_mode):        
-        # Trova e rimuovi la domanda corrente dalla lista di risposte sbagliate
-        current_q = st.session_state.domanda_corrente.to_dict()
-        st.session_state.wrong_answers = [
-            item for item in st.session_state.wrong_answers
-            if item.get('domanda') != current_q.get('domanda')
-        ]
-        st.session_state.correct_count += 1
-    elif st.session_state.practice_mode and st.session_state.selezione_utente != corretta:
-        st.session_state.wrong_count += 1
-
-def avanza_domanda_esame():
-    if st.session_state.domande_esame_fatte >= MAX_DOMANDE_ESAME:
-        st.session_state.punteggio = 0.0
-        st.session_state.domande_esame_fatte = 0
-        st.session_state.idx = 0
-        reset_quiz_state()
+    if sessione.nuova_domanda() is None:
+        fine_domande()
+
+def gestisci_click(indice_cliccato):
+    st.session_state.sessione.rispondi(indice_cliccato)
+
+def salva_sessione():
+    """Ultimo stato della sessione (quiz, contatori, esame), per riprenderlo al rientro."""
+    if 'registro' not in st.session_state:
+        return
+    esame = None
+    if sessione.in_esame:
+        esame = {
+            'seme': sessione.seme_esame,
+            'strati': st.session_state.get('esame_strati', "File"),
+            'pesi': st.session_state.get('esame_pesi', False),
+            'punteggio': sessione.punteggio,
+            'fatte': sessione.fatte,
+            'ordine': sessione.ordine.tolist(),
+            'qids': [sessione.banca.domande[pos].qid for pos in sessione.ordine.tolist()],
+        }
+    st.session_state.registro.stato({
+        'quiz': st.session_state.current_quiz_name,
+        'quiz_selection': st.session_state.get('quiz_selection'),
+        'banche_combinate': st.session_state.get('banche_combinate', []),
+        'corrette': sessione.corrette,
+        'sbagliate': sessione.sbagliate,
+        'viste': sessione.viste,
+        'esame': esame,
+    })
+
+def ricarica_domanda():
+    """Riesegue solo il fragment della domanda, o tutto lo script se la sidebar è cambiata."""
+    if len(sessione.errori) != st.session_state.get('errori_in_sidebar'):
+        st.rerun()
+    try:
+        st.rerun(scope="fragment")
+    except StreamlitAPIException:
+        # Il fragment è stato eseguito dentro un rerun completo
         st.rerun()
+
+def domande_esame():
+    """Lunghezza dell'esame in corso: MAX_DOMANDE_ESAME o meno se la banca è più piccola."""
+    return sessione.domande_esame if sessione.in_esame else MAX_DOMANDE_ESAME
+
+def prossima_domanda():
+    if sessione.avanti() is None:
+        if sessione.esito == ESAME_RICOMINCIATO:
+            st.rerun()
+        if sessione.esito == FINE_PRATICA:
+            st.session_state.practice_mode = False
+            st.success("✅ Hai completato la pratica delle risposte sbagliate!")
+            st.rerun()
+        fine_domande()
+    ricarica_domanda()
+
+def salta_domanda():
+    # Dopo l'ultima domanda d'esame saltata resta il riepilogo
+    if sessione.salta() is None and sessione.esito != FINE_ESAME:
+        fine_domande()
+    ricarica_domanda()
+
+def cambia_modalita_veloce():
+    """Passando al browser la domanda mostrata e non ancora risposta viene riproposta."""
+    st.session_state.sessione.riponi_domanda()
+
+# Domanda aperta dalla ricerca: si mostra subito, senza toccare la permutazione
+richiesta = st.session_state.pop('domanda_richiesta', None)
+if richiesta is not None and not st.session_state.practice_mode and load_data(richiesta[0]) is df and richiesta[1] < len(df):
+    sessione.mostra(richiesta[1])
+
+# ==============================
+# 8. MODALITÀ ESAME (stato e sidebar)
+# ==============================
+misure.fase('esame')
+
+if 'modalita_esame' not in st.session_state:
+    st.session_state.modalita_esame = False
+
+st.sidebar.markdown("---")
+st.session_state.modalita_esame = st.sidebar.checkbox(
+    "📝 Modalità ESAME (33 domande)",
+    value=st.session_state.modalita_esame
+)
+
+def nome_banca(sha):
+    """Etichetta nel menu dei quiz della banca con questo SHA, altrimenti il nome del file."""
+    banca = banca_per_sha(sha)
+    sorgente = getattr(banca, 'sorgente', None)
+    if sorgente is None:
+        return f"Banca {sha[:8]}"
+    etichette = {percorso: label for label, percorso in quiz_map.items() if isinstance(percorso, str)}
+    return etichette.get(sorgente, os.path.basename(str(sorgente)))
+
+def strati_con_nomi(banca, criterio):
+    """(strato di ogni domanda, nome di ogni strato): banca di origine o categoria del cheatsheet."""
+    domande = banca.domande
+    codici = {}
+    if criterio == "File":
+        nomi_banche = {sha: nome_banca(sha) for sha in {q.banca for q in domande}}
+        chiavi = (nomi_banche[q.banca] for q in domande)
+    elif criterio == "Categoria cheatsheet":
+        categoria_di = {
+            percorso: categoria
+            for categoria, voci in get_catalog().categorie().items()
+            for _, _, percorso in voci
+        }
+        collegamenti = get_collegamenti()
+        chiavi = (
+            next((categoria_di.get(c[0]) for c in collegamenti.per_domanda(q.qid)), None) or "Senza categoria"
+            for q in domande
+        )
+    else:
+        return None, []
+    strati = np.fromiter(
+        (codici.setdefault(k, len(codici)) for k in chiavi), dtype=np.int32, count=len(domande)
+    )
+    return strati, list(codici)
+
+def strati_correnti():
+    """Strati della composizione d'esame scelta, calcolati una volta per banca."""
+    banca = banca_completa(sessione.banca)
+    chiave = (st.session_state.get('current_quiz_name'), st.session_state.get('esame_strati', "File"), len(banca))
+    salvati = st.session_state.get('strati_correnti')
+    if salvati is None or salvati[0] != chiave:
+        salvati = (chiave, strati_con_nomi(banca, chiave[1]))
+        st.session_state.strati_correnti = salvati
+    return salvati[1]
+
+def storico_banca(qids):
+    """(tentativi, esatte) dell'utente per ogni qid numerica della banca."""
+    tentativi = np.zeros(len(qids))
+    esatte = np.zeros(len(qids))
+    storico = st.session_state.get('storico')
+    if storico:
+        chiavi = np.fromiter(storico.keys(), dtype=np.uint64, count=len(storico))
+        valori = np.array(list(storico.values()), dtype=np.float64)
+        ordine = np.argsort(chiavi)
+        chiavi, valori = chiavi[ordine], valori[ordine]
+        pos = np.minimum(np.searchsorted(chiavi, qids), len(chiavi) - 1)
+        trovata = chiavi[pos] == qids
+        tentativi[trovata] = valori[pos[trovata], 0]
+        esatte[trovata] = valori[pos[trovata], 1]
+    return tentativi, esatte
+
+def pesi_esame(banca):
+    """Pesi delle domande: lista degli errori più tasso d'errore storico (rollup degli eventi)."""
+    tentativi, errore, _, _ = difficolta(get_event_log().rollup, qid_banca(banca, canonica))
+    return pesi_da_errori(banca.domande, sessione.errori, canonica, tentativi, errore)
+
+def chiave_quota(nome):
+    return f"esame_quota_{st.session_state.get('current_quiz_name')}_{st.session_state.get('esame_strati', 'File')}_{nome}"
+
+def quote_esame(nomi):
+    """Quote scelte nella sidebar ({strato: numero}), None se restano quelle proporzionali."""
+    quote = {i: st.session_state.get(chiave_quota(nome)) for i, nome in enumerate(nomi)}
+    if not nomi or all(q is None for q in quote.values()):
+        return None
+    proporzionali = quote_proporzionali(dimensioni_strati(), MAX_DOMANDE_ESAME)
+    return {i: int(proporzionali[i] if q is None else q) for i, q in quote.items()}
+
+def dimensioni_strati():
+    strati, nomi = strati_correnti()
+    return np.bincount(strati, minlength=len(nomi)).tolist()
+
+def prepara_esame():
+    """Sostituisce la permutazione con le domande di un nuovo esame (seme riproducibile)."""
+    seme = st.session_state.pop('esame_seme_forzato', None)
+    if seme is None:
+        seme = random.randrange(1_000_000)
+    # Stesso seme, stesso esame: si compone sulla banca intera
+    banca = banca_completa(sessione.banca)
+    pesi = None
+    if st.session_state.get('esame_pesi'):
+        # Pesi congelati col seme: rigenerando lo stesso esame non contano gli
+        # errori fatti nel frattempo
+        chiave = (st.session_state.get('current_quiz_name'), len(banca), seme)
+        congelati = st.session_state.get('esame_pesi_congelati')
+        if congelati is not None and congelati[0] == chiave:
+            pesi = congelati[1]
+        else:
+            pesi = pesi_esame(banca)
+            st.session_state.esame_pesi_congelati = (chiave, pesi)
+    strati, nomi = strati_correnti()
+    ordine = genera_esame(
+        len(banca), MAX_DOMANDE_ESAME, seme, strati=strati, pesi=pesi, quote=quote_esame(nomi),
+    )
+    sessione.inizia_esame(ordine, seme)
+    st.session_state.esame_seme_richiesto = str(seme)
+
+def rigenera_esame():
+    """Le opzioni dell'esame sono cambiate: si ricompone da capo."""
+    st.session_state.sessione.ricomincia_esame()
+
+def rigenera_esame_da_seme():
+    try:
+        st.session_state.esame_seme_forzato = int(st.session_state.esame_seme_richiesto)
+    except ValueError:
         return
-    
-    st.session_state.risposta_gia_valutata = False
-    nuova_domanda()
-    st.rerun()
+    rigenera_esame()
 
-def salta_domanda_esame():
-    if 'domande_risposte_totali' in st.session_state:
-        st.session_state.domande_risposte_totali += 1
-        
-    if not st.session_state.salto_gia_contato:
-        st.session_state.domande_esame_fatte += 1
-        st.session_state.salto_gia_contato = True
-
-    st.session_state.risposta_gia_valutata = False
-    st.session_state.salto_gia_contato = False
-    nuova_domanda()
-    st.rerun()
-
-if st.session_state.domanda_corrente is None:
-    nuova_domanda()
-
-q = st.session_state.domanda_corrente
-opts = st.session_state.opzioni_mix
-
-# -- Calcolo risposta corretta --
-soluzione_raw = str(q['soluzione']).strip()
-mappa_lettere = {'A': 'opzioneA', 'B': 'opzioneB', 'C': 'opzioneC'}
-if ha_opzioneD:
-    mappa_lettere['D'] = 'opzioneD'
-
-if soluzione_raw.upper() in mappa_lettere:
-    colonna_target = mappa_lettere[soluzione_raw.upper()]
-    corretta = str(q[colonna_target]).strip()
-else:
-    corretta = soluzione_raw
+if st.session_state.modalita_esame:
+    if not sessione.in_esame:
+        prepara_esame()
+    with st.sidebar.expander("⚙️ Composizione esame"):
+        st.selectbox(
+            "Quote per argomento:",
+            ["File", "Categoria cheatsheet", "Nessuna"],
+            key="esame_strati",
+            on_change=rigenera_esame
+        )
+        strati, nomi = strati_correnti()
+        if nomi:
+            st.caption("Domande per argomento (tuoi tentativi · errori):")
+            tentativi, esatte = storico_banca(qid_banca(banca_completa(sessione.banca), canonica))
+            tentativi_strato = np.bincount(strati, weights=tentativi, minlength=len(nomi))
+            esatte_strato = np.bincount(strati, weights=esatte, minlength=len(nomi))
+            dimensioni = dimensioni_strati()
+            proporzionali = quote_proporzionali(dimensioni, MAX_DOMANDE_ESAME)
+            for i, nome in enumerate(nomi):
+                fatti = int(tentativi_strato[i])
+                errori = f"{1 - esatte_strato[i] / fatti:.0%}" if fatti else "–"
+                st.number_input(
+                    f"{nome} ({fatti} · {errori})",
+                    min_value=0, max_value=dimensioni[i], value=int(proporzionali[i]), step=1,
+                    key=chiave_quota(nome), on_change=rigenera_esame,
+                )
+            totale = sum(quote_esame(nomi).values())
+            if totale != MAX_DOMANDE_ESAME:
+                st.warning(f"Le quote danno {totale} domande invece di {MAX_DOMANDE_ESAME}.")
+        st.toggle(
+            "Più peso alle domande sbagliate e difficili",
+            key="esame_pesi",
+            on_change=rigenera_esame,
+            help="Le domande nella lista degli errori pesano di più; le altre in base al "
+                 "tasso d'errore storico, anche senza errori tuoi"
+        )
+        st.text_input(
+            "🎲 Seme",
+            key="esame_seme_richiesto",
+            on_change=rigenera_esame_da_seme,
+            help="Lo stesso seme, con le stesse opzioni, rigenera lo stesso esame. "
+                 "Con più peso alle sbagliate vale per l'ultimo esame generato, "
+                 "che conserva le sbagliate di allora"
+        )
+elif sessione.in_esame or sessione.ordine_normale is not None:
+    # Fine dell'esame: si riprende la permutazione completa da dove era rimasta
+    sessione.termina_esame()
+
+def ordine_esame(esame):
+    """Permutazione di un esame salvato, se la banca ha ancora le stesse domande in quelle posizioni."""
+    ordine, qids = esame.get('ordine'), esame.get('qids')
+    if not ordine or qids is None or len(ordine) != len(qids):
+        return None
+    domande = banca_completa(sessione.banca).domande
+    if any(pos >= len(domande) or domande[pos].qid != qid for pos, qid in zip(ordine, qids)):
+        return None
+    return np.asarray(ordine, dtype=np.int32)
+
+# Contatori salvati, applicati una volta sola quando il quiz è quello di allora
+ripristino = st.session_state.pop('ripristino', None)
+if ripristino and ripristino.get('quiz') == st.session_state.current_quiz_name:
+    sessione.corrette = ripristino['corrette']
+    sessione.sbagliate = ripristino['sbagliate']
+    sessione.viste = ripristino['viste']
+    esame = ripristino.get('esame')
+    ordine = ordine_esame(esame) if esame and sessione.in_esame else None
+    if ordine is not None:
+        # Si riprendono le domande salvate: col peso alle sbagliate il seme da
+        # solo non basta, le sbagliate possono essere cambiate nel frattempo
+        sessione.inizia_esame(ordine, esame['seme'])
+    if esame and sessione.seme_esame == esame['seme']:
+        # Stesso esame, si riprende dalla domanda successiva
+        sessione.punteggio = esame['punteggio']
+        sessione.fatte = esame['fatte']
+        sessione.idx = min(esame['fatte'], len(sessione.ordine))
+
+st.sidebar.toggle(
+    "⚡ Risposte nel browser",
+    key="modalita_veloce",
+    on_change=cambia_modalita_veloce,
+    help=f"Precarica {PREFETCH} domande e invia i risultati al server a lotti "
+         "(non con la ripetizione spaziata)"
+)
+sessione.srs = st.sidebar.toggle(
+    "🧠 Ripetizione spaziata",
+    key="modalita_srs",
+    help="Ripropone le domande sbagliate dopo poche risposte e quelle giuste "
+         "a intervalli crescenti (SM-2). Non usata in modalità esame"
+)
+if sessione.ripetizione_attiva and sessione.ripetizione is not None:
+    st.sidebar.caption(
+        f"🧠 In ripetizione: {len(sessione.ripetizione)} domande · "
+        f"nuove introdotte: {sessione.ripetizione.cursore}/{len(sessione.ordine)}"
+    )
+
+# Memoria propria della sessione (le banche condivise non sono contate): si
+# misura ogni RERUN_MEMORIA esecuzioni, a ogni esecuzione col pannello di debug
+misure.fase('memoria')
+st.session_state.reruns_memoria = st.session_state.get('reruns_memoria', 0) + 1
+if (
+    'sessione_kb' not in st.session_state
+    or st.session_state.reruns_memoria >= RERUN_MEMORIA
+    or st.query_params.get('debug') == '1'
+):
+    st.session_state.reruns_memoria = 0
+    st.session_state.sessione_kb = round(memoria_sessione(st.session_state) / 1024, 1)
+    misure.extra['sessione_kb'] = st.session_state.sessione_kb
+st.sidebar.caption(f"🧠 Memoria sessione: {st.session_state.sessione_kb:.1f} KB")
 
-motivazione = q['motivazione'] if 'motivazione' in df.columns else ""
 
 # --- 6. CSS STILE E COLORI ---
+misure.fase('rendering')
 css_style = """
 <style>
 div.stButton > button {
@@ -614,227 +1126,289 @@ st.markdown(css_style, unsafe_allow_html=True)
 
 st.title(f"🔄 Pratica - {scelta_utente}" if st.session_state.practice_mode else f"{scelta_utente}") 
 
-if 'quiz_df' in st.session_state and 'domande_risposte_totali' in st.session_state:
-    total_seen = st.session_state.domande_risposte_totali
-    total_questions = len(st.session_state.quiz_df)
-    correct = st.session_state.correct_count
-    wrong = st.session_state.wrong_count
-    skipped = total_seen - correct - wrong
+def mostra_statistiche():
+    """Intestazione con domande viste, giuste/sbagliate e voto stimato."""
+    if sessione.banca is not None:
+        total_seen = sessione.viste
+        total_questions = len(sessione.banca)
+        correct = sessione.corrette
+        wrong = sessione.sbagliate
     
-    # Calcola il voto stimato su 33
-    if total_seen > 0:
-        score_per_question = (correct - (wrong * 0.33)) / total_seen
-        estimated_grade = score_per_question * MAX_DOMANDE_ESAME
-    else:
-        estimated_grade = 0
+        # Voto atteso su 33: difficoltà storica delle domande della banca
+        # (rollup degli eventi) riscalata sulla bravura della sessione
+        estimated_grade = voto_stimato(
+            get_event_log().rollup,
+            qid_banca(sessione.banca, canonica),
+            correct, wrong, total_seen, n_domande=MAX_DOMANDE_ESAME,
+        ) or 0
     
-    col1, col2, col3 = st.columns(3)
-    with col1:
-        st.write(f"📚 Domande viste: **{total_seen}/{total_questions}**")
-    with col2:
-        st.write(f"✅ Giuste: **{correct}** | ❌ Sbagliate: **{wrong}**")
-    with col3:
-        st.write(f"📊 Voto stimato: **{estimated_grade:.2f}/33**")
+        col1, col2, col3 = st.columns(3)
+        with col1:
+            st.write(f"📚 Domande viste: **{total_seen}/{total_questions}**")
+        with col2:
+            st.write(f"✅ Giuste: **{correct}** | ❌ Sbagliate: **{wrong}**")
+        with col3:
+            st.write(f"📊 Voto stimato: **{estimated_grade:.2f}/33**")
+
+        if not st.session_state.practice_mode and st.toggle("🎲 Simula esame", key="simula_esame"):
+            mostra_simulazione(correct, wrong, total_seen)
+
+
+def mostra_simulazione(correct, wrong, total_seen):
+    """Distribuzione del punteggio su esami simulati (simulator.py) e probabilità di superarlo."""
+    banca = banca_completa(sessione.banca)
+    qids = qid_banca(banca, canonica)
+    tentativi, esatte = storico_banca(qids)
+    p = probabilita_esatte(get_event_log().rollup, qids, correct, wrong, total_seen)
+    if p is None:
+        if not tentativi.any():
+            st.caption("Rispondi a qualche domanda per simulare l'esame.")
+            return
+        p = np.full(len(qids), esatte.sum() / tentativi.sum())
+    strati, nomi = strati_correnti()
+    if strati is not None:
+        p = probabilita_argomenti(strati, p, tentativi, esatte)
+    p = probabilita_domande(p, tentativi, esatte)
+    pesi = None
+    if st.session_state.get('esame_pesi'):
+        pesi = pesi_esame(banca)
+    p_salto = (total_seen - correct - wrong) / total_seen if total_seen else 0.0
+    simulazione = simula_esami(
+        p, p_salto, n_esami=N_ESAMI_INTERATTIVI, n_domande=MAX_DOMANDE_ESAME,
+        seme=total_seen, strati=strati, pesi=pesi, quote=quote_esame(nomi),
+    )
+    basso, mediano, alto = simulazione.percentili()
+    col1, col2 = st.columns(2)
+    col1.metric("Probabilità di superare l'esame", f"{simulazione.p_superamento:.0%}")
+    col2.metric("Punteggio mediano", f"{mediano:.1f}/{simulazione.n_domande}")
+    st.caption(f"{len(simulazione):,} esami simulati · 90% dei punteggi tra {basso:.1f} e {alto:.1f}")
+    distribuzione = simulazione.distribuzione()
+    st.bar_chart(
+        {"Punteggio": list(distribuzione), "Esami": list(distribuzione.values())},
+        x="Punteggio", y="Esami", height=180,
+    )
 
-st.markdown(f"### {q['domanda']}")
 
-c1, c2 = st.columns(2)
+def mostra_fine_esame():
+    """Riepilogo e pulsante di ripartenza quando l'esame è terminato."""
+    if sessione.esame_finito:
+        st.markdown("---")
+        st.subheader("🏁 ESAME TERMINATO")
 
-# --- FUNZIONE DI RENDERING BOTTONI (CORRETTA) ---
-def render_button_with_feedback(option_text, key, col):
-    selezione = str(st.session_state.selezione_utente).strip()
-    val_opt = str(option_text).strip()
-    val_corr = str(corretta).strip()
-    
-    # 1. SE ABBIAMO GIÀ RISPOSTO -> MOSTRA HTML COLORATO
-    if st.session_state.fase == 'verificato':
-        if val_opt == val_corr:
-            # VERDE (Corretta)
-            border_c = "#28a745"
-            bg_c = "rgba(40, 167, 69, 0.2)"
-            text_c = "#155724"
-        elif val_opt == selezione:
-            # ROSSO (Sbagliata)
-            border_c = "#dc3545"
-            bg_c = "rgba(220, 53, 69, 0.2)"
-            text_c = "#721c24"
-        else:
-            # GRIGIO (Le altre)
-            border_c = "#e9ecef"
-            bg_c = "rgba(233, 236, 239, 0.4)"
-            text_c = "#6c757d"
-
-        col.markdown(f"""
-        <div style="
-            height: 85px; 
-            width: 100%; 
-            display: flex; 
-            align-items: center; 
-            justify-content: center; 
-            border: 2px solid {border_c}; 
-            background-color: {bg_c}; 
-            color: {text_c};
-            border-radius: 12px; 
-            font-weight: 600; 
-            font-size: 19px; 
-            margin-bottom: 10px;
-            padding: 5px;
-            text-align: center;
-            line-height: 1.2;
-        ">
-            {val_opt}
-        </div>
-        """, unsafe_allow_html=True)
+        st.metric("Punteggio Finale", round(sessione.punteggio, 2))
 
-    # 2. SE DOBBIAMO ANCORA RISPONDERE -> MOSTRA BOTTONE CLICCABILE
-    else:
-        # Se col è il modulo st, chiama direttamente st.button()
-        if isinstance(col, type(st)):
-            st.button(
-                option_text if option_text else "(vuoto)",
-                key=key,
-                use_container_width=True,
-                on_click=gestisci_click,
-                args=(option_text,)
-            )
+        if sessione.esame_superato:
+            st.success("✅ **ESAME SUPERATO**")
         else:
-            # Altrimenti usa col come context manager (per colonne)
-            with col:
-                st.button(
-                    option_text if option_text else "(vuoto)",
-                    key=key,
-                    use_container_width=True,
-                    on_click=gestisci_click,
-                    args=(option_text,)
-                )
+            st.error("❌ **ESAME NON SUPERATO**")
 
-# Rendering griglia
-q_idx = st.session_state.idx 
+        if st.button("🔄 Ricomincia Esame", use_container_width=True):
+            sessione.ricomincia_esame()
+            st.rerun()
 
-if ha_opzioneD:
-    render_button_with_feedback(opts[0], f"b0_{q_idx}", c1)
-    render_button_with_feedback(opts[1], f"b1_{q_idx}", c2)
-    render_button_with_feedback(opts[2], f"b2_{q_idx}", c1)
-    render_button_with_feedback(opts[3], f"b3_{q_idx}", c2)
-else:
-    render_button_with_feedback(opts[0], f"b0_{q_idx}", st)
-    render_button_with_feedback(opts[1], f"b1_{q_idx}", st)
-    render_button_with_feedback(opts[2], f"b2_{q_idx}", st)
 
-st.write("---")
+# La scheda della domanda (statistiche, opzioni, feedback, navigazione ed esame)
+# è un fragment: rispondere o passare alla domanda successiva riesegue solo
+# questa parte, non sidebar, catalogo e caricamento dati.
+@st.fragment
+@misurato('scheda_domanda')
+def scheda_domanda():
+    if sessione.esame_finito:
+        mostra_statistiche()
+        mostra_fine_esame()
+        return
+    if sessione.domanda is None:
+        nuova_domanda()
 
-# --- Feedback & Navigazione ---
+    q = sessione.domanda
+    opts = sessione.opzioni
 
-if st.session_state.fase == 'verificato':
-    sel_utente = str(st.session_state.selezione_utente).strip()
-    
-    # Traccia la risposta (solo una volta)
-    if not st.session_state.answer_already_counted:
-        if not st.session_state.practice_mode:
-            track_wrong_answer()
-        else:
-            remove_correct_from_wrong_list()
-        st.session_state.answer_already_counted = True
-    
+    # La risposta corretta è già risolta in q.corretta (indice in q.opzioni)
+    motivazione = q.motivazione
 
+    mostra_statistiche()
 
-    if st.button("PROSSIMA DOMANDA", type="primary", use_container_width=True):
-        st.session_state.answer_already_counted = False
-        if st.session_state.practice_mode:
-            # Se siamo in pratica, torna alla modalità normale quando finisci
-            if st.session_state.idx >= len(st.session_state.quiz_df):
-                st.session_state.practice_mode = False
-                st.session_state.idx = 0
-                reset_quiz_state()
-                st.success("✅ Hai completato la pratica delle risposte sbagliate!")
-                st.rerun()
-            else:
-                nuova_domanda()
-                st.rerun()
-        elif st.session_state.modalita_esame:
-            avanza_domanda_esame()
-        else:
-            nuova_domanda()
-            st.rerun()
-    if motivazione and str(motivazione) != "nan":
-        st.info(f"**Motivazione:**\n\n{motivazione}")
-elif st.session_state.fase == 'selezione':
-    if st.button("Salta Domanda", use_container_width=True):
-        if 'domande_risposte_totali' in st.session_state:
-            st.session_state.domande_risposte_totali += 1
-        if st.session_state.modalita_esame:
-            salta_domanda_esame()
-        else:
-            nuova_domanda()
-            st.rerun()
+    st.markdown(f"### {q.testo}")
 
-# ==============================
-# 8. MODALITÀ ESAME
-# ==============================
+    c1, c2 = st.columns(2)
 
-if 'modalita_esame' not in st.session_state:
-    st.session_state.modalita_esame = False
-if 'punteggio' not in st.session_state:
-    st.session_state.punteggio = 0.0
-if 'domande_esame_fatte' not in st.session_state:
-    st.session_state.domande_esame_fatte = 0
-if 'risposta_gia_valutata' not in st.session_state:
-    st.session_state.risposta_gia_valutata = False
-if 'salto_gia_contato' not in st.session_state:
-    st.session_state.salto_gia_contato = False
-if 'quiz_df' in st.session_state:
-    if 'domande_risposte_totali' not in st.session_state:
-        st.session_state.domande_risposte_totali = 0
+    # --- FUNZIONE DI RENDERING BOTTONI (CORRETTA) ---
+    def render_button_with_feedback(option_index, key, col):
+        val_opt = q.opzioni[option_index]
+    
+        # 1. SE ABBIAMO GIÀ RISPOSTO -> MOSTRA HTML COLORATO
+        if sessione.fase == VERIFICATO:
+            if option_index == q.corretta:
+                # VERDE (Corretta)
+                border_c = "#28a745"
+                bg_c = "rgba(40, 167, 69, 0.2)"
+                text_c = "#155724"
+            elif option_index == sessione.selezione:
+                # ROSSO (Sbagliata)
+                border_c = "#dc3545"
+                bg_c = "rgba(220, 53, 69, 0.2)"
+                text_c = "#721c24"
+            else:
+                # GRIGIO (Le altre)
+                border_c = "#e9ecef"
+                bg_c = "rgba(233, 236, 239, 0.4)"
+                text_c = "#6c757d"
+
+            col.markdown(f"""
+            <div style="
+                height: 85px; 
+                width: 100%; 
+                display: flex; 
+                align-items: center; 
+                justify-content: center; 
+                border: 2px solid {border_c}; 
+                background-color: {bg_c}; 
+                color: {text_c};
+                border-radius: 12px; 
+                font-weight: 600; 
+                font-size: 19px; 
+                margin-bottom: 10px;
+                padding: 5px;
+                text-align: center;
+                line-height: 1.2;
+            ">
+                {val_opt}
+            </div>
+            """, unsafe_allow_html=True)
+
+        # 2. SE DOBBIAMO ANCORA RISPONDERE -> MOSTRA BOTTONE CLICCABILE
+        else:
+            # Se col è il modulo st, chiama direttamente st.button()
+            if isinstance(col, type(st)):
+                st.button(
+                    val_opt if val_opt else "(vuoto)",
+                    key=key,
+                    use_container_width=True,
+                    on_click=gestisci_click,
+                    args=(option_index,)
+                )
+            else:
+                # Altrimenti usa col come context manager (per colonne)
+                with col:
+                    st.button(
+                        val_opt if val_opt else "(vuoto)",
+                        key=key,
+                        use_container_width=True,
+                        on_click=gestisci_click,
+                        args=(option_index,)
+                    )
+
+    # Rendering griglia
+    q_idx = sessione.idx
+
+    if q.ha_d:
+        render_button_with_feedback(opts[0], f"b0_{q_idx}", c1)
+        render_button_with_feedback(opts[1], f"b1_{q_idx}", c2)
+        render_button_with_feedback(opts[2], f"b2_{q_idx}", c1)
+        render_button_with_feedback(opts[3], f"b3_{q_idx}", c2)
+    else:
+        render_button_with_feedback(opts[0], f"b0_{q_idx}", st)
+        render_button_with_feedback(opts[1], f"b1_{q_idx}", st)
+        render_button_with_feedback(opts[2], f"b2_{q_idx}", st)
 
-st.sidebar.markdown("---")
-st.session_state.modalita_esame = st.sidebar.checkbox(
-    "📝 Modalità ESAME (33 domande)",
-    value=st.session_state.modalita_esame
-)
+    st.write("---")
 
-if st.session_state.modalita_esame:
-    st.write(
-        f"📊 **Domande:** {st.session_state.domande_esame_fatte}/{MAX_DOMANDE_ESAME} | "
-        f"🎯 **Punteggio:** {round(st.session_state.punteggio, 2)}"
-    )
+    # --- Feedback & Navigazione ---
+
+    if sessione.fase == VERIFICATO:
+        # La risposta è già stata contata dal motore nel callback del click
+        if not q.valutabile:
+            st.warning("⚠️ La soluzione di questa domanda nel CSV non corrisponde a nessuna opzione: "
+                       "la risposta non è stata conteggiata.")
+        if st.button("PROSSIMA DOMANDA", type="primary", use_container_width=True):
+            prossima_domanda()
+        if motivazione:
+            st.info(f"**Motivazione:**\n\n{motivazione}")
+        if not st.session_state.modalita_esame:
+            mostra_approfondimenti(q)
+    else:
+        if st.button("Salta Domanda", use_container_width=True):
+            salta_domanda()
+
+    if sessione.in_esame:
+        st.write(
+            f"📊 **Domande:** {sessione.fatte}/{domande_esame()} | "
+            f"🎯 **Punteggio:** {round(sessione.punteggio, 2)}"
+        )
+
+    mostra_fine_esame()
+    salva_sessione()
+
+# Sezioni di cheatsheet collegate alla domanda (linking.py)
+def mostra_approfondimenti(q):
+    etichette = {percorso: label for label, percorso in cheatsheet_map.items()}
+    # Mai calcolati qui: finché il thread di linking.py non ha finito non si mostra nulla
+    collegamenti = [c for c in collegamenti_disponibili().per_domanda(q.qid) if c[0] in etichette]
+    if not collegamenti:
+        return
+    st.caption("📖 Approfondisci")
+    for n, (percorso, titolo, parte, _) in enumerate(collegamenti):
+        etichetta = etichette[percorso]
+        titolo = titolo.strip('*# ') or etichetta
+        st.button(
+            f"📘 {etichetta} › {titolo}",
+            key=f"approfondisci_{n}",
+            use_container_width=True,
+            on_click=richiedi_salto,
+            args=('md', etichetta, percorso, parte)
+        )
+    if 'salto_richiesto' in st.session_state:
+        # Il cambio di sezione richiede il rerun di tutta l'app
+        st.rerun()
 
-# Calcolo Punteggio
-if (
-    st.session_state.modalita_esame
-    and st.session_state.fase == 'verificato'
-    and not st.session_state.risposta_gia_valutata
-):
+# Variante lato browser: il componente riceve le prossime PREFETCH domande della
+# permutazione e rimanda i risultati a lotti, applicati qui una sola volta.
+@st.fragment
+@misurato('scheda_veloce')
+def scheda_veloce():
+    chiave = f"quiz_client_{scelta_utente}_{st.session_state.practice_mode}_{st.session_state.modalita_esame}"
+    esito = st.session_state.get(chiave)
+    if esito and esito['seq'] > st.session_state.get('lotto_applicato', 0):
+        st.session_state.lotto_applicato = esito['seq']
+        sessione.applica_risultati(esito['risultati'])
+        if len(sessione.errori) != st.session_state.get('errori_in_sidebar'):
+            st.rerun()
 
-    sel = str(st.session_state.selezione_utente).strip().lower()
-    corr = str(corretta).strip().lower()
+    mostra_statistiche()
+
+    fine = len(sessione.ordine)
+    if sessione.in_esame:
+        st.write(
+            f"📊 **Domande:** {sessione.fatte}/{domande_esame()} | "
+            f"🎯 **Punteggio:** {round(sessione.punteggio, 2)}"
+        )
+        mancanti = domande_esame() - sessione.fatte
+        fine = min(fine, sessione.idx + max(mancanti, 0))
+
+    inizio = sessione.idx
+    if inizio >= len(sessione.ordine):
+        if sessione.pratica:
+            st.success("🎉 Pratica finita! Torno alla modalità normale.")
+            sessione.esci_pratica()
+            st.session_state.practice_mode = False
+            st.rerun()
+        st.warning("Hai completato tutte le domande di questo quiz!")
 
-    if sel == corr:
-        st.session_state.punteggio += 1
-    else:
-        st.session_state.punteggio -= 0.33
+    ordine = sessione.ordine
+    banca = sessione.banca
+    domande = prepara_domande(
+        (pos, banca.domande[ordine[pos]]) for pos in range(inizio, min(inizio + PREFETCH, fine))
+    )
+    if domande:
+        quiz_client(domande, st.session_state.get('lotto_applicato', 0), key=chiave)
 
-    st.session_state.domande_esame_fatte += 1
-    st.session_state.risposta_gia_valutata = True
-    
-# Fine Esame
-if (
-    st.session_state.modalita_esame
-    and st.session_state.domande_esame_fatte >= MAX_DOMANDE_ESAME
-):
-    st.markdown("---")
-    st.subheader("🏁 ESAME TERMINATO")
+    mostra_fine_esame()
+    salva_sessione()
 
-    punteggio_finale = round(st.session_state.punteggio, 2)
-    st.metric("Punteggio Finale", punteggio_finale)
 
-    if punteggio_finale >= 18:
-        st.success("✅ **ESAME SUPERATO**")
-    else:
-        st.error("❌ **ESAME NON SUPERATO**")
+if st.session_state.get('modalita_veloce') and not sessione.ripetizione_attiva:
+    scheda_veloce()
+else:
+    scheda_domanda()
 
-    if st.button("🔄 Ricomincia Esame", use_container_width=True):
-        st.session_state.punteggio = 0.0
-        st.session_state.domande_esame_fatte = 0
-        st.session_state.idx = 0
-        reset_quiz_state()
-        st.rerun()
+registra_misure(misure)
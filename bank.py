@@ -0,0 +1,575 @@
+"""Banche di domande compilate in un formato colonnare binario.
+
+Ogni CSV di csv/ viene compilato una volta in un artefatto `.qbank` salvato in
+.cache/banks/ e identificato dallo SHA-256 del contenuto. L'artefatto viene poi
+aperto con mmap: caricare una banca costa pochi millisecondi e non richiede
+pandas.
+
+Un CSV mai compilato può anche essere letto a blocchi (`load_bank_stream`):
+il testo viene decodificato man mano, la prima domanda è disponibile dopo il
+primo blocco e la banca cresce in background finché l'artefatto non è pronto.
+
+Formato (little endian):
+    header   '<4sHHII'  magic, versione, n_colonne, n_righe, lunghezza nomi
+    nomi     nomi delle colonne in UTF-8 separati da '\\0' (padding a 4 byte)
+    offsets  uint32 * (n_righe * n_colonne + 1), celle in ordine per riga
+    blob     testo UTF-8 di tutte le celle concatenate
+
+Uso offline:  python bank.py csv/*.csv
+"""
+import codecs
+import csv
+import hashlib
+import io
+import mmap
+import os
+import struct
+import sys
+import threading
+from array import array
+from bisect import bisect_right
+from collections.abc import Sequence
+from itertools import accumulate, islice
+
+MAGIC = b'QBNK'
+VERSIONE_FORMATO = 1
+CARTELLA_CACHE = os.path.join('.cache', 'banks')
+
+_HEADER = struct.Struct('<4sHHII')
+# Righe lette prima di restituire una StreamingBank e poi per ogni blocco
+PRIMO_BLOCCO = 200
+RIGHE_PER_BLOCCO = 5000
+# Byte iniziali su cui si sceglie la codifica di un CSV
+PREFISSO_CODIFICA = 1 << 16
+
+
+def _latin1(errore):
+    return errore.object[errore.start:errore.end].decode('latin-1'), errore.end
+
+
+codecs.register_error('bank-latin1', _latin1)
+
+
+def _testo_csv(dati):
+    """Testo dei byte di un CSV, decodificato man mano che si legge.
+
+    UTF-8 se lo è l'inizio del file (PREFISSO_CODIFICA byte), altrimenti
+    latin-1; un byte non UTF-8 più avanti vale come carattere latin-1.
+    """
+    try:
+        codecs.getincrementaldecoder('utf-8')().decode(bytes(dati[:PREFISSO_CODIFICA]))
+        codifica = 'utf-8-sig'
+    except UnicodeDecodeError:
+        codifica = 'latin-1'
+    return io.TextIOWrapper(io.BytesIO(dati), encoding=codifica, errors='bank-latin1', newline='')
+
+
+def _lettore_csv(dati):
+    """(colonne, iteratore delle righe pulite) dei byte di un CSV."""
+    reader = csv.reader(_testo_csv(dati))
+    try:
+        intestazione = next(reader)
+    except StopIteration:
+        return [], iter(())
+    colonne = [c.strip().replace('\ufeff', '') for c in intestazione]
+    n = len(colonne)
+
+    def righe():
+        for riga in reader:
+            if not riga:
+                continue
+            if len(riga) < n:
+                riga = riga + [''] * (n - len(riga))
+            yield riga[:n]
+
+    return colonne, righe()
+
+
+def leggi_csv(dati):
+    """Legge i byte di un CSV e restituisce (colonne, righe) come stringhe.
+
+    Stessa pulizia di load_data: nomi colonne senza spazi/BOM, celle mancanti
+    come stringa vuota.
+    """
+    colonne, righe = _lettore_csv(dati)
+    return colonne, list(righe)
+
+
+def serializza(colonne, righe):
+    """Costruisce i byte dell'artefatto a partire da colonne e righe."""
+    nomi = '\0'.join(colonne).encode('utf-8')
+    nomi += b'\0' * (-len(nomi) % 4)
+
+    offsets = array('I', [0])
+    blob = bytearray()
+    for riga in righe:
+        for cella in riga:
+            blob += cella.encode('utf-8')
+            offsets.append(len(blob))
+    if sys.byteorder != 'little':
+        offsets.byteswap()
+
+    header = _HEADER.pack(MAGIC, VERSIONE_FORMATO, len(colonne), len(righe), len(nomi))
+    return header + nomi + offsets.tobytes() + bytes(blob)
+
+
+COLONNE_OPZIONI = ('opzioneA', 'opzioneB', 'opzioneC', 'opzioneD')
+LETTERE = 'ABCD'
+
+
+def _normalizza(testo):
+    return ' '.join(testo.lower().split())
+
+
+def id_domanda(testo, opzioni):
+    """ID stabile di una domanda: hash del testo e delle opzioni normalizzati.
+
+    Le opzioni sono ordinate, quindi l'ID non dipende dalla lettera a cui
+    l'opzione è assegnata né dalla posizione della riga nel CSV.
+    """
+    contenuto = '\x1f'.join([_normalizza(testo)] + sorted(_normalizza(o) for o in opzioni))
+    return hashlib.blake2b(contenuto.encode('utf-8'), digest_size=8).hexdigest()
+
+
+class Question:
+    """Domanda immutabile con la risposta corretta già risolta.
+
+    `opzioni` contiene i testi normalizzati (strip) nell'ordine A, B, C[, D] e
+    `corretta` è l'indice dell'opzione giusta (-1 se la soluzione non
+    corrisponde a nessuna opzione): la correzione confronta indici, non testi.
+    Le domande con -1 non sono valutabili: vengono segnalate alla compilazione
+    e nella sidebar e le loro risposte non contano (engine.py).
+    """
+
+    __slots__ = ('qid', 'banca', 'riga', 'testo', 'opzioni', 'corretta', 'ha_d', 'motivazione')
+
+    def __init__(self, banca, riga, testo, opzioni, corretta, motivazione):
+        for nome, valore in (
+            ('qid', id_domanda(testo, opzioni)), ('banca', banca), ('riga', riga),
+            ('testo', testo), ('opzioni', tuple(opzioni)), ('corretta', corretta),
+            ('ha_d', len(opzioni) > 3), ('motivazione', motivazione),
+        ):
+            object.__setattr__(self, nome, valore)
+
+    def __setattr__(self, nome, valore):
+        raise AttributeError("Question è immutabile")
+
+    @property
+    def valutabile(self):
+        return self.corretta >= 0
+
+    def __repr__(self):
+        return f"Question(qid={self.qid}, testo={self.testo[:40]!r}, corretta={self.corretta})"
+
+    @property
+    def riferimento(self):
+        """Riferimento compatto (sha banca, riga) per ritrovare la domanda."""
+        return self.banca, self.riga
+
+    @classmethod
+    def da_riga(cls, banca, riga, valori):
+        """Costruisce la domanda da un dizionario {colonna: testo}."""
+        opzioni = [valori.get(c, '').strip() for c in COLONNE_OPZIONI[:3]]
+        if valori.get('opzioneD', '').strip():
+            opzioni.append(valori['opzioneD'].strip())
+
+        soluzione = valori.get('soluzione', '').strip()
+        if len(soluzione) == 1 and soluzione.upper() in LETTERE[:len(opzioni)]:
+            corretta = LETTERE.index(soluzione.upper())
+        else:
+            # Soluzione scritta per esteso: si cerca l'opzione con lo stesso testo
+            testi = [o.lower() for o in opzioni]
+            corretta = testi.index(soluzione.lower()) if soluzione.lower() in testi else -1
+
+        motivazione = valori.get('motivazione', '').strip()
+        if motivazione == 'nan':
+            motivazione = ''
+        return cls(banca, riga, valori.get('domanda', ''), opzioni, corretta, motivazione)
+
+
+class QuestionBank:
+    """Banca di domande immutabile, in memoria o su artefatto memory-mapped."""
+
+    def __init__(self, colonne, celle, offsets, sha=None, sorgente=None):
+        self.columns = list(colonne)
+        self.sha = sha
+        self.sorgente = sorgente
+        self._celle = celle        # buffer (mmap/bytes) con il testo UTF-8
+        self._offsets = offsets    # sequenza di offset nel buffer
+        self._n_col = len(self.columns)
+        self._indice_col = {c: i for i, c in enumerate(self.columns)}
+        self._n_righe = (len(offsets) - 1) // self._n_col if self._n_col else 0
+        self._domande = None
+        self._non_valutabili = None
+
+    @classmethod
+    def from_rows(cls, colonne, righe, sha=None, sorgente=None):
+        """Banca in memoria (es. domande della modalità pratica)."""
+        dati = serializza(colonne, righe)
+        return cls._da_buffer(dati, sha=sha, sorgente=sorgente)
+
+    @classmethod
+    def _da_buffer(cls, buffer, sha=None, sorgente=None):
+        magic, versione, n_col, n_righe, len_nomi = _HEADER.unpack_from(buffer, 0)
+        if magic != MAGIC or versione != VERSIONE_FORMATO:
+            raise ValueError("Artefatto banca non valido")
+        inizio = _HEADER.size
+        nomi = bytes(buffer[inizio:inizio + len_nomi]).rstrip(b'\0').decode('utf-8')
+        colonne = nomi.split('\0') if n_col else []
+        inizio += len_nomi
+        n_offsets = n_righe * n_col + 1
+        vista = memoryview(buffer)
+        offsets = vista[inizio:inizio + 4 * n_offsets].cast('I')
+        if sys.byteorder != 'little':
+            offsets = array('I', offsets)
+            offsets.byteswap()
+        celle = vista[inizio + 4 * n_offsets:]
+        return cls(colonne, celle, offsets, sha=sha, sorgente=sorgente)
+
+    def __len__(self):
+        return self._n_righe
+
+    def valore(self, riga, colonna):
+        """Testo della cella (riga, nome colonna)."""
+        k = riga * self._n_col + self._indice_col[colonna]
+        return str(self._celle[self._offsets[k]:self._offsets[k + 1]], 'utf-8')
+
+    @property
+    def domande(self):
+        """Tuple di Question, costruita una sola volta per banca."""
+        if self._domande is None:
+            self._domande = tuple(
+                Question.da_riga(self.sha, i, self.row(i)) for i in range(self._n_righe)
+            )
+        return self._domande
+
+    @property
+    def non_valutabili(self):
+        """Righe (da 0) la cui soluzione non corrisponde a nessuna opzione."""
+        if self._non_valutabili is None:
+            self._non_valutabili = non_valutabili(self.domande) if 'domanda' in self.columns else ()
+        return self._non_valutabili
+
+    def row(self, riga):
+        """Riga come dizionario {colonna: testo}."""
+        if not 0 <= riga < self._n_righe:
+            raise IndexError(riga)
+        base = riga * self._n_col
+        off = self._offsets
+        celle = self._celle
+        return {
+            c: str(celle[off[base + i]:off[base + i + 1]], 'utf-8')
+            for i, c in enumerate(self.columns)
+        }
+
+
+class QuestionView:
+    """Sequenza di Question già caricate, anche da banche diverse (es. pratica)."""
+
+    def __init__(self, domande):
+        self.domande = tuple(domande)
+
+    def __len__(self):
+        return len(self.domande)
+
+
+class MultiBankView:
+    """Più banche viste come una sola, senza copiarne le domande.
+
+    Tiene solo i riferimenti alle banche condivise e gli indici di inizio di
+    ciascuna: la domanda i-esima si trova con una ricerca binaria.
+    """
+
+    def __init__(self, banche):
+        self.banche = tuple(banche)
+        self._inizi = list(accumulate((len(b) for b in self.banche), initial=0))
+        self.domande = _DomandeConcatenate(self)
+
+    def __len__(self):
+        return self._inizi[-1]
+
+    def posizione(self, i):
+        """(indice della banca, riga nella banca) della domanda globale i."""
+        if not 0 <= i < len(self):
+            raise IndexError(i)
+        b = bisect_right(self._inizi, i) - 1
+        return b, i - self._inizi[b]
+
+
+class _DomandeConcatenate(Sequence):
+    __slots__ = ('_vista',)
+
+    def __init__(self, vista):
+        self._vista = vista
+
+    def __len__(self):
+        return len(self._vista)
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self[j] for j in range(*i.indices(len(self)))]
+        i = int(i)
+        if i < 0:
+            i += len(self)
+        b, riga = self._vista.posizione(i)
+        return self._vista.banche[b].domande[riga]
+
+
+def non_valutabili(domande):
+    """Posizioni delle domande con una soluzione che non corrisponde a nessuna opzione."""
+    return tuple(i for i, q in enumerate(domande) if q.corretta < 0)
+
+
+def elenco_righe(righe, massimo=20):
+    """Righe (da 0) come testo per i messaggi: numerate da 1, come la domanda nella banca."""
+    testo = ', '.join(str(r + 1) for r in righe[:massimo])
+    return testo + ('…' if len(righe) > massimo else '')
+
+
+def sha_contenuto(dati):
+    return hashlib.sha256(dati).hexdigest()
+
+
+def percorso_artefatto(sha, cartella=CARTELLA_CACHE):
+    return os.path.join(cartella, f"{sha}.qbank")
+
+
+def _scrivi_artefatto(sha, colonne, righe, cartella=CARTELLA_CACHE):
+    destinazione = percorso_artefatto(sha, cartella)
+    os.makedirs(cartella, exist_ok=True)
+    temporaneo = f"{destinazione}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(temporaneo, 'wb') as f:
+        f.write(serializza(colonne, righe))
+    os.replace(temporaneo, destinazione)
+
+
+def compila(dati, cartella=CARTELLA_CACHE):
+    """Compila i byte di un CSV nell'artefatto su disco; restituisce lo SHA."""
+    sha = sha_contenuto(dati)
+    if not os.path.exists(percorso_artefatto(sha, cartella)):
+        colonne, righe = leggi_csv(dati)
+        _scrivi_artefatto(sha, colonne, righe, cartella)
+    return sha
+
+
+def _apri_artefatto(sha, cartella=CARTELLA_CACHE, sorgente=None):
+    with open(percorso_artefatto(sha, cartella), 'rb') as f:
+        mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    return QuestionBank._da_buffer(mm, sha=sha, sorgente=sorgente)
+
+
+# Banche già aperte nel processo: per SHA e per percorso ({percorso: (mtime, sha)},
+# una voce per file); in lettura a blocchi per SHA
+_banche = {}
+_firme = {}
+_in_corso = {}
+_lock = threading.Lock()
+
+
+class StreamingBank:
+    """Banca letta a blocchi in un thread: le domande si usano man mano che arrivano.
+
+    Il primo blocco (PRIMO_BLOCCO righe) viene letto subito, il resto in
+    background. `domande` è una lista che cresce solo in coda e len() conta
+    le domande già pronte. A fine lettura l'artefatto viene compilato e
+    registrato come quello di load_bank_bytes, con le stesse Question: SHA e
+    righe coincidono, quindi i riferimenti restano validi.
+    """
+
+    def __init__(self, colonne, righe, sha, sorgente=None, cartella=CARTELLA_CACHE):
+        self.columns = list(colonne)
+        self.sha = sha
+        self.sorgente = sorgente
+        self.domande = []
+        self.errore = None
+        self._non_valutabili = []
+        self._righe = righe
+        self._lette = []
+        self._cartella = cartella
+        self._annullata = False
+        self._finita = threading.Event()
+        self._aggiungi(list(islice(righe, PRIMO_BLOCCO)))
+
+    def __len__(self):
+        return len(self.domande)
+
+    @property
+    def completa(self):
+        return self._finita.is_set()
+
+    @property
+    def non_valutabili(self):
+        """Come QuestionBank.non_valutabili, sulle righe già lette."""
+        return tuple(self._non_valutabili) if 'domanda' in self.columns else ()
+
+    def attendi(self, timeout=None):
+        """Aspetta la fine della lettura; restituisce se è finita."""
+        return self._finita.wait(timeout)
+
+    def annulla(self):
+        """Interrompe la lettura al prossimo blocco (es. colonne non valide)."""
+        self._annullata = True
+
+    def _avvia(self):
+        threading.Thread(target=self._leggi, name=f"bank-{self.sha[:8]}", daemon=True).start()
+
+    def _aggiungi(self, righe):
+        base = len(self._lette)
+        self._lette.extend(righe)
+        colonne = self.columns
+        nuove = [
+            Question.da_riga(self.sha, base + i, dict(zip(colonne, riga)))
+            for i, riga in enumerate(righe)
+        ]
+        self._non_valutabili.extend(base + i for i in non_valutabili(nuove))
+        # Una sola extend: chi legge in un altro thread vede il blocco intero o niente
+        self.domande.extend(nuove)
+
+    def _leggi(self):
+        try:
+            while not self._annullata:
+                blocco = list(islice(self._righe, RIGHE_PER_BLOCCO))
+                if not blocco:
+                    break
+                self._aggiungi(blocco)
+            if not self._annullata:
+                self._registra()
+        except Exception as e:
+            self.errore = e
+        finally:
+            self._righe = None
+            with _lock:
+                _in_corso.pop(self.sha, None)
+            self._finita.set()
+
+    def _registra(self):
+        try:
+            _scrivi_artefatto(self.sha, self.columns, self._lette, self._cartella)
+            banca = _apri_artefatto(self.sha, self._cartella, self.sorgente)
+        except OSError:
+            banca = QuestionBank.from_rows(self.columns, self._lette, sha=self.sha, sorgente=self.sorgente)
+        banca._domande = tuple(self.domande)
+        banca._non_valutabili = self.non_valutabili
+        self._lette = None
+        with _lock:
+            _banche.setdefault(self.sha, banca)
+
+
+def load_bank_stream(dati, sorgente=None, cartella=CARTELLA_CACHE):
+    """Come load_bank_bytes, ma un CSV mai compilato diventa una StreamingBank.
+
+    Restituisce dopo il primo blocco; se lo stesso contenuto è già in
+    lettura si riceve la stessa StreamingBank.
+    """
+    sha = sha_contenuto(dati)
+    with _lock:
+        banca = _banche.get(sha)
+        if banca is None:
+            banca = _in_corso.get(sha)
+    if banca is not None:
+        return banca
+    if os.path.exists(percorso_artefatto(sha, cartella)):
+        return load_bank_bytes(dati, sorgente=sorgente, cartella=cartella)
+    colonne, righe = _lettore_csv(dati)
+    banca = StreamingBank(colonne, righe, sha, sorgente=sorgente, cartella=cartella)
+    with _lock:
+        esistente = _in_corso.setdefault(sha, banca)
+    if esistente is banca:
+        banca._avvia()
+    return esistente
+
+
+def banca_completa(banca):
+    """La banca con tutte le righe: per una StreamingBank aspetta la fine della lettura."""
+    if isinstance(banca, StreamingBank):
+        banca.attendi()
+        if banca.errore is not None:
+            raise banca.errore
+    return banca
+
+
+def load_bank_bytes(dati, sorgente=None, cartella=CARTELLA_CACHE):
+    """Banca a partire dai byte di un CSV (file locale o upload)."""
+    sha = sha_contenuto(dati)
+    with _lock:
+        banca = _banche.get(sha)
+    if banca is not None:
+        return banca
+    try:
+        compila(dati, cartella)
+        banca = _apri_artefatto(sha, cartella, sorgente)
+    except OSError:
+        # Cartella cache non scrivibile: si resta in memoria
+        colonne, righe = leggi_csv(dati)
+        banca = QuestionBank.from_rows(colonne, righe, sha=sha, sorgente=sorgente)
+    if 'domanda' in banca.columns:
+        banca.domande
+    with _lock:
+        return _banche.setdefault(sha, banca)
+
+
+def banca_per_sha(sha, cartella=CARTELLA_CACHE):
+    """Banca già aperta, in lettura o in cache su disco con un certo SHA, None se assente."""
+    with _lock:
+        banca = _banche.get(sha)
+        if banca is None:
+            banca = _in_corso.get(sha)
+    if banca is None and sha and os.path.exists(percorso_artefatto(sha, cartella)):
+        banca = _apri_artefatto(sha, cartella)
+        with _lock:
+            banca = _banche.setdefault(sha, banca)
+    return banca
+
+
+def rilascia(sha):
+    """Toglie una banca dal registro del processo (l'artefatto resta su disco)."""
+    with _lock:
+        _banche.pop(sha, None)
+
+
+def risolvi(riferimento):
+    """Question a partire da un riferimento (sha banca, riga), None se non trovata."""
+    sha, riga = riferimento
+    banca = banca_per_sha(sha)
+    if banca is None or not 0 <= riga < len(banca):
+        return None
+    return banca.domande[riga]
+
+
+def load_bank(percorso, mtime=None, cartella=CARTELLA_CACHE, a_blocchi=False):
+    """Banca di un CSV locale; il file viene riletto solo se cambia mtime.
+
+    Con a_blocchi un CSV non ancora compilato arriva come StreamingBank.
+    """
+    if mtime is None:
+        mtime = os.stat(percorso).st_mtime_ns
+    with _lock:
+        firma = _firme.get(percorso)
+        banca = _banche.get(firma[1]) if firma and firma[0] == mtime else None
+    if banca is not None:
+        return banca
+    with open(percorso, 'rb') as f:
+        carica = load_bank_stream if a_blocchi else load_bank_bytes
+        banca = carica(f.read(), sorgente=percorso, cartella=cartella)
+    with _lock:
+        # La nuova versione del file sostituisce la vecchia: il registro non cresce con le modifiche
+        vecchia = _firme.get(percorso)
+        _firme[percorso] = (mtime, banca.sha)
+        if vecchia and vecchia[1] != banca.sha and all(sha != vecchia[1] for _, sha in _firme.values()):
+            # Anche la banca della versione precedente esce dal registro (l'artefatto resta su disco)
+            _banche.pop(vecchia[1], None)
+    return banca
+
+
+if __name__ == '__main__':
+    files = sys.argv[1:] or [
+        os.path.join('csv', f) for f in sorted(os.listdir('csv')) if f.endswith('.csv')
+    ]
+    for percorso in files:
+        with open(percorso, 'rb') as f:
+            sha = compila(f.read())
+        print(f"{percorso} -> {percorso_artefatto(sha)}")
+        righe = _apri_artefatto(sha).non_valutabili
+        if righe:
+            print(f"  ATTENZIONE: {len(righe)} domande con soluzione non riconosciuta, "
+                  f"righe {elenco_righe(righe)}")
@@ -0,0 +1,323 @@
+"""Benchmark riproducibili dei percorsi caldi dell'app.
+
+Per ogni scala (numero di domande) si crea in una cartella temporanea una
+banca e un cheatsheet sintetici, generati con seme fisso, e si misura in un
+processo separato (memoria di picco pulita):
+
+    micro    catalogo (get_lista_quiz), categorie dei cheatsheet, load_data a
+             freddo e a caldo, load_markdown, risposta sbagliata e risposta
+             esatta in pratica (track_wrong_answer e
+             remove_correct_from_wrong_list, oggi QuizSession.rispondi);
+    scenari  l'app vera con AppTest: apertura della banca, esame di 33
+             domande, modalità pratica, cheatsheet più grande; ogni misura è
+             la latenza di un rerun.
+
+Il risultato è un JSON con p50/p99/media in millisecondi per metrica e la
+memoria di picco (RSS) per scala. Con --confronta si mette a confronto con un
+JSON precedente (es. del commit base): le metriche con p50 peggiorato oltre
+SOGLIA_REGRESSIONE vengono elencate e l'uscita è 1.
+
+Uso:  python benchmark.py [--scale 1000,10000,100000] [--output risultati.json]
+                          [--ripetizioni 200] [--confronta base.json]
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+VERSIONE_RISULTATI = 1
+SCALE = (1000, 10_000, 100_000)
+RIPETIZIONI = 200
+SEME = 20240601
+# p50 nuovo / p50 base oltre cui una metrica è una regressione
+SOGLIA_REGRESSIONE = 1.2
+# Domande per sezione del cheatsheet sintetico
+DOMANDE_PER_SEZIONE = 50
+BANCA = 'Sintetica'
+CATEGORIA = 'BENCH'
+APP = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'app.py')
+
+
+# --- Dati sintetici ---
+
+def _vocabolario(rng, n=3000):
+    sillabe = ['ra', 'to', 'ne', 'ci', 'lo', 'mu', 'sa', 'pe', 'di', 'va', 'ro', 'te', 'ga', 'fi', 'zo']
+    return sorted({''.join(rng.choice(sillabe) for _ in range(rng.randint(2, 4))) for _ in range(n)})
+
+
+def _frase(rng, parole, n):
+    return ' '.join(rng.choice(parole) for _ in range(n))
+
+
+def genera_dati(cartella, n_domande, seme=SEME):
+    """Scrive csv/Sintetica.csv e md/BENCH/1_sintetico.md per n_domande."""
+    import csv
+
+    rng = random.Random(seme + n_domande)
+    parole = _vocabolario(rng)
+    os.makedirs(os.path.join(cartella, 'csv'), exist_ok=True)
+    os.makedirs(os.path.join(cartella, 'md', CATEGORIA), exist_ok=True)
+    with open(os.path.join(cartella, 'csv', f'{BANCA}.csv'), 'w', encoding='utf-8', newline='') as f:
+        scrittore = csv.writer(f)
+        scrittore.writerow(['domanda', 'opzioneA', 'opzioneB', 'opzioneC', 'opzioneD', 'soluzione', 'motivazione'])
+        for i in range(n_domande):
+            opzioni = [_frase(rng, parole, rng.randint(2, 6)) for _ in range(4)]
+            scrittore.writerow([
+                f"{_frase(rng, parole, rng.randint(8, 20))} ({i})?", *opzioni,
+                'ABCD'[rng.randrange(4)], _frase(rng, parole, 12),
+            ])
+    with open(os.path.join(cartella, 'md', CATEGORIA, '1_sintetico.md'), 'w', encoding='utf-8') as f:
+        f.write(f"# Cheatsheet sintetico\n\n{_frase(rng, parole, 40)}\n\n")
+        for s in range(max(n_domande // DOMANDE_PER_SEZIONE, 1)):
+            f.write(f"## Sezione {s} {_frase(rng, parole, 3)}\n\n")
+            for _ in range(3):
+                f.write(f"{_frase(rng, parole, 60)}\n\n")
+            f.write(f"- {_frase(rng, parole, 8)}\n- `{_frase(rng, parole, 2)}`\n\n")
+            if s % 5 == 0:
+                f.write(f"```python\nx = {s}\nprint(x * 2)\n```\n\n")
+
+
+# --- Misure ---
+
+def statistiche(durate_ns):
+    """{'n', 'p50_ms', 'p99_ms', 'media_ms'} di una lista di durate in ns."""
+    ms = np.asarray(durate_ns, dtype=np.float64) / 1e6
+    if not len(ms):
+        return {'n': 0, 'p50_ms': None, 'p99_ms': None, 'media_ms': None}
+    p50, p99 = np.percentile(ms, [50, 99])
+    return {'n': len(ms), 'p50_ms': round(float(p50), 4), 'p99_ms': round(float(p99), 4),
+            'media_ms': round(float(ms.mean()), 4)}
+
+
+def misura(funzione, ripetizioni):
+    durate = []
+    for _ in range(ripetizioni):
+        inizio = time.perf_counter_ns()
+        funzione()
+        durate.append(time.perf_counter_ns() - inizio)
+    return durate
+
+
+def rss_picco_mb():
+    """Memoria residente di picco del processo, in MB."""
+    import resource
+
+    picco = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux in KB, macOS in byte
+    return round(picco / (1024 * 1024 if sys.platform == 'darwin' else 1024), 1)
+
+
+def micro(ripetizioni):
+    """Micro-benchmark delle funzioni dei percorsi caldi (cartella corrente)."""
+    from bank import QuestionView, load_bank, risolvi
+    from catalog import build_cheatsheet_categories, get_catalog
+    from cheatsheet import sezioni_markdown
+    from engine import QuizSession
+
+    risultati = {}
+    catalogo = get_catalog()
+    risultati['get_lista_quiz'] = statistiche(misura(catalogo.snapshot, ripetizioni))
+    _, quizzes, cheatsheets = catalogo.snapshot()
+    risultati['build_cheatsheet_categories'] = statistiche(
+        misura(lambda: build_cheatsheet_categories(cheatsheets), ripetizioni)
+    )
+
+    percorso = quizzes[BANCA]
+    mtime = catalogo.mtime(percorso)
+    risultati['load_data_freddo'] = statistiche(misura(lambda: load_bank(percorso, mtime=mtime), 1))
+    risultati['load_data'] = statistiche(misura(lambda: load_bank(percorso, mtime=mtime), ripetizioni))
+
+    md = next(iter(cheatsheets.values()))
+
+    def load_markdown():
+        with open(md, 'r', encoding='utf-8') as f:
+            sezioni_markdown(f.read())
+
+    risultati['load_markdown_freddo'] = statistiche(misura(load_markdown, 1))
+    risultati['load_markdown'] = statistiche(misura(load_markdown, ripetizioni))
+
+    # Risposte sbagliate (aggiunta agli errori) e poi esatte in pratica (rimozione)
+    banca = load_bank(percorso, mtime=mtime)
+    sessione = QuizSession(seme=SEME)
+    sessione.imposta_banca(banca)
+    sbagliate = []
+    for _ in range(min(ripetizioni * 5, len(banca))):
+        domanda = sessione.nuova_domanda()
+        errata = (domanda.corretta + 1) % len(domanda.opzioni)
+        inizio = time.perf_counter_ns()
+        sessione.rispondi(errata, ms=0)
+        sbagliate.append(time.perf_counter_ns() - inizio)
+    risultati['track_wrong_answer'] = statistiche(sbagliate)
+
+    pratica = QuizSession(errori=sessione.errori, seme=SEME)
+    pratica.imposta_banca(QuestionView(risolvi(r) for r in sessione.errori.riferimenti()), pratica=True)
+    esatte = []
+    while pratica.nuova_domanda() is not None:
+        inizio = time.perf_counter_ns()
+        pratica.rispondi(pratica.domanda.corretta, ms=0)
+        esatte.append(time.perf_counter_ns() - inizio)
+    risultati['remove_correct_from_wrong_list'] = statistiche(esatte)
+    return risultati
+
+
+class _Scenario:
+    """AppTest con la latenza di ogni rerun registrata per nome di scenario."""
+
+    def __init__(self):
+        from streamlit.testing.v1 import AppTest
+
+        self.durate = {}
+        self.at = AppTest.from_file(APP, default_timeout=600)
+        self.at.query_params['utente'] = f"bench-{os.getpid()}"
+
+    def esegui(self, nome, elemento=None):
+        """Rerun (dell'elemento già modificato, o dell'app) cronometrato."""
+        inizio = time.perf_counter_ns()
+        (self.at if elemento is None else elemento).run()
+        self.durate.setdefault(nome, []).append(time.perf_counter_ns() - inizio)
+        if self.at.exception:
+            raise RuntimeError(f"{nome}: {self.at.exception[0].value}")
+
+    def bottone(self, testo):
+        return next(b for b in self.at.button if b.label == testo)
+
+    def opzione(self):
+        return next(b for b in self.at.button if b.key and b.key.startswith('b'))
+
+
+def scenari():
+    """Scenari end-to-end sull'app (cartella corrente)."""
+    s = _Scenario()
+    at = s.at
+    s.esegui('avvio')
+    s.esegui('apri_banca', at.sidebar.radio(key='section_selection').set_value('Quiz'))
+    s.esegui('apri_banca', at.sidebar.radio(key='quiz_selection').set_value(BANCA.title()))
+
+    s.esegui('esame_33', next(c for c in at.sidebar.checkbox if 'ESAME' in c.label).check())
+    for _ in range(33):
+        s.esegui('esame_33', s.opzione().click())
+        avanti = [b for b in at.button if b.label == 'PROSSIMA DOMANDA']
+        if not avanti:
+            break
+        s.esegui('esame_33', avanti[0].click())
+    s.esegui('esame_33', next(c for c in at.sidebar.checkbox if 'ESAME' in c.label).uncheck())
+
+    s.esegui('pratica', next(b for b in at.sidebar.button if 'Pratica' in b.label).click())
+    for _ in range(10):
+        s.esegui('pratica', s.opzione().click())
+        s.esegui('pratica', s.bottone('PROSSIMA DOMANDA').click())
+
+    s.esegui('cheatsheet', at.sidebar.radio(key='section_selection').set_value('Cheatsheets'))
+    s.esegui('cheatsheet', at.sidebar.selectbox(key='cheatsheet_category').set_value(CATEGORIA))
+    for tasto in at.button:
+        if tasto.key and tasto.key.startswith('succ_'):
+            s.esegui('cheatsheet', tasto.click())
+            break
+    return {nome: statistiche(durate) for nome, durate in s.durate.items()}
+
+
+def esegui_scala(n_domande, ripetizioni):
+    """Risultati di una scala, in un processo figlio con cartella di lavoro propria."""
+    cartella = tempfile.mkdtemp(prefix=f'bench-{n_domande}-')
+    try:
+        genera_dati(cartella, n_domande)
+        processo = subprocess.run(
+            [sys.executable, os.path.abspath(__file__), '--figlio', str(ripetizioni)],
+            cwd=cartella, capture_output=True, text=True,
+        )
+        if processo.returncode != 0:
+            raise RuntimeError(f"scala {n_domande}:\n{processo.stderr[-2000:]}")
+        return json.loads(processo.stdout.strip().splitlines()[-1])
+    finally:
+        shutil.rmtree(cartella, ignore_errors=True)
+
+
+def figlio(ripetizioni):
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    risultati = {'micro': micro(ripetizioni)}
+    risultati['rss_micro_mb'] = rss_picco_mb()
+    risultati['scenari'] = scenari()
+    risultati['rss_picco_mb'] = rss_picco_mb()
+    print(json.dumps(risultati))
+
+
+def _commit():
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'], cwd=os.path.dirname(APP),
+            capture_output=True, text=True, check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def confronta(nuovi, base, soglia=SOGLIA_REGRESSIONE):
+    """[(scala, metrica, p50 base, p50 nuovo)] delle metriche peggiorate oltre la soglia."""
+    regressioni = []
+    for scala, risultati in nuovi['scale'].items():
+        precedenti = base.get('scale', {}).get(scala)
+        if precedenti is None:
+            continue
+        for gruppo in ('micro', 'scenari'):
+            for metrica, valori in risultati[gruppo].items():
+                vecchi = precedenti.get(gruppo, {}).get(metrica)
+                if not vecchi or not vecchi['p50_ms'] or valori['p50_ms'] is None:
+                    continue
+                if valori['p50_ms'] > soglia * vecchi['p50_ms']:
+                    regressioni.append((scala, f"{gruppo}.{metrica}", vecchi['p50_ms'], valori['p50_ms']))
+    return regressioni
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark dei percorsi caldi dell'app")
+    parser.add_argument('--scale', default=','.join(map(str, SCALE)),
+                        help="numeri di domande separati da virgole")
+    parser.add_argument('--ripetizioni', type=int, default=RIPETIZIONI)
+    parser.add_argument('--output', help="file JSON dei risultati (altrimenti stdout)")
+    parser.add_argument('--confronta', help="JSON precedente con cui confrontare i p50")
+    parser.add_argument('--figlio', type=int, help=argparse.SUPPRESS)
+    argomenti = parser.parse_args()
+    if argomenti.figlio is not None:
+        figlio(argomenti.figlio)
+        return 0
+
+    risultati = {
+        'versione': VERSIONE_RISULTATI,
+        'commit': _commit(),
+        'python': platform.python_version(),
+        'piattaforma': platform.platform(),
+        'ripetizioni': argomenti.ripetizioni,
+        'scale': {},
+    }
+    for n in (int(x) for x in argomenti.scale.split(',') if x.strip()):
+        inizio = time.perf_counter()
+        risultati['scale'][str(n)] = esegui_scala(n, argomenti.ripetizioni)
+        print(f"{n} domande: {time.perf_counter() - inizio:.1f} s, "
+              f"RSS di picco {risultati['scale'][str(n)]['rss_picco_mb']} MB", file=sys.stderr)
+
+    testo = json.dumps(risultati, indent=2)
+    if argomenti.output:
+        with open(argomenti.output, 'w', encoding='utf-8') as f:
+            f.write(testo + '\n')
+    else:
+        print(testo)
+
+    if argomenti.confronta:
+        with open(argomenti.confronta, encoding='utf-8') as f:
+            regressioni = confronta(risultati, json.load(f))
+        for scala, metrica, prima, dopo in regressioni:
+            print(f"REGRESSIONE {scala} {metrica}: p50 {prima:.3f} -> {dopo:.3f} ms", file=sys.stderr)
+        return 1 if regressioni else 0
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
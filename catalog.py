@@ -0,0 +1,328 @@
+"""Catalogo dei contenuti locali (quiz in csv/ e cheatsheet in md/).
+
+Il catalogo viene costruito una sola volta per processo e condiviso da tutte
+le sessioni Streamlit: ad ogni rerun restituisce l'indice già in memoria e
+riscansiona solo le cartelle che risultano modificate (evento del watcher o
+mtime cambiato).
+"""
+import csv
+import os
+import re
+import threading
+import time
+from functools import lru_cache
+
+try:
+    from watchdog.events import FileSystemEventHandler
+    from watchdog.observers import Observer
+except ImportError:  # watchdog è opzionale: senza si usa il polling degli mtime
+    FileSystemEventHandler = object
+    Observer = None
+
+
+CSV_DIR = 'csv'
+MD_DIR = 'md'
+README = 'README.md'
+
+# Ogni quanti secondi (al massimo) controllare gli mtime quando manca il watcher
+INTERVALLO_POLLING = 2.0
+
+
+def crea_csv_esempio_se_mancano(csv_dir=CSV_DIR):
+    """Crea un file di test in csv/ se non ci sono quiz disponibili."""
+    os.makedirs(csv_dir, exist_ok=True)
+    files_csv = [f for f in os.listdir(csv_dir) if f.endswith('.csv')]
+
+    if not files_csv:
+        righe = [
+            ['domanda', 'opzioneA', 'opzioneB', 'opzioneC', 'opzioneD', 'soluzione', 'motivazione'],
+            ['Quanto fa 1+1?', '1', '2', '3', '4', 'B', 'Matematica base.'],
+            ['Il cielo è?', 'Verde', 'Blu', 'Giallo', 'Viola', 'B', 'Rayleigh scattering.'],
+        ]
+        with open(os.path.join(csv_dir, 'Quiz_Demo.csv'), 'w', encoding='utf-8', newline='') as f:
+            csv.writer(f).writerows(righe)
+
+
+@lru_cache(maxsize=4096)
+def parse_cheatsheet_category(label):
+    """Estrae categoria e ordine numerico da un nome di cheatsheet."""
+    if label.startswith("📤 "):
+        label = label[2:]
+    label = label.strip()
+    parts = label.split()
+    if not parts:
+        return "Other", 999, label
+
+    category = parts[0].upper()
+    order = None
+    if len(parts) > 1:
+        match = re.match(r'^(\d+)', parts[1])
+        if match:
+            order = int(match.group(1))
+
+    if order is None:
+        match = re.search(r'(\d+)', label)
+        if match:
+            order = int(match.group(1))
+
+    # Compute display
+    display = ' '.join(parts[1:]) if len(parts) > 1 else label
+    if display and display[0].isdigit():
+        space_index = display.find(' ')
+        if space_index != -1:
+            display = display[:space_index] + '. ' + display[space_index+1:]
+
+    return category, order if order is not None else 999, display
+
+
+def build_cheatsheet_categories(cheatsheet_map):
+    categories = {}
+    for label, item in cheatsheet_map.items():
+        category, order, display = parse_cheatsheet_category(label)
+        categories.setdefault(category, []).append((order, display, item))
+
+    for cat, items in categories.items():
+        items.sort(key=lambda x: (x[0], x[1]))
+        categories[cat] = items
+
+    return dict(sorted(categories.items(), key=lambda x: x[0]))
+
+
+class _GestoreEventi(FileSystemEventHandler):
+    """Inoltra gli eventi del watcher al catalogo come cartelle da riscansionare."""
+
+    def __init__(self, catalogo):
+        self.catalogo = catalogo
+
+    def on_any_event(self, event):
+        if event.event_type in ('opened', 'closed', 'closed_no_write'):
+            return
+        percorsi = [event.src_path, getattr(event, 'dest_path', '')]
+        for p in percorsi:
+            if p:
+                self.catalogo.invalida(os.fsdecode(p), event.is_directory)
+
+
+class ContentCatalog:
+    """Indice delle cartelle csv/ e md/ con aggiornamento incrementale.
+
+    Per ogni cartella si memorizzano mtime e file contenuti; una cartella viene
+    riletta solo se il watcher la segnala o se il suo mtime è cambiato. Le
+    mappe quiz/cheatsheet e le categorie sono ricalcolate solo quando
+    `versione` cambia.
+    """
+
+    def __init__(self, csv_dir=CSV_DIR, md_dir=MD_DIR, readme=README,
+                 intervallo_polling=INTERVALLO_POLLING, usa_watcher=True):
+        self.csv_dir = csv_dir
+        self.md_dir = md_dir
+        self.readme = readme
+        self.intervallo_polling = intervallo_polling
+
+        self._lock = threading.RLock()
+        self._cartelle = {}      # cartella -> (mtime_ns, [file], [sottocartelle])
+        self._file = {}          # percorso file -> mtime_ns
+        self._sporche = set()    # cartelle segnalate dal watcher
+        self._ultimo_controllo = 0.0
+        self._readme_presente = False
+        self._vista = None       # (readme, quizzes, cheatsheets)
+        self._categorie = None
+
+        self.versione = 0
+        self.stats = {'chiamate': 0, 'hit': 0, 'controlli': 0, 'scansioni_cartelle': 0, 'aggiornamenti': 0}
+
+        crea_csv_esempio_se_mancano(csv_dir)
+        os.makedirs(md_dir, exist_ok=True)
+        self._scansiona_albero(csv_dir, ricorsivo=False)
+        self._scansiona_albero(md_dir, ricorsivo=True)
+        self._readme_presente = os.path.exists(readme)
+        self._ultimo_controllo = time.monotonic()
+        self._observer = self._avvia_watcher() if usa_watcher else None
+
+    # --- scansione ---
+
+    def _scansiona_cartella(self, cartella):
+        """Rilegge una sola cartella; restituisce le sottocartelle trovate."""
+        self.stats['scansioni_cartelle'] += 1
+        try:
+            mtime = os.stat(cartella).st_mtime_ns
+            voci = list(os.scandir(cartella))
+        except FileNotFoundError:
+            self._rimuovi_cartella(cartella)
+            return []
+
+        vecchie = self._cartelle.get(cartella)
+        if vecchie:
+            for f in vecchie[1]:
+                self._file.pop(f, None)
+
+        files, sottocartelle = [], []
+        for voce in voci:
+            if voce.is_dir():
+                sottocartelle.append(voce.path)
+            elif voce.name.endswith(('.csv', '.md')):
+                files.append(voce.path)
+                self._file[voce.path] = voce.stat().st_mtime_ns
+        self._cartelle[cartella] = (mtime, files, sottocartelle)
+        return sottocartelle
+
+    def _scansiona_albero(self, cartella, ricorsivo):
+        da_visitare = [cartella]
+        while da_visitare:
+            corrente = da_visitare.pop()
+            nuove = self._scansiona_cartella(corrente)
+            if ricorsivo:
+                da_visitare.extend(s for s in nuove if s not in self._cartelle)
+
+    def _rimuovi_cartella(self, cartella):
+        voce = self._cartelle.pop(cartella, None)
+        if voce is None:
+            return
+        for f in voce[1]:
+            self._file.pop(f, None)
+        for s in voce[2]:
+            self._rimuovi_cartella(s)
+
+    def _aggiorna_cartella(self, cartella):
+        """Riscansiona una cartella già nota e propaga sottocartelle nuove/rimosse."""
+        prima = set(self._cartelle.get(cartella, (0, [], []))[2])
+        dopo = set(self._scansiona_cartella(cartella))
+        for rimossa in prima - dopo:
+            self._rimuovi_cartella(rimossa)
+        ricorsivo = cartella != self.csv_dir
+        for nuova in dopo - prima:
+            if ricorsivo:
+                self._scansiona_albero(nuova, ricorsivo=True)
+
+    # --- invalidazione ---
+
+    def _avvia_watcher(self):
+        if Observer is None:
+            return None
+        try:
+            observer = Observer()
+            gestore = _GestoreEventi(self)
+            observer.schedule(gestore, self.csv_dir, recursive=False)
+            observer.schedule(gestore, self.md_dir, recursive=True)
+            observer.schedule(gestore, os.path.dirname(os.path.abspath(self.readme)), recursive=False)
+            observer.daemon = True
+            observer.start()
+            return observer
+        except Exception:
+            return None
+
+    def invalida(self, percorso, is_directory=False):
+        """Segna come da riscansionare la cartella che contiene `percorso`."""
+        percorso = os.path.relpath(percorso) if os.path.isabs(percorso) else percorso
+        with self._lock:
+            if is_directory and percorso in self._cartelle:
+                self._sporche.add(percorso)
+            self._sporche.add(os.path.dirname(percorso) or '.')
+
+    def _controlla_modifiche(self):
+        """Restituisce True se qualcosa è cambiato rispetto all'indice in memoria."""
+        if self._observer is not None:
+            sporche, self._sporche = self._sporche, set()
+        else:
+            adesso = time.monotonic()
+            if adesso - self._ultimo_controllo < self.intervallo_polling:
+                return False
+            self._ultimo_controllo = adesso
+            self.stats['controlli'] += 1
+            sporche = set()
+            for cartella, (mtime, _, _) in list(self._cartelle.items()):
+                try:
+                    if os.stat(cartella).st_mtime_ns != mtime:
+                        sporche.add(cartella)
+                except FileNotFoundError:
+                    sporche.add(cartella)
+            for percorso, mtime in list(self._file.items()):
+                try:
+                    if os.stat(percorso).st_mtime_ns != mtime:
+                        sporche.add(os.path.dirname(percorso))
+                except FileNotFoundError:
+                    sporche.add(os.path.dirname(percorso))
+            sporche.add('.')
+
+        cambiato = False
+        if '.' in sporche or os.path.dirname(self.readme) in sporche:
+            presente = os.path.exists(self.readme)
+            cambiato = presente != self._readme_presente
+            self._readme_presente = presente
+        for cartella in sporche:
+            if cartella in self._cartelle:
+                prima = dict((f, self._file.get(f)) for f in self._cartelle[cartella][1])
+                self._aggiorna_cartella(cartella)
+                dopo = dict((f, self._file.get(f)) for f in self._cartelle.get(cartella, (0, [], []))[1])
+                cambiato = cambiato or prima != dopo
+        return cambiato
+
+    # --- API pubblica ---
+
+    def _costruisci_vista(self):
+        quizzes = {}
+        cheatsheets = {}
+        mtime_csv, files_csv, _ = self._cartelle.get(self.csv_dir, (0, [], []))
+        for path in sorted(files_csv):
+            f = os.path.basename(path)
+            if f.endswith('.csv'):
+                nome_pulito = f.replace('.csv', '').replace('_', ' ').title()
+                quizzes[nome_pulito] = os.path.join(self.csv_dir, f)
+
+        for cartella in sorted(c for c in self._cartelle if c == self.md_dir or c.startswith(self.md_dir + os.sep)):
+            rel_path = os.path.relpath(cartella, self.md_dir)
+            category = 'OTHER' if rel_path == '.' else rel_path.upper()
+            for path in sorted(self._cartelle[cartella][1]):
+                f = os.path.basename(path)
+                if f.endswith('.md'):
+                    nome_pulito = f.replace('.md', '').replace('_', ' ')
+                    cheatsheets[f"{category} {nome_pulito}"] = os.path.join(cartella, f)
+
+        readme_item = self.readme if self._readme_presente else None
+        return readme_item, quizzes, cheatsheets
+
+    def snapshot(self):
+        """Restituisce (readme, quizzes, cheatsheets) come faceva get_lista_quiz.
+
+        Le mappe sono copie: il chiamante può aggiungere gli upload della
+        sessione senza toccare l'indice condiviso.
+        """
+        with self._lock:
+            self.stats['chiamate'] += 1
+            if self._controlla_modifiche() or self._vista is None:
+                self.stats['aggiornamenti'] += 1
+                self.versione += 1
+                self._vista = self._costruisci_vista()
+                self._categorie = None
+            else:
+                self.stats['hit'] += 1
+            readme_item, quizzes, cheatsheets = self._vista
+            return readme_item, dict(quizzes), dict(cheatsheets)
+
+    def categorie(self):
+        """Categorie dei cheatsheet locali, ricalcolate solo a nuova versione."""
+        with self._lock:
+            if self._vista is None:
+                self.snapshot()
+            if self._categorie is None:
+                self._categorie = build_cheatsheet_categories(self._vista[2])
+            return self._categorie
+
+    def mtime(self, percorso):
+        """mtime (ns) noto al catalogo per un file, None se sconosciuto."""
+        return self._file.get(percorso)
+
+
+_cataloghi = {}
+_cataloghi_lock = threading.Lock()
+
+
+def get_catalog():
+    """Catalogo condiviso dal processo per la cartella di lavoro corrente."""
+    chiave = os.getcwd()
+    with _cataloghi_lock:
+        catalogo = _cataloghi.get(chiave)
+        if catalogo is None:
+            catalogo = ContentCatalog()
+            _cataloghi[chiave] = catalogo
+        return catalogo
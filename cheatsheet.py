@@ -0,0 +1,126 @@
+"""Divisione dei cheatsheet Markdown in sezioni per titolo.
+
+Il documento viene analizzato una sola volta per contenuto (chiave: SHA-256)
+in un albero di sezioni con indice; l'app mostra solo la sezione scelta
+invece dell'intero file.
+"""
+import hashlib
+import re
+import threading
+from collections import OrderedDict
+
+# Sotto questa dimensione (caratteri) il cheatsheet viene mostrato intero
+SOGLIA_SEZIONI = 15_000
+MAX_DOCUMENTI_IN_CACHE = 64
+# Numero minimo di parti perché valga la pena navigare per sezioni
+MIN_PARTI = 5
+
+_TITOLO = re.compile(r'^ {0,3}(#{1,6})[ \t]+(.*?)(?:[ \t]+#+)?[ \t]*$')
+_RECINTO = re.compile(r'^ {0,3}(`{3,}|~{3,})')
+
+
+class Sezione:
+    """Titolo Markdown con il testo che lo segue fino al titolo successivo."""
+
+    __slots__ = ('livello', 'titolo', 'testo')
+
+    def __init__(self, livello, titolo, testo):
+        self.livello = livello
+        self.titolo = titolo
+        self.testo = testo
+
+
+class Documento:
+    """Cheatsheet diviso in parti al livello di titolo più utile per navigare.
+
+    `sezioni` contiene tutti i titoli (per l'indice), `parti` solo quelli al
+    livello di taglio, ciascuno con il testo delle sue sottosezioni.
+    """
+
+    __slots__ = ('sha', 'preambolo', 'sezioni', 'parti', 'livello_taglio')
+
+    def __init__(self, sha, preambolo, sezioni):
+        self.sha = sha
+        self.preambolo = preambolo
+        self.sezioni = tuple(sezioni)
+        self.livello_taglio = _livello_taglio(self.sezioni)
+
+        parti = []
+        for s in self.sezioni:
+            if s.livello <= self.livello_taglio or not parti:
+                parti.append(Sezione(s.livello, s.titolo, s.testo))
+            else:
+                parti[-1].testo += '\n' + s.testo
+        self.parti = tuple(parti)
+
+    def testo_completo(self):
+        """Documento intero ricomposto dalle parti (modalità "mostra tutto")."""
+        return '\n\n'.join([self.preambolo] + [p.testo for p in self.parti])
+
+    def indice(self):
+        """Righe dell'indice: (livello relativo, titolo, indice della parte)."""
+        righe = []
+        parte = -1
+        minimo = min((s.livello for s in self.sezioni), default=1)
+        for s in self.sezioni:
+            if s.livello <= self.livello_taglio or parte < 0:
+                parte += 1
+            righe.append((s.livello - minimo, s.titolo, parte))
+        return righe
+
+
+def _livello_taglio(sezioni):
+    """Primo livello di titolo che divide il documento in almeno MIN_PARTI parti."""
+    for livello in range(1, 7):
+        if sum(1 for s in sezioni if s.livello <= livello) >= MIN_PARTI:
+            return livello
+    return max((s.livello for s in sezioni), default=1)
+
+
+def analizza(testo, sha=None):
+    """Divide il Markdown in preambolo e sezioni, ignorando i '#' nei blocchi di codice."""
+    preambolo = []
+    sezioni = []
+    corrente = preambolo
+    recinto = None
+    for riga in testo.splitlines():
+        m = _RECINTO.match(riga)
+        if m:
+            marcatore = m.group(1)
+            if recinto is None:
+                recinto = marcatore[0] * len(marcatore)
+            elif marcatore.startswith(recinto):
+                recinto = None
+        elif recinto is None:
+            m = _TITOLO.match(riga)
+            if m:
+                corrente = [riga]
+                sezioni.append((len(m.group(1)), m.group(2).strip(), corrente))
+                continue
+        corrente.append(riga)
+
+    return Documento(
+        sha,
+        '\n'.join(preambolo).strip(),
+        [Sezione(livello, titolo, '\n'.join(righe)) for livello, titolo, righe in sezioni],
+    )
+
+
+_documenti = OrderedDict()
+_lock = threading.Lock()
+
+
+def sezioni_markdown(testo):
+    """Documento analizzato, dalla cache LRU per SHA del contenuto."""
+    sha = hashlib.sha256(testo.encode('utf-8')).hexdigest()
+    with _lock:
+        doc = _documenti.get(sha)
+        if doc is not None:
+            _documenti.move_to_end(sha)
+            return doc
+    doc = analizza(testo, sha)
+    with _lock:
+        _documenti[sha] = doc
+        while len(_documenti) > MAX_DOCUMENTI_IN_CACHE:
+            _documenti.popitem(last=False)
+    return doc
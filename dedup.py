@@ -0,0 +1,292 @@
+"""Domande quasi duplicate tra banche diverse (MinHash + LSH).
+
+Ogni domanda viene ridotta a un insieme di shingle (terne di parole del testo
+e delle opzioni ordinate, normalizzati come per la ricerca) e poi a una firma
+MinHash di N_PERMUTAZIONI valori, calcolata per tutte le domande insieme con
+NumPy. Le firme vengono divise in BANDE: due domande sono candidate solo se
+coincidono in almeno una banda, quindi i confronti sono quasi lineari invece
+che quadratici. Le candidate diventano duplicati se la somiglianza stimata
+supera SOGLIA e la risposta corretta ha lo stesso testo.
+
+Ogni gruppo di duplicati ha una domanda canonica; `alias` porta la qid di
+ogni altra copia su quella canonica (risposte sbagliate e statistiche la
+usano), `banca_unita()` contiene solo le canoniche. L'app non aspetta mai il
+calcolo: `deduplica_disponibile()` lo avvia in un thread e fino al primo
+risultato ogni domanda è canonica di sé stessa.
+
+Uso batch:  python dedup.py [-o banca_unita.csv] [csv ...]
+"""
+import csv
+import hashlib
+import io
+import logging
+import os
+import re
+import sys
+import threading
+from itertools import combinations
+
+import numpy as np
+
+from bank import COLONNE_OPZIONI, LETTERE, load_bank, load_bank_bytes
+from catalog import get_catalog
+from search import tokenizza
+
+N_PERMUTAZIONI = 64
+BANDE = 16
+SOGLIA = 0.8
+SEME = 20240229
+# Shingle per blocco nel calcolo delle firme: 64 x 65536 uint64 = 32 MB al massimo
+BLOCCO_FIRME = 1 << 16
+
+# Permutazioni universali h(x) = (a*x + b) mod P su hash a 32 bit; con a < 2**31
+# il prodotto resta sotto 2**63 e il calcolo in uint64 non va in overflow
+_P = np.uint64(4294967291)
+_generatore = np.random.default_rng(SEME)
+_A = _generatore.integers(1, 2 ** 31, N_PERMUTAZIONI, dtype=np.uint64)
+_B = _generatore.integers(0, 2 ** 31, N_PERMUTAZIONI, dtype=np.uint64)
+
+_log = logging.getLogger(__name__)
+
+_NUMERAZIONE = re.compile(r'^\s*\d+\s*[.)]\s*|\(\d+\)\s*$')
+
+
+def shingle(domanda):
+    """Insieme di shingle (hash a 32 bit) di testo e opzioni di una domanda."""
+    parole = tokenizza(_NUMERAZIONE.sub('', domanda.testo))
+    for opzione in sorted(domanda.opzioni, key=str.lower):
+        parole.append('|')
+        parole.extend(tokenizza(opzione))
+    terne = {' '.join(parole[i:i + 3]) for i in range(max(1, len(parole) - 2))}
+    return np.array(
+        [int.from_bytes(hashlib.blake2b(t.encode('utf-8'), digest_size=4).digest(), 'little') for t in terne],
+        dtype=np.uint64,
+    )
+
+
+def firme_minhash(insiemi, blocco=BLOCCO_FIRME):
+    """Matrice (n_domande, N_PERMUTAZIONI) delle firme, con NumPy a blocchi di domande.
+
+    Ogni blocco materializza N_PERMUTAZIONI valori per shingle del blocco
+    (circa `blocco` shingle); della banca intera resta solo il minimo.
+    """
+    firme = np.empty((len(insiemi), N_PERMUTAZIONI), dtype=np.uint32)
+    inizio = 0
+    while inizio < len(insiemi):
+        fine, totale = inizio, 0
+        while fine < len(insiemi) and (fine == inizio or totale + len(insiemi[fine]) <= blocco):
+            totale += len(insiemi[fine])
+            fine += 1
+        parte = insiemi[inizio:fine]
+        tutti = np.concatenate(parte)
+        valori = (_A[:, None] * tutti[None, :] + _B[:, None]) % _P
+        inizi = np.concatenate(([0], np.cumsum([len(x) for x in parte])[:-1]))
+        firme[inizio:fine] = np.minimum.reduceat(valori, inizi, axis=1).T
+        inizio = fine
+    return firme
+
+
+def coppie_candidate(firme, bande=BANDE):
+    """Coppie (i, j) con almeno una banda di firma identica."""
+    n, k = firme.shape
+    righe = k // bande
+    coppie = set()
+    for b in range(bande):
+        banda = np.ascontiguousarray(firme[:, b * righe:(b + 1) * righe])
+        chiavi = banda.view(np.dtype((np.void, banda.dtype.itemsize * righe))).ravel()
+        _, gruppo, conteggi = np.unique(chiavi, return_inverse=True, return_counts=True)
+        # Solo le domande in bucket con almeno due membri, ordinate per bucket
+        # (stabile: indici crescenti dentro il bucket) e divise ai cambi di bucket
+        multiple = np.flatnonzero(conteggi[gruppo] > 1)
+        if not len(multiple):
+            continue
+        multiple = multiple[np.argsort(gruppo[multiple], kind='stable')]
+        confini = np.flatnonzero(np.diff(gruppo[multiple])) + 1
+        for membri in np.split(multiple, confini):
+            membri = membri.tolist()
+            if len(membri) <= 32:
+                coppie.update(combinations(membri, 2))
+            else:
+                # Gruppo enorme (testi quasi vuoti): solo le coppie con il primo, per restare lineari
+                coppie.update((membri[0], m) for m in membri[1:])
+    return coppie
+
+
+def _risposta(domanda):
+    if domanda.corretta < 0:
+        return None
+    return ' '.join(domanda.opzioni[domanda.corretta].lower().split())
+
+
+class Deduplica:
+    """Gruppi di duplicati, domande canoniche e mappa degli alias."""
+
+    def __init__(self, domande, gruppi):
+        self.domande = domande
+        self.gruppi = gruppi            # liste di indici in `domande`, canonica per prima
+        self.alias = {}                 # qid duplicata -> qid canonica
+        for gruppo in gruppi:
+            canonica = domande[gruppo[0]].qid
+            for i in gruppo[1:]:
+                if domande[i].qid != canonica:
+                    self.alias[domande[i].qid] = canonica
+        self._banca = None
+
+    def canonica(self, qid):
+        return self.alias.get(qid, qid)
+
+    def canoniche(self):
+        """Domande canoniche, nell'ordine delle banche."""
+        primo = {gruppo[0] for gruppo in self.gruppi}
+        return [q for i, q in enumerate(self.domande) if i in primo]
+
+    def banca_unita(self):
+        """Banca con le sole domande canoniche; la motivazione mancante è presa da una copia."""
+        if self._banca is None:
+            buffer = io.StringIO()
+            scrittore = csv.writer(buffer)
+            scrittore.writerow(['domanda', *COLONNE_OPZIONI, 'soluzione', 'motivazione'])
+            for gruppo in sorted(self.gruppi):
+                q = self.domande[gruppo[0]]
+                motivazione = next((self.domande[i].motivazione for i in gruppo if self.domande[i].motivazione), '')
+                opzioni = list(q.opzioni) + [''] * (4 - len(q.opzioni))
+                soluzione = LETTERE[q.corretta] if q.corretta >= 0 else ''
+                scrittore.writerow([q.testo, *opzioni, soluzione, motivazione])
+            self._banca = load_bank_bytes(buffer.getvalue().encode('utf-8'), sorgente='dedup')
+        return self._banca
+
+
+def deduplica(banche, soglia=SOGLIA):
+    """Raggruppa le domande quasi duplicate di più banche.
+
+    Due copie della stessa domanda con numerazione, punteggiatura e ordine
+    delle opzioni diversi hanno qid diverse ma finiscono nello stesso gruppo
+    (verifica: python -m doctest dedup.py):
+
+    >>> from types import SimpleNamespace
+    >>> from bank import Question
+    >>> a = Question('a', 0, 'Quale protocollo usa di default la porta 80 del server?', ['HTTP', 'FTP', 'SSH'], 0, '')
+    >>> b = Question('b', 0, '12) Quale protocollo usa, di default, la porta 80 del server', ['SSH', 'HTTP', 'FTP'], 1, '')
+    >>> a.qid != b.qid
+    True
+    >>> risultato = deduplica([SimpleNamespace(domande=[a]), SimpleNamespace(domande=[b])])
+    >>> risultato.gruppi, risultato.canonica(b.qid) == a.qid
+    ([[0, 1]], True)
+    """
+    domande = [q for banca in banche for q in banca.domande]
+    n = len(domande)
+    padre = list(range(n))
+
+    def radice(i):
+        while padre[i] != i:
+            padre[i] = padre[padre[i]]
+            i = padre[i]
+        return i
+
+    # Copie identiche (stessa qid) senza passare dalle firme
+    prima = {}
+    for i, q in enumerate(domande):
+        padre[i] = prima.setdefault(q.qid, i)
+
+    unici = [i for i in range(n) if padre[i] == i]
+    if unici:
+        firme = firme_minhash([shingle(domande[i]) for i in unici])
+        for a, b in coppie_candidate(firme):
+            i, j = unici[a], unici[b]
+            if _risposta(domande[i]) != _risposta(domande[j]):
+                continue
+            if np.count_nonzero(firme[a] == firme[b]) / N_PERMUTAZIONI < soglia:
+                continue
+            ri, rj = radice(i), radice(j)
+            if ri != rj:
+                padre[max(ri, rj)] = min(ri, rj)
+
+    gruppi = {}
+    for i in range(n):
+        gruppi.setdefault(radice(i), []).append(i)
+    # Canonica: la prima copia con motivazione, altrimenti la prima in ordine di banca
+    ordinati = []
+    for membri in gruppi.values():
+        canonica = next((i for i in membri if domande[i].motivazione), membri[0])
+        ordinati.append([canonica] + [i for i in membri if i != canonica])
+    return Deduplica(domande, ordinati)
+
+
+_corrente = (None, None)    # (firma del catalogo, Deduplica) dell'ultimo calcolo
+_calcolo_lock = threading.Lock()
+_thread = None
+_thread_lock = threading.Lock()
+
+
+def _firma_catalogo(catalogo):
+    _, quizzes, _ = catalogo.snapshot()
+    return tuple((p, catalogo.mtime(p)) for p in sorted(quizzes.values()))
+
+
+def _calcola(firma):
+    global _corrente
+    with _calcolo_lock:
+        if _corrente[0] != firma:
+            risultato = deduplica([load_bank(p, mtime=m) for p, m in firma])
+            if risultato.alias or len(risultato.gruppi) < len(risultato.domande):
+                risultato.banca_unita()
+            _corrente = (firma, risultato)
+        return _corrente[1]
+
+
+def _calcola_registrando(firma):
+    try:
+        _calcola(firma)
+    except Exception:
+        _log.exception("Ricerca dei duplicati non riuscita")
+
+
+def get_deduplica(catalogo=None):
+    """Deduplica delle banche del catalogo, ricalcolata solo se cambia un CSV (aspetta il calcolo)."""
+    return _calcola(_firma_catalogo(catalogo or get_catalog()))
+
+
+def deduplica_disponibile(catalogo=None):
+    """Deduplica senza attese, per le esecuzioni dello script.
+
+    Se il catalogo è cambiato (o non è mai stata calcolata) il calcolo parte
+    in un thread e intanto si restituisce l'ultima pronta, None la prima volta.
+    """
+    global _thread
+    firma = _firma_catalogo(catalogo or get_catalog())
+    pronta, risultato = _corrente
+    if pronta != firma:
+        with _thread_lock:
+            if _thread is None or not _thread.is_alive():
+                _thread = threading.Thread(
+                    target=_calcola_registrando, args=(firma,), name='dedup', daemon=True
+                )
+                _thread.start()
+    return risultato
+
+
+def identica(qid):
+    """Canonica quando la deduplica non è pronta: ogni domanda rappresenta sé stessa."""
+    return qid
+
+
+if __name__ == '__main__':
+    argomenti = sys.argv[1:]
+    uscita = None
+    if argomenti[:1] == ['-o']:
+        uscita, argomenti = argomenti[1], argomenti[2:]
+    files = argomenti or [
+        os.path.join('csv', f) for f in sorted(os.listdir('csv')) if f.endswith('.csv')
+    ]
+    risultato = deduplica([load_bank(p) for p in files])
+    duplicati = [g for g in risultato.gruppi if len(g) > 1]
+    print(f"{len(risultato.domande)} domande, {len(risultato.gruppi)} distinte, "
+          f"{len(duplicati)} gruppi di duplicati")
+    if uscita:
+        banca = risultato.banca_unita()
+        with open(uscita, 'w', encoding='utf-8', newline='') as f:
+            scrittore = csv.writer(f)
+            scrittore.writerow(banca.columns)
+            for i in range(len(banca)):
+                scrittore.writerow(list(banca.row(i).values()))
+        print(f"Banca unita -> {uscita}")
@@ -0,0 +1,400 @@
+"""Motore di una sessione di quiz, indipendente da Streamlit.
+
+QuizSession contiene tutto lo stato di una sessione (banca condivisa,
+permutazione e cursore, domanda corrente con le opzioni mescolate, contatori,
+pratica, esame, ripetizione spaziata) e le transizioni che l'app esegue a ogni
+click: mostrare la prossima domanda, rispondere, saltare, andare avanti,
+applicare un lotto di risposte date nel browser. L'app tiene in session_state
+un solo oggetto QuizSession, ne chiama i metodi dai callback e si limita a
+disegnarne lo stato.
+
+Gli effetti collaterali (registro eventi, archivio dei progressi) passano per
+la funzione opzionale `registra`: senza, il motore risponde a centinaia di
+migliaia di domande al secondo, per test, simulazioni di carico e analisi.
+
+Uso batch:  python engine.py [csv]   (risposte simulate al secondo)
+"""
+import random
+import time
+from itertools import permutations
+
+import numpy as np
+
+from progress import WrongAnswerStore
+from scheduler import SpacedRepetition
+
+# Fasi della domanda corrente
+SELEZIONE = 'selezione'
+VERIFICATO = 'verificato'
+
+# Regole dell'esame
+DOMANDE_ESAME = 33
+PUNTI_ESATTA = 1.0
+PENALITA_ERRORE = 0.33
+SOGLIA_SUPERAMENTO = 18
+
+# Perché nuova_domanda/avanti/salta non hanno una domanda da mostrare
+CONTINUA = 'continua'
+FINE_QUIZ = 'fine_quiz'
+FINE_PRATICA = 'fine_pratica'
+FINE_ESAME = 'fine_esame'
+ESAME_RICOMINCIATO = 'esame_ricominciato'
+
+# Ordini possibili delle opzioni (3 o 4): mescolarle è scegliere un indice
+_ORDINI = {n: [list(p) for p in permutations(range(n))] for n in range(1, 5)}
+
+
+class QuizSession:
+    """Stato e transizioni di una sessione di quiz.
+
+    `registra(domanda, qid, scelta, esatta, ms)` viene chiamata per ogni
+    risposta (scelta = indice originale dell'opzione) e per ogni salto
+    (scelta None); `canonica` porta la qid di una domanda su quella dei suoi
+    duplicati (vedi dedup.py).
+    """
+
+    __slots__ = (
+        'banca', 'ordine', 'idx', 'domanda', 'pos', 'opzioni', 'fase', 'selezione', 'mostrata_il',
+        'corrette', 'sbagliate', 'viste', 'pratica', 'srs', 'ripetizione',
+        'seme_esame', 'ordine_normale', 'punteggio', 'fatte', 'esito',
+        'errori', 'canonica', 'registra', '_rng',
+    )
+
+    def __init__(self, errori=None, canonica=None, registra=None, seme=None):
+        self.errori = WrongAnswerStore() if errori is None else errori
+        self.canonica = canonica
+        self.registra = registra
+        self._rng = random.Random(seme)
+        self.banca = None
+        self.ordine = np.zeros(0, dtype=np.int32)
+        self.idx = 0                    # prossima posizione della permutazione
+        self.pratica = False
+        self.srs = False
+        self.ripetizione = None         # SpacedRepetition, creata alla prima domanda
+        self.seme_esame = None          # None fuori dall'esame
+        self.ordine_normale = None      # (permutazione, cursore) da riprendere dopo l'esame
+        self.punteggio = 0.0
+        self.fatte = 0
+        self.esito = CONTINUA
+        self.azzera()
+
+    # --- Stato ---
+
+    def azzera(self):
+        """Nessuna domanda mostrata e contatori a zero (cambio di quiz o di sezione)."""
+        self.domanda = None
+        self.pos = None
+        self.opzioni = []
+        self.fase = SELEZIONE
+        self.selezione = None
+        self.mostrata_il = 0.0
+        self.viste = 0
+        self.corrette = 0
+        self.sbagliate = 0
+
+    def imposta_banca(self, banca, pratica=False, ordine=None):
+        """Nuova banca (o pratica sulle sbagliate): nuova permutazione, niente esame in corso."""
+        self.banca = banca
+        self.pratica = pratica
+        if ordine is None:
+            ordine = np.random.default_rng(self._rng.getrandbits(64)).permutation(len(banca))
+        self.ordine = np.asarray(ordine, dtype=np.int32)
+        self.idx = 0
+        self.ripetizione = None
+        self.seme_esame = None
+        self.ordine_normale = None
+        self.punteggio = 0.0
+        self.fatte = 0
+        self.azzera()
+
+    def estendi(self):
+        """Aggiunge alla permutazione le domande arrivate dopo (banca letta a blocchi).
+
+        Le nuove posizioni vengono mescolate con quelle non ancora estratte:
+        la parte ancora da fare resta una permutazione uniforme e quella già
+        fatta non cambia. In esame e in pratica la permutazione resta com'è.
+        """
+        if self.banca is None or self.pratica or self.ordine_normale is not None:
+            return
+        n, noti = len(self.banca), len(self.ordine)
+        if n <= noti:
+            return
+        inizio = self.idx if self.ripetizione is None else max(self.idx, self.ripetizione.cursore)
+        coda = np.concatenate([self.ordine[inizio:], np.arange(noti, n, dtype=np.int32)])
+        np.random.default_rng(self._rng.getrandbits(64)).shuffle(coda)
+        self.ordine = np.concatenate([self.ordine[:inizio], coda])
+
+    @property
+    def in_esame(self):
+        return self.seme_esame is not None
+
+    @property
+    def ripetizione_attiva(self):
+        """La ripetizione spaziata sceglie le domande (non in esame)."""
+        return self.srs and not self.in_esame
+
+    @property
+    def domande_esame(self):
+        """Lunghezza dell'esame in corso: DOMANDE_ESAME o meno se la banca è più piccola."""
+        return len(self.ordine) if self.in_esame else DOMANDE_ESAME
+
+    @property
+    def esame_finito(self):
+        return self.in_esame and self.fatte >= len(self.ordine)
+
+    @property
+    def esame_superato(self):
+        return round(self.punteggio, 2) >= SOGLIA_SUPERAMENTO
+
+    def qid(self, domanda):
+        return self.canonica(domanda.qid) if self.canonica is not None else domanda.qid
+
+    # --- Domande ---
+
+    def mostra(self, pos):
+        """Rende corrente la domanda in posizione `pos` della banca, con le opzioni mescolate."""
+        domanda = self.banca.domande[pos]
+        # Si mescolano gli indici delle opzioni, non i testi
+        ordini = _ORDINI.get(len(domanda.opzioni))
+        if ordini is None:
+            opzioni = list(range(len(domanda.opzioni)))
+            self._rng.shuffle(opzioni)
+        else:
+            opzioni = ordini[int(self._rng.random() * len(ordini))][:]
+        self.domanda = domanda
+        self.pos = pos
+        self.opzioni = opzioni
+        self.selezione = None
+        self.fase = SELEZIONE
+        self.mostrata_il = time.monotonic()
+        self.esito = CONTINUA
+        return domanda
+
+    def nuova_domanda(self):
+        """Mostra la prossima domanda; None (con `esito`) se non ce ne sono altre.
+
+        Finite le domande della pratica si torna alla modalità normale.
+        """
+        if self.idx >= len(self.ordine) and not getattr(self.banca, 'completa', True):
+            # Permutazione finita prima della lettura della banca: si aspetta il resto
+            self.banca.attendi()
+        if len(self.ordine) < len(self.banca):
+            self.estendi()
+        if self.ripetizione_attiva:
+            return self._nuova_ripetizione()
+        if self.idx >= len(self.ordine):
+            if self.pratica:
+                self.esci_pratica()
+                self.esito = FINE_PRATICA
+            else:
+                self.esito = FINE_QUIZ
+            return None
+        pos = int(self.ordine[self.idx])
+        self.idx += 1
+        return self.mostra(pos)
+
+    def _nuova_ripetizione(self):
+        if self.ripetizione is None:
+            # Le domande già viste in ordine normale non vengono riproposte come nuove
+            self.ripetizione = SpacedRepetition(cursore=self.idx)
+        if self.pos is not None and self.domanda is not None and self.fase == SELEZIONE:
+            self.ripetizione.salta(self.pos)
+        if self.pratica and not self.ripetizione.scaduta and not any(
+            self.errori.contiene(self.banca.domande[p].qid, self.canonica) for p in self.ordine.tolist()
+        ):
+            # Pratica finita: nessuna domanda è ancora sbagliata e nessuna ripetizione
+            # è scaduta (altrimenti si riproporrebbe all'infinito la più vicina)
+            pos = None
+        else:
+            pos = self.ripetizione.prossima(self.ordine)
+        if pos is None:
+            if self.pratica:
+                self.esci_pratica()
+                self.esito = FINE_PRATICA
+            else:
+                self.esito = FINE_QUIZ
+            return None
+        self.idx = self.ripetizione.cursore
+        return self.mostra(pos)
+
+    def riponi_domanda(self):
+        """La domanda mostrata e non ancora risposta tornerà alla prossima estrazione."""
+        if self.domanda is not None:
+            if self.fase == SELEZIONE:
+                self.idx = max(self.idx - 1, 0)
+            self.domanda = None
+            self.fase = SELEZIONE
+
+    def _latenza(self, ms):
+        if ms is None:
+            ms = (time.monotonic() - self.mostrata_il) * 1000
+        return max(int(ms), 0)
+
+    def rispondi(self, indice, ms=None):
+        """Risposta alla domanda corrente (indice originale dell'opzione).
+
+        Aggiorna contatori, lista degli errori, ripetizione spaziata e
+        punteggio d'esame, una sola volta per domanda. Restituisce se la
+        risposta è esatta, None se non c'era una domanda da rispondere.
+        """
+        domanda = self.domanda
+        if domanda is None or self.fase != SELEZIONE:
+            return None
+        esatta = indice == domanda.corretta
+        self.selezione = indice
+        self.fase = VERIFICATO
+        self.viste += 1
+        if not domanda.valutabile:
+            # Soluzione del CSV non riconosciuta (bank.py): la risposta non conta
+            if self.in_esame:
+                self.fatte += 1
+            return False
+        qid = self.qid(domanda)
+        if self.registra is not None:
+            self.registra(domanda, qid, indice, esatta, self._latenza(ms))
+
+        if self.pratica:
+            if esatta:
+                self.errori.rimuovi(domanda.qid, self.canonica)
+                self.corrette += 1
+            else:
+                self.sbagliate += 1
+        elif esatta:
+            self.corrette += 1
+        else:
+            # Aggiunta idempotente: si salva la qid della domanda, le copie contano una volta
+            self.errori.aggiungi(domanda, self.canonica)
+            self.sbagliate += 1
+
+        if self.ripetizione_attiva and self.ripetizione is not None and self.pos is not None:
+            self.ripetizione.registra(self.pos, esatta)
+        if self.in_esame:
+            self.punteggio += PUNTI_ESATTA if esatta else -PENALITA_ERRORE
+            self.fatte += 1
+        return esatta
+
+    def salta(self, ms=None):
+        """Salta la domanda corrente e mostra la prossima (None a fine esame o quiz)."""
+        domanda = self.domanda
+        if domanda is not None and self.registra is not None:
+            self.registra(domanda, self.qid(domanda), None, False, self._latenza(ms))
+        self.viste += 1
+        if self.in_esame:
+            self.fatte += 1
+            if self.esame_finito:
+                # Ultima domanda saltata: resta solo il riepilogo
+                self.domanda = None
+                self.esito = FINE_ESAME
+                return None
+        return self.nuova_domanda()
+
+    def avanti(self):
+        """'Prossima domanda' dopo una risposta.
+
+        Chiude la pratica quando le sbagliate sono finite (con la ripetizione
+        spaziata, quando sono state tutte corrette e nessuna ripetizione è
+        scaduta) e ricomincia l'esame se era già terminato; altrimenti mostra
+        la prossima domanda.
+        """
+        if self.pratica and self.idx >= len(self.ordine) and not self.ripetizione_attiva:
+            self.esci_pratica()
+            self.esito = FINE_PRATICA
+            return None
+        if self.esame_finito:
+            self.ricomincia_esame()
+            self.esito = ESAME_RICOMINCIATO
+            return None
+        return self.nuova_domanda()
+
+    def applica_risultati(self, risultati):
+        """Applica un lotto di risposte date nel browser ({pos, qid, scelta, ms}) come click."""
+        for r in risultati:
+            pos = r['pos']
+            # Lotti fuori sequenza o domande cambiate (quiz ricaricato) vengono ignorati
+            if pos < self.idx or pos >= len(self.ordine):
+                continue
+            posizione = int(self.ordine[pos])
+            domanda = self.banca.domande[posizione]
+            if domanda.qid != r['qid']:
+                continue
+            self.idx = pos + 1
+            self.domanda = domanda
+            self.pos = posizione
+            self.fase = SELEZIONE
+            if r['scelta'] is None:
+                if self.registra is not None:
+                    self.registra(domanda, self.qid(domanda), None, False, self._latenza(r.get('ms', 0)))
+                self.viste += 1
+                if self.in_esame:
+                    self.fatte += 1
+                continue
+            self.rispondi(r['scelta'], r.get('ms', 0))
+        self.domanda = None
+        self.selezione = None
+        self.fase = SELEZIONE
+
+    # --- Pratica ed esame ---
+
+    def esci_pratica(self):
+        self.pratica = False
+        self.idx = 0
+        self.azzera()
+
+    def inizia_esame(self, ordine, seme):
+        """Sostituisce la permutazione con le domande dell'esame generato con `seme`."""
+        if self.ordine_normale is None:
+            # La domanda mostrata e non ancora risposta verrà riproposta all'uscita
+            idx = self.idx
+            if self.domanda is not None and self.fase == SELEZIONE:
+                idx -= 1
+            self.ordine_normale = (self.ordine, max(idx, 0))
+        self.ordine = np.asarray(ordine, dtype=np.int32)
+        self.idx = 0
+        self.punteggio = 0.0
+        self.fatte = 0
+        self.seme_esame = seme
+        self.domanda = None
+        self.fase = SELEZIONE
+
+    def ricomincia_esame(self):
+        """Azzera l'esame: il prossimo va ricomposto con inizia_esame."""
+        self.punteggio = 0.0
+        self.fatte = 0
+        self.idx = 0
+        self.seme_esame = None
+        self.azzera()
+
+    def termina_esame(self):
+        """Fine dell'esame: si riprende la permutazione completa da dove era rimasta."""
+        self.seme_esame = None
+        if self.ordine_normale is not None:
+            self.ordine, self.idx = self.ordine_normale
+            self.ordine_normale = None
+            self.estendi()
+        self.domanda = None
+        self.fase = SELEZIONE
+
+
+if __name__ == '__main__':
+    import os
+    import sys
+
+    from bank import load_bank
+
+    percorso = sys.argv[1] if len(sys.argv) > 1 else os.path.join('csv', sorted(os.listdir('csv'))[0])
+    banca = load_bank(percorso)
+    sessione = QuizSession(seme=0)
+    sessione.imposta_banca(banca)
+    scelte = random.Random(1)
+    n = 0
+    inizio = time.perf_counter()
+    while time.perf_counter() - inizio < 1.0:
+        for _ in range(10_000):
+            if sessione.avanti() is None and sessione.esito == FINE_QUIZ:
+                sessione.idx = 0
+                continue
+            sessione.rispondi(scelte.randrange(len(sessione.domanda.opzioni)), ms=0)
+            n += 1
+    durata = time.perf_counter() - inizio
+    print(f"{percorso}: {n / durata:,.0f} risposte/s, {sessione.corrette} giuste, "
+          f"{sessione.sbagliate} sbagliate, {len(sessione.errori)} da ripassare")
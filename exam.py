@@ -0,0 +1,193 @@
+"""Composizione degli esami: estrazione pesata e stratificata con tabelle alias.
+
+Le domande sono divise in strati (file di origine, categoria di cheatsheet...)
+e ogni strato ha una tabella alias (metodo di Vose) sui pesi delle sue domande:
+costruirla costa O(n) una volta, ogni estrazione costa O(1). L'estrazione
+senza ripetizione scarta le domande già uscite; se gli scarti diventano
+troppi (pesi molto concentrati) si finisce con un'estrazione diretta sulle
+domande rimaste.
+
+Le quote per strato sono proporzionali al numero di domande dello strato
+(metodo dei resti più grandi) salvo quote esplicite: i pesi decidono quali
+domande escono dentro ogni strato, non il mix di argomenti. A parità di
+strati, pesi e seme l'esame generato è sempre lo stesso.
+"""
+import hashlib
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+MAX_TABELLE_IN_CACHE = 32
+# Peso delle domande sbagliate rispetto alle altre
+PESO_ERRORI = 3.0
+# Tentativi storici con cui il tasso d'errore di una domanda conta per metà
+TENTATIVI_AFFIDABILI = 5
+MAX_TENTATIVI = 8
+
+
+class AliasTable:
+    """Tabella alias di Vose per estrarre indici con probabilità proporzionale ai pesi."""
+
+    __slots__ = ('prob', 'alias')
+
+    def __init__(self, pesi):
+        pesi = np.asarray(pesi, dtype=np.float64)
+        n = len(pesi)
+        self.prob = np.ones(n, dtype=np.float64)
+        self.alias = np.arange(n, dtype=np.int32)
+        totale = pesi.sum()
+        if n == 0 or totale <= 0:
+            return
+        scalati = pesi * (n / totale)
+        piccoli = np.flatnonzero(scalati < 1).tolist()
+        grandi = np.flatnonzero(scalati >= 1).tolist()
+        while piccoli and grandi:
+            s = piccoli.pop()
+            g = grandi[-1]
+            self.prob[s] = scalati[s]
+            self.alias[s] = g
+            scalati[g] -= 1 - scalati[s]
+            if scalati[g] < 1:
+                piccoli.append(grandi.pop())
+        # I residui (errori di arrotondamento) restano con probabilità 1
+
+    def __len__(self):
+        return len(self.prob)
+
+    def estrai(self, rng, k):
+        """k indici estratti con ripetizione."""
+        i = rng.integers(0, len(self.prob), size=k)
+        return np.where(rng.random(k) < self.prob[i], i, self.alias[i])
+
+
+def estrai_senza_ripetizione(tabella, pesi, k, rng):
+    """k indici distinti con probabilità (sequenziale) proporzionale ai pesi."""
+    n = len(tabella)
+    k = min(k, int(np.count_nonzero(pesi > 0)))
+    scelti = []
+    visti = set()
+    for _ in range(MAX_TENTATIVI):
+        mancanti = k - len(scelti)
+        if mancanti <= 0:
+            break
+        for i in tabella.estrai(rng, 2 * mancanti).tolist():
+            if i not in visti:
+                visti.add(i)
+                scelti.append(i)
+                if len(scelti) == k:
+                    break
+    mancanti = k - len(scelti)
+    if mancanti > 0:
+        resto = np.setdiff1d(np.arange(n), scelti)
+        p = pesi[resto] / pesi[resto].sum()
+        scelti.extend(rng.choice(resto, size=mancanti, replace=False, p=p).tolist())
+    return np.asarray(scelti, dtype=np.int64)
+
+
+def quote_proporzionali(dimensioni, n):
+    """Quote per strato proporzionali alla dimensione, senza superarla."""
+    dimensioni = np.asarray(dimensioni, dtype=np.int64)
+    n = min(n, int(dimensioni.sum()))
+    quote = np.zeros(len(dimensioni), dtype=np.int64)
+    attivi = dimensioni > 0
+    while quote.sum() < n and attivi.any():
+        restanti = n - quote.sum()
+        ideali = np.where(attivi, dimensioni, 0).astype(np.float64)
+        ideali = ideali / ideali.sum() * restanti
+        aggiunte = np.floor(ideali).astype(np.int64)
+        # Resti più grandi
+        avanzo = restanti - aggiunte.sum()
+        if avanzo > 0:
+            ordine = np.argsort(-(ideali - aggiunte), kind='stable')
+            aggiunte[ordine[:avanzo]] += 1
+        quote = np.minimum(quote + aggiunte, dimensioni)
+        attivi = quote < dimensioni
+    return quote
+
+
+class _Tabelle:
+    """Tabelle alias per strato di una certa combinazione (strati, pesi)."""
+
+    __slots__ = ('strati', 'membri', 'pesi', 'tabelle')
+
+    def __init__(self, strati, pesi):
+        self.strati = np.unique(strati)
+        self.membri = [np.flatnonzero(strati == s) for s in self.strati]
+        self.pesi = [pesi[m] for m in self.membri]
+        self.tabelle = [AliasTable(p) for p in self.pesi]
+
+
+_cache = OrderedDict()
+_cache_lock = threading.Lock()
+
+
+def tabelle_alias(strati, pesi):
+    """Tabelle precalcolate, riusate finché strati e pesi non cambiano."""
+    chiave = hashlib.blake2b(strati.tobytes() + pesi.tobytes(), digest_size=16).digest()
+    with _cache_lock:
+        tabelle = _cache.get(chiave)
+        if tabelle is not None:
+            _cache.move_to_end(chiave)
+            return tabelle
+    tabelle = _Tabelle(strati, pesi)
+    with _cache_lock:
+        _cache[chiave] = tabelle
+        while len(_cache) > MAX_TABELLE_IN_CACHE:
+            _cache.popitem(last=False)
+    return tabelle
+
+
+def numeri_per_strato(tabelle, n, quote=None):
+    """Domande da estrarre per strato: quote esplicite ({strato: numero}) o proporzionali."""
+    dimensioni = [int(np.count_nonzero(p > 0)) for p in tabelle.pesi]
+    if quote is None:
+        return quote_proporzionali(dimensioni, n)
+    return np.array(
+        [min(quote.get(int(s), 0), d) for s, d in zip(tabelle.strati, dimensioni)], dtype=np.int64
+    )
+
+
+def genera_esame(n_domande, n, seme, strati=None, pesi=None, quote=None):
+    """Posizioni (int32) delle n domande d'esame, in ordine casuale.
+
+    strati: array (n_domande,) con lo strato di ogni domanda (None = uno solo);
+    pesi: array (n_domande,) di pesi non negativi (None = uniformi);
+    quote: {strato: numero di domande}, altrimenti proporzionali agli strati.
+    """
+    strati = np.zeros(n_domande, dtype=np.int32) if strati is None else np.asarray(strati, dtype=np.int32)
+    pesi = np.ones(n_domande, dtype=np.float64) if pesi is None else np.asarray(pesi, dtype=np.float64)
+    rng = np.random.default_rng(seme)
+    tabelle = tabelle_alias(strati, pesi)
+    numeri = numeri_per_strato(tabelle, n, quote)
+
+    scelte = [
+        membri[estrai_senza_ripetizione(tabella, p, k, rng)]
+        for membri, tabella, p, k in zip(tabelle.membri, tabelle.tabelle, tabelle.pesi, numeri)
+        if k > 0
+    ]
+    posizioni = np.concatenate(scelte) if scelte else np.zeros(0, dtype=np.int64)
+    rng.shuffle(posizioni)
+    return posizioni.astype(np.int32)
+
+
+def pesi_da_errori(domande, sbagliate, canonica=lambda qid: qid, tentativi=None, errore=None):
+    """Pesi per domanda: PESO_ERRORI per quelle nella lista degli errori.
+
+    La lista contiene le qid delle domande risposte: il confronto avviene
+    sulle canoniche, quindi pesa anche una copia in un'altra banca. Le altre
+    pesano 1, oppure, con `tentativi` ed `errore` per domanda (storico di
+    tutti gli utenti, analytics.difficolta), da 1 a PESO_ERRORI secondo il
+    tasso d'errore ammorbidito verso 0 quando i tentativi sono pochi: anche
+    chi non ha ancora sbagliato nulla riceve più domande difficili.
+    """
+    canoniche = {canonica(qid) for qid in sbagliate}
+    sbagliata = np.fromiter(
+        (canonica(q.qid) in canoniche for q in domande), dtype=bool, count=len(domande)
+    )
+    base = np.ones(len(domande), dtype=np.float64)
+    if tentativi is not None and errore is not None:
+        tentativi = np.asarray(tentativi, dtype=np.float64)
+        tasso = np.nan_to_num(np.asarray(errore, dtype=np.float64)) * tentativi / (tentativi + TENTATIVI_AFFIDABILI)
+        base += (PESO_ERRORI - 1) * tasso
+    return np.where(sbagliata, PESO_ERRORI, base)
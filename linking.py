@@ -0,0 +1,300 @@
+"""Collegamenti domanda -> sezioni di cheatsheet con TF-IDF e similarità coseno.
+
+I conteggi dei termini arrivano dagli indici per file di search.py, che
+vengono ricostruiti solo per i file cambiati; da questi si ricavano, sempre
+per file, gli array (documento, termine, peso). La similarità tra le domande
+di una banca e tutte le sezioni è un prodotto di matrici NumPy a blocchi di
+domande, seguito da un top-k con argpartition: nessun ciclo per coppia.
+
+Le domande fanno da query: l'IDF è calcolato sulle sole sezioni, quindi il
+top-k di una banca dipende solo dal suo contenuto e dall'insieme dei
+cheatsheet. I risultati sono tenuti per banca con chiave lo sha del file, in
+memoria e in .cache/links/<firma cheatsheet>/<sha>.json: quando cambia una
+banca si ricalcolano solo le sue righe; quando cambia un cheatsheet cambiano
+IDF e candidati di tutte le domande e si ricalcola tutto (costa millisecondi).
+
+Uso batch:  python linking.py
+"""
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+
+import numpy as np
+
+from bank import load_bank
+from search import get_indice
+
+CARTELLA_CACHE = os.path.join('.cache', 'links')
+VERSIONE_COLLEGAMENTI = 2
+TOP_K = 3
+# Sotto questa similarità il collegamento non viene proposto
+SOGLIA_SIMILARITA = 0.12
+BLOCCO_DOMANDE = 512
+# Secondi minimi tra due controlli in background del catalogo (vedi `disponibili`)
+INTERVALLO_CONTROLLO = 5.0
+
+_log = logging.getLogger(__name__)
+
+
+def _triplette(indice_file, vocabolario):
+    """Array (documento, termine, tf) di un indice per file; aggiunge i termini nuovi."""
+    righe, colonne, tf = [], [], []
+    for termine, lista in indice_file.postings.items():
+        t = vocabolario.setdefault(termine, len(vocabolario))
+        for doc, n in lista:
+            righe.append(doc)
+            colonne.append(t)
+            tf.append(n)
+    return (
+        np.asarray(righe, dtype=np.int32),
+        np.asarray(colonne, dtype=np.int32),
+        np.asarray(tf, dtype=np.float32),
+    )
+
+
+class Sezioni:
+    """Pesi TF-IDF normalizzati di tutte le sezioni di cheatsheet.
+
+    `righe`, `colonne` e `pesi` sono le triplette (sezione, termine, peso) con
+    i termini numerati in `vocabolario`; `metadati` ha (percorso, documento)
+    per ogni sezione.
+    """
+
+    __slots__ = ('vocabolario', 'idf', 'idf_assente', 'righe', 'colonne', 'pesi', 'metadati')
+
+    def __init__(self, file_md):
+        self.vocabolario, self.metadati = {}, []
+        parti, base = [], 0
+        for percorso, indice in file_md:
+            r, c, tf = _triplette(indice, self.vocabolario)
+            parti.append((r + base, c, tf))
+            self.metadati.extend((percorso, doc) for doc in indice.documenti)
+            base += len(indice.documenti)
+        if parti:
+            righe, colonne, tf = (np.concatenate([p[i] for p in parti]) for i in range(3))
+        else:
+            righe = colonne = np.zeros(0, dtype=np.int32)
+            tf = np.zeros(0, dtype=np.float32)
+
+        # IDF sulle sezioni, TF sublineare; un termine assente ha df = 0
+        n_s = len(self.metadati)
+        df = np.bincount(colonne, minlength=len(self.vocabolario))
+        self.idf = (np.log((n_s + 1) / (df + 1)) + 1).astype(np.float32)
+        self.idf_assente = np.float32(np.log(n_s + 1) + 1)
+        pesi = (1 + np.log(tf)) * self.idf[colonne]
+        norma = np.sqrt(np.bincount(righe, weights=pesi * pesi, minlength=n_s)).astype(np.float32)
+        norma[norma == 0] = 1
+        self.righe, self.colonne, self.pesi = righe, colonne, pesi / norma[righe]
+
+    def migliori(self, indice_quiz, k=TOP_K, soglia=SOGLIA_SIMILARITA):
+        """Per ogni documento della banca, [[percorso_md, titolo, parte, similarità], ...]."""
+        n_q, n_s = len(indice_quiz.documenti), len(self.metadati)
+        if not n_q or not n_s:
+            return [[] for _ in range(n_q)]
+        locale = {}
+        rq, cq, tfq = _triplette(indice_quiz, locale)
+        globale = np.fromiter(
+            (self.vocabolario.get(t, -1) for t in locale), dtype=np.int32, count=len(locale))
+        cq = globale[cq]
+        noto = cq >= 0
+        idf = np.where(noto, self.idf[cq], self.idf_assente)
+        wq = (1 + np.log(tfq)) * idf
+        norma_q = np.sqrt(np.bincount(rq, weights=wq * wq, minlength=n_q)).astype(np.float32)
+        norma_q[norma_q == 0] = 1
+
+        # Solo i termini presenti da entrambe le parti contribuiscono al prodotto
+        comuni = np.unique(cq[noto])
+        colonna = np.full(len(self.vocabolario), -1, dtype=np.int32)
+        colonna[comuni] = np.arange(len(comuni), dtype=np.int32)
+
+        sezioni = np.zeros((len(comuni), n_s), dtype=np.float32)
+        m = colonna[self.colonne] >= 0
+        sezioni[colonna[self.colonne[m]], self.righe[m]] = self.pesi[m]
+
+        rq, cq, wq = rq[noto], colonna[cq[noto]], wq[noto] / norma_q[rq[noto]]
+
+        k = min(k, n_s)
+        migliori = np.empty((n_q, k), dtype=np.int32)
+        punteggi = np.empty((n_q, k), dtype=np.float32)
+        for inizio in range(0, n_q, BLOCCO_DOMANDE):
+            fine = min(inizio + BLOCCO_DOMANDE, n_q)
+            blocco = np.zeros((fine - inizio, len(comuni)), dtype=np.float32)
+            sel = (rq >= inizio) & (rq < fine)
+            blocco[rq[sel] - inizio, cq[sel]] = wq[sel]
+            simili = blocco @ sezioni
+            top = np.argpartition(-simili, k - 1, axis=1)[:, :k]
+            valori = np.take_along_axis(simili, top, axis=1)
+            ordine = np.argsort(-valori, axis=1)
+            migliori[inizio:fine] = np.take_along_axis(top, ordine, axis=1)
+            punteggi[inizio:fine] = np.take_along_axis(valori, ordine, axis=1)
+
+        risultato = []
+        for i in range(n_q):
+            voci = []
+            for j, s in zip(migliori[i].tolist(), punteggi[i].tolist()):
+                if s < soglia:
+                    break
+                percorso, doc_s = self.metadati[j]
+                _, titolo, parte, _ = doc_s[:4]
+                voci.append([percorso, titolo, parte, round(s, 4)])
+            risultato.append(voci)
+        return risultato
+
+
+def collegamenti_banca(qids, indice_quiz, sezioni, k=TOP_K, soglia=SOGLIA_SIMILARITA):
+    """{qid: voci} per una banca; qids ha la qid di ogni documento dell'indice."""
+    return {qid: voci for qid, voci in zip(qids, sezioni.migliori(indice_quiz, k, soglia)) if voci}
+
+
+def calcola_collegamenti(file_quiz, file_md, k=TOP_K, soglia=SOGLIA_SIMILARITA):
+    """Top-k sezioni per ogni domanda.
+
+    file_quiz: lista di (qid per documento, IndiceFile); file_md: lista di
+    (percorso, IndiceFile). Restituisce {qid: [[percorso_md, titolo, parte,
+    similarità], ...]}.
+    """
+    sezioni = Sezioni(file_md)
+    collegamenti = {}
+    for qids, indice in file_quiz:
+        collegamenti.update(collegamenti_banca(qids, indice, sezioni, k, soglia))
+    return collegamenti
+
+
+def _qids(percorso, mtime, indice):
+    """Qid di ogni documento dell'indice di una banca."""
+    domande = load_bank(percorso, mtime=mtime).domande
+    return [domande[doc[2]].qid for doc in indice.documenti]
+
+
+def _firma(righe):
+    return hashlib.sha256('\n'.join(righe).encode('utf-8')).hexdigest()
+
+
+class Collegamenti:
+    """Collegamenti correnti; per banca, ricalcolati solo se cambia il suo file o un cheatsheet."""
+
+    def __init__(self, cartella=CARTELLA_CACHE):
+        self.cartella = cartella
+        self._lock = threading.Lock()
+        self._lock_thread = threading.Lock()
+        self._firma = None
+        self._firma_md = None
+        self._sezioni = None
+        self._per_banca = {}    # sha della banca -> {qid: voci}, validi per _firma_md
+        self._dati = {}
+        self._thread = None
+        self._controllato = None    # istante dell'ultimo aggiornamento avviato in background
+        self.stats = {'calcoli': 0, 'da_disco': 0, 'riusati': 0}
+
+    @property
+    def pronti(self):
+        return self._firma is not None
+
+    def aggiorna_in_background(self):
+        """Avvia `aggiorna` in un thread, al più ogni INTERVALLO_CONTROLLO secondi; non aspetta."""
+        adesso = time.monotonic()
+        with self._lock_thread:
+            if self._thread is not None and self._thread.is_alive():
+                return
+            if self._controllato is not None and adesso - self._controllato < INTERVALLO_CONTROLLO:
+                return
+            self._controllato = adesso
+            self._thread = threading.Thread(target=self._aggiorna_registrando, name='linking', daemon=True)
+            self._thread.start()
+
+    def _aggiorna_registrando(self):
+        try:
+            self.aggiorna()
+        except Exception:
+            _log.exception("Calcolo dei collegamenti non riuscito")
+
+    def _collegamenti_banca(self, percorso, mtime, indice, file_md):
+        cache = os.path.join(self.cartella, self._firma_md, f"{indice.sha}.json")
+        try:
+            with open(cache, 'r', encoding='utf-8') as f:
+                dati = json.load(f)
+            self.stats['da_disco'] += 1
+            return dati
+        except (OSError, ValueError):
+            pass
+        if self._sezioni is None:
+            self._sezioni = Sezioni(file_md)
+        dati = collegamenti_banca(_qids(percorso, mtime, indice), indice, self._sezioni)
+        self.stats['calcoli'] += 1
+        try:
+            os.makedirs(os.path.dirname(cache), exist_ok=True)
+            with open(cache, 'w', encoding='utf-8') as f:
+                json.dump(dati, f, ensure_ascii=False)
+        except OSError:
+            pass
+        return dati
+
+    def aggiorna(self):
+        indice = get_indice()
+        indice.aggiorna()
+        file_indicizzati = indice.file()
+        banche = [(p, m, i) for p, m, i in file_indicizzati if p.endswith('.csv')]
+        file_md = [(p, i) for p, _, i in file_indicizzati if not p.endswith('.csv')]
+        firma_md = _firma(
+            [f"{VERSIONE_COLLEGAMENTI}:{TOP_K}:{SOGLIA_SIMILARITA}"]
+            + [f"{p}:{i.sha}" for p, i in file_md]
+        )
+        firma = _firma([firma_md] + [i.sha for _, _, i in banche])
+        with self._lock:
+            if firma == self._firma:
+                return
+            if firma_md != self._firma_md:
+                self._firma_md, self._sezioni, self._per_banca = firma_md, None, {}
+            per_banca, dati = {}, {}
+            for percorso, mtime, indice_banca in banche:
+                voci = self._per_banca.get(indice_banca.sha)
+                if voci is None:
+                    voci = self._collegamenti_banca(percorso, mtime, indice_banca, file_md)
+                else:
+                    self.stats['riusati'] += 1
+                per_banca[indice_banca.sha] = voci
+                dati.update(voci)
+            self._per_banca, self._dati, self._firma = per_banca, dati, firma
+
+    def per_domanda(self, qid):
+        """[[percorso_md, titolo, parte, similarità], ...] per una domanda."""
+        return self._dati.get(qid, [])
+
+
+_collegamenti = {}
+_collegamenti_lock = threading.Lock()
+
+
+def _istanza():
+    chiave = os.getcwd()
+    with _collegamenti_lock:
+        c = _collegamenti.get(chiave)
+        if c is None:
+            c = _collegamenti[chiave] = Collegamenti()
+    return c
+
+
+def get_collegamenti():
+    """Collegamenti condivisi dal processo, allineati al catalogo (aspetta il calcolo)."""
+    c = _istanza()
+    c.aggiorna()
+    return c
+
+
+def collegamenti_disponibili():
+    """Collegamenti senza attese, per il percorso del click.
+
+    Il calcolo (indice di ricerca e TF-IDF) e il controllo del catalogo
+    avvengono in un thread; fino al primo risultato non ci sono collegamenti.
+    """
+    c = _istanza()
+    c.aggiorna_in_background()
+    return c
+
+
+if __name__ == '__main__':
+    c = get_collegamenti()
+    print(f"{len(c._dati)} domande collegate ({c.stats})")
@@ -0,0 +1,538 @@
+"""Prova di carico: quante sessioni contemporanee regge un processo server.
+
+Per ogni livello di concorrenza N si avvia un vero `streamlit run app.py` in
+una cartella di lavoro sintetica (la stessa di benchmark.py) e lo si fa
+lavorare con N client websocket senza browser: ognuno parla il protocollo di
+Streamlit (BackMsg/ForwardMsg), tiene l'albero degli elementi ricevuti e
+rimanda gli stati dei widget come il frontend, compresi i rerun del solo
+fragment per i pulsanti della scheda domanda. Ogni client ha un utente
+proprio e segue uno dei copioni, assegnati a rotazione:
+
+    quiz        apre la banca, risponde e passa alla domanda successiva;
+    pratica     sbaglia qualche risposta, preme "🔄 Pratica" e ripassa gli errori;
+    esame       attiva la modalità esame e risponde a tutte le 33 domande;
+    cheatsheet  apre i cheatsheet, sceglie la categoria e li sfoglia.
+
+Le sessioni si collegano e aprono la banca, poi partono insieme. Per livello
+si riportano rerun al secondo (throughput del server), latenza dei rerun vista
+dal client (p50/p99, complessiva e per copione), memoria residente del server
+aggiunta per sessione, stato di sessione medio (la didascalia "Memoria
+sessione" della sidebar) e, dal registro .cache/perf/reruns.jsonl scritto
+dal server (perf.py), i tempi per fase lato server. AppTest non basta: in
+thread diversi le sue istanze si scambiano il runtime globale.
+
+Con --slo-p99 la capacità è il livello più alto senza errori con p99 entro la
+soglia; con --confronta i livelli con p99 peggiorato oltre SOGLIA_REGRESSIONE
+(o throughput sceso sotto il suo inverso) fanno uscire con 1.
+
+Uso:  python loadtest.py [--sessioni 1,5,10,25] [--domande 10000] [--giri 1]
+                         [--pausa 0] [--copioni quiz,pratica,esame,cheatsheet]
+                         [--slo-p99 500] [--output carico.json] [--confronta base.json]
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import random
+import re
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.request
+
+from benchmark import APP, BANCA, CATEGORIA, SEME, SOGLIA_REGRESSIONE, _commit, genera_dati, statistiche
+
+VERSIONE_RISULTATI = 1
+SESSIONI = (1, 5, 10, 25)
+DOMANDE = 10_000
+COPIONI = ('quiz', 'pratica', 'esame', 'cheatsheet')
+DOMANDE_PER_GIRO = 10
+# Secondi massimi per un rerun e per l'avvio del server
+TIMEOUT_RERUN = 120
+TIMEOUT_AVVIO = 60
+
+WIDGET = ('button', 'checkbox', 'radio', 'selectbox')
+MEMORIA = re.compile(r"Memoria sessione: ([\d.]+) KB")
+
+
+# --- Server ---
+
+def _porta_libera():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def rss_mb(pid):
+    """Memoria residente attuale del processo `pid` in MB (solo Linux, altrimenti None)."""
+    try:
+        with open(f'/proc/{pid}/status') as f:
+            for riga in f:
+                if riga.startswith('VmRSS:'):
+                    return round(int(riga.split()[1]) / 1024, 1)
+    except OSError:
+        pass
+    return None
+
+
+class Server:
+    """`streamlit run app.py` senza browser nella cartella `cartella`."""
+
+    def __init__(self, cartella):
+        self.cartella = cartella
+        self.porta = _porta_libera()
+        self._log = open(os.path.join(cartella, 'server.log'), 'w')
+        self.processo = subprocess.Popen(
+            [sys.executable, '-m', 'streamlit', 'run', APP,
+             '--server.headless', 'true', '--server.port', str(self.porta),
+             '--server.fileWatcherType', 'none', '--browser.gatherUsageStats', 'false'],
+            cwd=cartella, stdout=self._log, stderr=subprocess.STDOUT,
+        )
+        self._attendi()
+
+    @property
+    def url(self):
+        return f"ws://127.0.0.1:{self.porta}/_stcore/stream"
+
+    def _attendi(self):
+        scadenza = time.monotonic() + TIMEOUT_AVVIO
+        while time.monotonic() < scadenza:
+            if self.processo.poll() is not None:
+                break
+            try:
+                with urllib.request.urlopen(f"http://127.0.0.1:{self.porta}/_stcore/health", timeout=1):
+                    return
+            except OSError:
+                time.sleep(0.2)
+        self.chiudi()
+        raise RuntimeError(f"il server non risponde:\n{self.coda_log()}")
+
+    def coda_log(self, n=2000):
+        with open(os.path.join(self.cartella, 'server.log'), errors='replace') as f:
+            return f.read()[-n:]
+
+    def rss_mb(self):
+        return rss_mb(self.processo.pid)
+
+    def chiudi(self):
+        # SIGTERM: Streamlit si ferma pulito e perf.py scrive le ultime righe del registro
+        self.processo.terminate()
+        try:
+            self.processo.wait(15)
+        except subprocess.TimeoutExpired:
+            self.processo.kill()
+            self.processo.wait()
+        self._log.close()
+
+
+# --- Client ---
+
+class Client:
+    """Un utente simulato su websocket: albero degli elementi, widget e rerun cronometrati."""
+
+    def __init__(self, numero, url, copione='quiz', giri=1, pausa=0.0):
+        self.numero = numero
+        self.url = url
+        self.copione = copione
+        self.giri = giri
+        self.pausa = pausa
+        self.query = f"utente=carico-{os.getpid()}-{numero}"
+        self.rng = random.Random(SEME + numero)
+        self.durate = []
+        # Rerun fatti prima della partenza comune (collegamento e apertura della banca)
+        self.preparazione = 0
+        self.errore = None
+        self.memoria_kb = None
+        self.ws = None
+        # delta_path -> (tipo, proto del widget o None, fragment_id)
+        self.elementi = {}
+        # id del widget -> WidgetState scelto dall'utente
+        self.valori = {}
+
+    async def apri(self):
+        import websockets
+
+        self.ws = await websockets.connect(self.url, subprotocols=['streamlit'], max_size=None)
+
+    async def chiudi(self):
+        if self.ws is not None:
+            await self.ws.close()
+
+    # Albero degli elementi
+
+    def widget(self, tipo, chiave=None, etichetta=None):
+        """Primo widget `tipo` con quella chiave (o etichetta che la contiene), None se assente."""
+        for percorso in sorted(self.elementi):
+            t, w, fragment = self.elementi[percorso]
+            if t != tipo:
+                continue
+            if chiave is not None and not w.id.endswith(f"-{chiave}"):
+                continue
+            if etichetta is not None and etichetta not in w.label:
+                continue
+            return w, fragment
+        return None, None
+
+    def opzioni(self):
+        """Pulsanti delle risposte (chiavi b0_1, b1_1, ...)."""
+        return [
+            (w, fragment) for t, w, fragment in self.elementi.values()
+            if t == 'button' and re.search(r"-b\d+_\d+$", w.id)
+        ]
+
+    def _stati(self, cliccato=None):
+        from streamlit.proto.WidgetStates_pb2 import WidgetStates
+
+        stati = WidgetStates()
+        for t, w, _ in self.elementi.values():
+            if t not in WIDGET:
+                continue
+            if t == 'button':
+                if cliccato is not None and w.id == cliccato:
+                    stato = stati.widgets.add()
+                    stato.id = w.id
+                    stato.trigger_value = True
+                continue
+            scelto = self.valori.get(w.id)
+            if scelto is not None:
+                stati.widgets.add().CopyFrom(scelto)
+                continue
+            stato = stati.widgets.add()
+            stato.id = w.id
+            if t == 'checkbox':
+                stato.bool_value = w.value if w.set_value else w.default
+            elif w.set_value and w.HasField('raw_value'):
+                stato.string_value = w.raw_value
+            elif w.HasField('default') and w.default < len(w.options):
+                stato.string_value = w.options[w.default]
+            else:
+                stati.widgets.pop()
+        return stati
+
+    def _ricevi(self, messaggio, toccati):
+        tipo = messaggio.WhichOneof('type')
+        if tipo == 'new_session':
+            toccati.clear()
+        if tipo != 'delta':
+            return
+        delta = messaggio.delta
+        percorso = tuple(messaggio.metadata.delta_path)
+        toccati.add(percorso)
+        if delta.WhichOneof('type') != 'new_element':
+            self.elementi[percorso] = ('blocco', None, delta.fragment_id)
+            return
+        elemento = delta.new_element
+        t = elemento.WhichOneof('type')
+        if t in WIDGET:
+            self.elementi[percorso] = (t, getattr(elemento, t), delta.fragment_id)
+            return
+        self.elementi[percorso] = (t, None, delta.fragment_id)
+        if t == 'exception':
+            self.errore = f"{elemento.exception.type}: {elemento.exception.message}"
+        elif t == 'markdown':
+            trovata = MEMORIA.search(elemento.markdown.body)
+            if trovata:
+                self.memoria_kb = float(trovata.group(1))
+
+    async def rerun(self, cliccato=None, fragment=''):
+        """Un rerun (del solo fragment se `fragment`), fino alla fine dello script."""
+        from streamlit.proto.BackMsg_pb2 import BackMsg
+        from streamlit.proto.ForwardMsg_pb2 import ForwardMsg
+
+        if self.pausa:
+            await asyncio.sleep(self.rng.uniform(0, 2 * self.pausa))
+        richiesta = BackMsg()
+        richiesta.rerun_script.query_string = self.query
+        richiesta.rerun_script.widget_states.CopyFrom(self._stati(cliccato))
+        if fragment:
+            richiesta.rerun_script.fragment_id = fragment
+        toccati = set()
+        inizio = time.perf_counter_ns()
+        await self.ws.send(richiesta.SerializeToString())
+        while True:
+            messaggio = ForwardMsg()
+            messaggio.ParseFromString(await asyncio.wait_for(self.ws.recv(), TIMEOUT_RERUN))
+            if messaggio.WhichOneof('type') == 'script_finished':
+                esito = messaggio.script_finished
+                if esito == ForwardMsg.FINISHED_EARLY_FOR_RERUN:
+                    continue
+                break
+            self._ricevi(messaggio, toccati)
+        self.durate.append(time.perf_counter_ns() - inizio)
+        # Come il frontend: sparisce ciò che questa esecuzione non ha ridisegnato
+        solo_fragment = esito == ForwardMsg.FINISHED_FRAGMENT_RUN_SUCCESSFULLY
+        for percorso in [p for p in self.elementi if p not in toccati]:
+            if not solo_fragment or self.elementi[percorso][2] == fragment:
+                del self.elementi[percorso]
+        if esito == ForwardMsg.FINISHED_WITH_COMPILE_ERROR:
+            self.errore = "errore di compilazione dello script"
+        if self.errore:
+            raise RuntimeError(self.errore)
+
+    async def clicca(self, w, fragment=''):
+        await self.rerun(w.id, fragment)
+
+    async def imposta(self, w, valore, fragment=''):
+        """Cambia il valore di radio, selectbox o checkbox e rilancia lo script."""
+        from streamlit.proto.WidgetStates_pb2 import WidgetState
+
+        stato = WidgetState(id=w.id)
+        if isinstance(valore, bool):
+            stato.bool_value = valore
+        else:
+            stato.string_value = valore
+        self.valori[w.id] = stato
+        await self.rerun(fragment=fragment)
+
+    # Copioni
+
+    async def _rispondi(self, n):
+        """Risponde a caso a n domande; False se il quiz finisce prima."""
+        for _ in range(n):
+            opzioni = self.opzioni()
+            if not opzioni:
+                return False
+            await self.clicca(*self.rng.choice(opzioni))
+            avanti, fragment = self.widget('button', etichetta='PROSSIMA DOMANDA')
+            if avanti is None:
+                return False
+            await self.clicca(avanti, fragment)
+        return True
+
+    async def _sezione(self, nome):
+        sezione, _ = self.widget('radio', chiave='section_selection')
+        await self.imposta(sezione, nome)
+
+    async def apri_banca(self):
+        await self._sezione('Quiz')
+        banca, _ = self.widget('radio', chiave='quiz_selection')
+        await self.imposta(banca, BANCA.title())
+
+    async def quiz(self):
+        await self._rispondi(DOMANDE_PER_GIRO)
+
+    async def pratica(self):
+        # Servono errori da ripassare: con risposte a caso ne arrivano presto
+        for _ in range(DOMANDE_PER_GIRO):
+            if self.widget('button', etichetta='Pratica')[0] is not None:
+                break
+            await self._rispondi(1)
+        pratica, _ = self.widget('button', etichetta='Pratica')
+        if pratica is None:
+            return
+        await self.clicca(pratica)
+        await self._rispondi(DOMANDE_PER_GIRO)
+        esci, _ = self.widget('button', etichetta='Esci Pratica')
+        if esci is not None:
+            await self.clicca(esci)
+
+    async def esame(self):
+        esame, _ = self.widget('checkbox', etichetta='ESAME')
+        await self.imposta(esame, True)
+        await self._rispondi(33)
+        esame, _ = self.widget('checkbox', etichetta='ESAME')
+        await self.imposta(esame, False)
+
+    async def cheatsheet(self):
+        await self._sezione('Cheatsheets')
+        categoria, _ = self.widget('selectbox', chiave='cheatsheet_category')
+        if categoria is not None:
+            await self.imposta(categoria, CATEGORIA)
+        for _ in range(DOMANDE_PER_GIRO):
+            successivo = next(
+                ((w, f) for t, w, f in self.elementi.values() if t == 'button' and '-succ_' in w.id), None
+            )
+            if successivo is None:
+                break
+            await self.clicca(*successivo)
+        await self._sezione('Quiz')
+
+    async def prepara(self):
+        await self.apri()
+        await self.rerun()
+        if self.copione != 'cheatsheet':
+            await self.apri_banca()
+        self.preparazione = len(self.durate)
+
+    async def esegui(self, via):
+        try:
+            await self.prepara()
+        except Exception as e:
+            self.errore = self.errore or f"{type(e).__name__}: {e}"
+        await via.wait()
+        if self.errore:
+            return
+        try:
+            for _ in range(self.giri):
+                await getattr(self, self.copione)()
+        except Exception as e:
+            self.errore = self.errore or f"{type(e).__name__}: {e}"
+
+
+# --- Livelli ---
+
+def _registro_server(cartella, da):
+    """Righe del registro dei rerun scritte dal server dopo l'istante `da`."""
+    percorso = os.path.join(cartella, '.cache', 'perf', 'reruns.jsonl')
+    try:
+        with open(percorso, encoding='utf-8') as f:
+            righe = [json.loads(riga) for riga in f if riga.strip()]
+    except (OSError, ValueError):
+        return []
+    return [r for r in righe if r.get('istante', 0) >= da]
+
+
+async def _livello(server, n_sessioni, copioni, giri, pausa):
+    # Un primo utente scalda le cache condivise (banca, e alla prima risposta indice di
+    # ricerca e collegamenti): si misura il regime, non il primo avvio
+    riscaldamento = Client(-1, server.url)
+    await riscaldamento.prepara()
+    await riscaldamento._rispondi(1)
+    await riscaldamento.chiudi()
+    await asyncio.sleep(0.5)
+    rss_base = server.rss_mb()
+
+    client = [Client(i, server.url, copioni[i % len(copioni)], giri, pausa) for i in range(n_sessioni)]
+    # Si parte insieme quando tutti hanno aperto la banca; la barriera conta anche questo task
+    via = asyncio.Barrier(n_sessioni + 1)
+    lavori = [asyncio.create_task(c.esegui(via)) for c in client]
+    await via.wait()
+    istante = time.time()
+    inizio = time.perf_counter()
+    await asyncio.gather(*lavori)
+    secondi = time.perf_counter() - inizio
+    # Memoria con tutte le sessioni ancora collegate (con poche sessioni domina il rumore dell'allocatore)
+    rss = server.rss_mb()
+    for c in client:
+        await c.chiudi()
+    return client, secondi, istante, rss_base, rss
+
+
+def livello(n_sessioni, n_domande, copioni, giri, pausa):
+    """Risultati di N sessioni contemporanee su un server nuovo."""
+    from perf import riepilogo
+
+    cartella = tempfile.mkdtemp(prefix=f'carico-{n_sessioni}-')
+    try:
+        genera_dati(cartella, n_domande)
+        server = Server(cartella)
+        try:
+            client, secondi, istante, rss_base, rss = asyncio.run(
+                _livello(server, n_sessioni, copioni, giri, pausa)
+            )
+        finally:
+            server.chiudi()
+        fasi_server = riepilogo(_registro_server(cartella, istante))
+    finally:
+        shutil.rmtree(cartella, ignore_errors=True)
+
+    durate = [d for c in client for d in c.durate[c.preparazione:]]
+    per_copione = {}
+    for c in client:
+        per_copione.setdefault(c.copione, []).extend(c.durate[c.preparazione:])
+    memorie = [c.memoria_kb for c in client if c.memoria_kb is not None]
+    return {
+        'sessioni': n_sessioni,
+        'rerun': len(durate),
+        'secondi': round(secondi, 3),
+        'rerun_al_secondo': round(len(durate) / secondi, 2) if secondi > 0 else None,
+        'latenza': statistiche(durate),
+        'copioni': {nome: statistiche(d) for nome, d in sorted(per_copione.items())},
+        'errori': [f"{c.copione} #{c.numero}: {c.errore}" for c in client if c.errore],
+        'rss_server_mb': rss,
+        'rss_per_sessione_mb': round((rss - rss_base) / n_sessioni, 2) if rss and rss_base else None,
+        'stato_sessione_kb': round(sum(memorie) / len(memorie), 1) if memorie else None,
+        'fasi_server': {
+            fase: {'n': n, 'p50_ms': p50, 'p99_ms': p99} for fase, (n, p50, p99) in fasi_server.items()
+        },
+    }
+
+
+def capacita(livelli, slo_p99):
+    """Sessioni del livello più alto senza errori e con p99 entro slo_p99 ms (0 se nessuno)."""
+    entro = [
+        r['sessioni'] for r in livelli.values()
+        if not r['errori'] and r['latenza']['p99_ms'] is not None and r['latenza']['p99_ms'] <= slo_p99
+    ]
+    return max(entro, default=0)
+
+
+def confronta(nuovi, base, soglia=SOGLIA_REGRESSIONE):
+    """[(sessioni, metrica, base, nuovo)] dei livelli peggiorati oltre la soglia."""
+    regressioni = []
+    for n, r in nuovi['livelli'].items():
+        prima = base.get('livelli', {}).get(n)
+        if prima is None:
+            continue
+        vecchio, nuovo = prima['latenza']['p99_ms'], r['latenza']['p99_ms']
+        if vecchio and nuovo is not None and nuovo > soglia * vecchio:
+            regressioni.append((n, 'latenza.p99_ms', vecchio, nuovo))
+        vecchio, nuovo = prima['rerun_al_secondo'], r['rerun_al_secondo']
+        if vecchio and nuovo is not None and nuovo < vecchio / soglia:
+            regressioni.append((n, 'rerun_al_secondo', vecchio, nuovo))
+    return regressioni
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Prova di carico con sessioni contemporanee")
+    parser.add_argument('--sessioni', default=','.join(map(str, SESSIONI)),
+                        help="livelli di concorrenza separati da virgole")
+    parser.add_argument('--domande', type=int, default=DOMANDE, help="domande della banca sintetica")
+    parser.add_argument('--copioni', default=','.join(COPIONI), help="copioni assegnati a rotazione")
+    parser.add_argument('--giri', type=int, default=1, help="ripetizioni del copione per sessione")
+    parser.add_argument('--pausa', type=float, default=0.0,
+                        help="tempo di riflessione medio tra due rerun, in secondi")
+    parser.add_argument('--slo-p99', type=float, help="latenza p99 massima (ms) per la capacità")
+    parser.add_argument('--output', help="file JSON dei risultati (altrimenti stdout)")
+    parser.add_argument('--confronta', help="JSON precedente con cui confrontare i livelli")
+    argomenti = parser.parse_args()
+    copioni = [c.strip() for c in argomenti.copioni.split(',') if c.strip()]
+    sconosciuti = set(copioni) - set(COPIONI)
+    if not copioni or sconosciuti:
+        parser.error(f"copioni sconosciuti: {', '.join(sorted(sconosciuti))}")
+
+    risultati = {
+        'versione': VERSIONE_RISULTATI,
+        'commit': _commit(),
+        'python': platform.python_version(),
+        'piattaforma': platform.platform(),
+        'domande': argomenti.domande,
+        'copioni': copioni,
+        'giri': argomenti.giri,
+        'pausa': argomenti.pausa,
+        'livelli': {},
+    }
+    for n in (int(x) for x in argomenti.sessioni.split(',') if x.strip()):
+        r = livello(n, argomenti.domande, copioni, argomenti.giri, argomenti.pausa)
+        risultati['livelli'][str(n)] = r
+        print(f"{n:>4} sessioni: {r['rerun_al_secondo']} rerun/s, p50 {r['latenza']['p50_ms']} ms, "
+              f"p99 {r['latenza']['p99_ms']} ms, {r['rss_per_sessione_mb']} MB/sessione"
+              + (f", {len(r['errori'])} errori" if r['errori'] else ""), file=sys.stderr)
+    if argomenti.slo_p99 is not None:
+        risultati['slo_p99_ms'] = argomenti.slo_p99
+        risultati['capacita'] = capacita(risultati['livelli'], argomenti.slo_p99)
+        print(f"Capacità con p99 <= {argomenti.slo_p99:g} ms: {risultati['capacita']} sessioni", file=sys.stderr)
+
+    testo = json.dumps(risultati, indent=2, ensure_ascii=False)
+    if argomenti.output:
+        with open(argomenti.output, 'w', encoding='utf-8') as f:
+            f.write(testo + '\n')
+    else:
+        print(testo)
+
+    esito = 1 if any(r['errori'] for r in risultati['livelli'].values()) else 0
+    if argomenti.confronta:
+        with open(argomenti.confronta, encoding='utf-8') as f:
+            regressioni = confronta(risultati, json.load(f))
+        for n, metrica, prima, dopo in regressioni:
+            print(f"REGRESSIONE {n} sessioni {metrica}: {prima} -> {dopo}", file=sys.stderr)
+        esito = esito or (1 if regressioni else 0)
+    return esito
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,270 @@
+"""Misure di prestazioni e di memoria dell'app.
+
+Ogni esecuzione dello script (o del solo fragment della domanda) ha un
+`Rerun` che cronometra le sue fasi a colpi di `fase(nome)`: la fase corrente
+finisce quando inizia la successiva, quindi non serve racchiudere il codice
+in blocchi. Le funzioni in cache di Streamlit avvolte con `cache_misurata`
+contano chiamate e miss (il corpo gira solo sui miss) sia per processo sia
+per esecuzione.
+
+I Rerun chiusi finiscono, come righe JSON, in .cache/perf/reruns.jsonl,
+scritte da un thread in background ogni INTERVALLO_SCRITTURA secondi: sul
+percorso dello script restano qualche perf_counter e un append, abbastanza
+poco da lasciarlo sempre attivo.
+
+Uso:  python perf.py [reruns.jsonl]   (p50/p99 per fase dal registro)
+"""
+import atexit
+import functools
+import json
+import os
+import sys
+import threading
+import time
+from itertools import islice
+
+from bank import MultiBankView, Question, QuestionBank, StreamingBank
+from progress import ProgressStore
+
+# Oggetti condivisi dal processo: in sessione pesano solo il riferimento
+TIPI_CONDIVISI = (QuestionBank, StreamingBank, MultiBankView, Question, ProgressStore)
+
+CARTELLA = os.path.join('.cache', 'perf')
+FILE_REGISTRO = 'reruns.jsonl'
+INTERVALLO_SCRITTURA = 1.0
+# Oltre questa dimensione il registro viene ruotato in reruns.jsonl.1
+MAX_BYTE_REGISTRO = 50 * 1024 * 1024
+# Elementi misurati di un contenitore più grande: il resto si stima dalla media
+CAMPIONE_CONTENITORI = 1000
+
+
+def _campione(elementi, n, misura):
+    """Somma di misura() sui primi CAMPIONE_CONTENITORI elementi, riscalata sugli n totali."""
+    if n <= CAMPIONE_CONTENITORI:
+        return sum(misura(v) for v in elementi)
+    parziale = sum(misura(v) for v in islice(elementi, CAMPIONE_CONTENITORI))
+    return parziale * n // CAMPIONE_CONTENITORI
+
+
+def dimensione_profonda(obj, visti=None):
+    """Byte occupati da `obj` e da ciò che contiene, esclusi gli oggetti condivisi.
+
+    Dei contenitori con più di CAMPIONE_CONTENITORI elementi si visitano solo
+    i primi: il costo resta limitato anche con uno storico senza limiti.
+    """
+    if visti is None:
+        visti = set()
+    if id(obj) in visti or isinstance(obj, TIPI_CONDIVISI) or isinstance(obj, type):
+        return 0
+    visti.add(id(obj))
+
+    totale = sys.getsizeof(obj)
+    if hasattr(obj, 'dtype'):  # array NumPy: se è una vista il buffer è nella base
+        base = getattr(obj, 'base', None)
+        return totale + (dimensione_profonda(base, visti) if base is not None else 0)
+    if isinstance(obj, (str, bytes, bytearray, int, float, bool)) or obj is None:
+        return totale
+    if isinstance(obj, dict):
+        totale += _campione(
+            obj.items(), len(obj), lambda kv: dimensione_profonda(kv[0], visti) + dimensione_profonda(kv[1], visti)
+        )
+    elif isinstance(obj, (list, tuple, set, frozenset)):
+        totale += _campione(obj, len(obj), lambda v: dimensione_profonda(v, visti))
+    else:
+        for nome in getattr(type(obj), '__slots__', ()):
+            if hasattr(obj, nome):
+                totale += dimensione_profonda(getattr(obj, nome), visti)
+        if hasattr(obj, '__dict__'):
+            totale += dimensione_profonda(vars(obj), visti)
+    return totale
+
+
+def memoria_sessione(session_state):
+    """Stima dei byte di una sessione Streamlit, esclusi banche e domande condivise."""
+    return dimensione_profonda(dict(session_state.to_dict()))
+
+
+# Esecuzione in corso nel thread dello script, per i contatori delle cache
+_corrente = threading.local()
+# Totali di processo: {nome funzione: [chiamate, miss]}
+cache_stats = {}
+_cache_lock = threading.Lock()
+
+
+class Rerun:
+    """Tempi delle fasi di un'esecuzione dello script ('script') o di un fragment."""
+
+    __slots__ = ('tipo', 'istante', 'inizio', 'fasi', 'fase_corrente', 'inizio_fase', 'cache', 'extra', 'totale_ms')
+
+    def __init__(self, tipo='script'):
+        self.tipo = tipo
+        self.istante = time.time()
+        self.inizio = time.perf_counter()
+        self.fasi = {}
+        self.fase_corrente = None
+        self.inizio_fase = self.inizio
+        self.cache = {}             # nome funzione -> [chiamate, miss]
+        self.extra = {}
+        self.totale_ms = None
+        _corrente.rerun = self
+
+    @property
+    def chiuso(self):
+        return self.totale_ms is not None
+
+    def fase(self, nome):
+        """Chiude la fase corrente e ne apre un'altra (le fasi ripetute si sommano)."""
+        adesso = time.perf_counter()
+        if self.fase_corrente is not None:
+            self.fasi[self.fase_corrente] = self.fasi.get(self.fase_corrente, 0.0) + (adesso - self.inizio_fase) * 1000
+        self.fase_corrente = nome
+        self.inizio_fase = adesso
+
+    def chiudi(self, **extra):
+        """Chiude l'esecuzione e restituisce il record da registrare."""
+        if not self.chiuso:
+            self.fase(None)
+            self.totale_ms = (time.perf_counter() - self.inizio) * 1000
+            self.extra.update(extra)
+            if getattr(_corrente, 'rerun', None) is self:
+                _corrente.rerun = None
+        return self.record()
+
+    def record(self):
+        return {
+            'istante': round(self.istante, 3),
+            'tipo': self.tipo,
+            'totale_ms': round(self.totale_ms, 3) if self.totale_ms is not None else None,
+            'fasi': {nome: round(ms, 3) for nome, ms in self.fasi.items()},
+            'cache': {nome: {'hit': c - m, 'miss': m} for nome, (c, m) in self.cache.items()},
+            **self.extra,
+        }
+
+
+def _conta(nome, indice):
+    with _cache_lock:
+        cache_stats.setdefault(nome, [0, 0])[indice] += 1
+    rerun = getattr(_corrente, 'rerun', None)
+    if rerun is not None:
+        rerun.cache.setdefault(nome, [0, 0])[indice] += 1
+
+
+def cache_misurata(decoratore, nome=None):
+    """Come `decoratore` (st.cache_data, st.cache_resource...), contando hit e miss.
+
+    Il corpo della funzione gira solo sui miss; le chiamate si contano fuori
+    dalla cache. hit = chiamate - miss.
+    """
+    def avvolgi(funzione):
+        etichetta = nome or funzione.__name__
+
+        @functools.wraps(funzione)
+        def corpo(*args, **kwargs):
+            _conta(etichetta, 1)
+            return funzione(*args, **kwargs)
+
+        in_cache = decoratore(corpo)
+
+        @functools.wraps(funzione)
+        def chiamata(*args, **kwargs):
+            _conta(etichetta, 0)
+            return in_cache(*args, **kwargs)
+
+        chiamata.clear = getattr(in_cache, 'clear', None)
+        return chiamata
+
+    return avvolgi
+
+
+class RegistroRerun:
+    """Righe JSON dei Rerun chiusi, scritte in background."""
+
+    def __init__(self, cartella=CARTELLA, intervallo=INTERVALLO_SCRITTURA):
+        self.percorso = os.path.join(cartella, FILE_REGISTRO)
+        os.makedirs(cartella, exist_ok=True)
+        self._buffer = []
+        self._lock = threading.Lock()
+        self._sveglia = threading.Event()
+        self._chiuso = False
+        self.intervallo = intervallo
+        self.stats = {'righe': 0, 'errori': 0}
+        self._thread = threading.Thread(target=self._ciclo, name='perf-log', daemon=True)
+        self._thread.start()
+        atexit.register(self.chiudi)
+
+    def registra(self, record):
+        with self._lock:
+            self._buffer.append(record)
+
+    def scrivi(self):
+        with self._lock:
+            buffer, self._buffer = self._buffer, []
+        if not buffer:
+            return
+        try:
+            if os.path.getsize(self.percorso) > MAX_BYTE_REGISTRO:
+                os.replace(self.percorso, self.percorso + '.1')
+        except OSError:
+            pass
+        with open(self.percorso, 'a', encoding='utf-8') as f:
+            f.write(''.join(json.dumps(r, ensure_ascii=False, separators=(',', ':')) + '\n' for r in buffer))
+        self.stats['righe'] += len(buffer)
+
+    def _ciclo(self):
+        while not self._chiuso:
+            self._sveglia.wait(self.intervallo)
+            self._sveglia.clear()
+            try:
+                self.scrivi()
+            except OSError:
+                self.stats['errori'] += 1
+
+    def chiudi(self):
+        if self._chiuso:
+            return
+        self._chiuso = True
+        self._sveglia.set()
+        self._thread.join(5)
+        try:
+            self.scrivi()
+        except OSError:
+            pass
+
+
+_registri = {}
+_registri_lock = threading.Lock()
+
+
+def get_registro_rerun():
+    """Registro dei Rerun condiviso dal processo per la cartella di lavoro corrente."""
+    chiave = os.getcwd()
+    with _registri_lock:
+        registro = _registri.get(chiave)
+        if registro is None:
+            registro = _registri[chiave] = RegistroRerun()
+        return registro
+
+
+def riepilogo(righe):
+    """{fase: (n, p50, p99)} in ms dalle righe del registro, più il totale."""
+    import numpy as np
+
+    valori = {}
+    for r in righe:
+        if r.get('totale_ms') is not None:
+            valori.setdefault(f"{r['tipo']}:totale", []).append(r['totale_ms'])
+        for fase, ms in r.get('fasi', {}).items():
+            valori.setdefault(fase, []).append(ms)
+    return {
+        fase: (len(v), *np.percentile(v, [50, 99]).round(2).tolist())
+        for fase, v in sorted(valori.items())
+    }
+
+
+if __name__ == '__main__':
+    percorso = sys.argv[1] if len(sys.argv) > 1 else os.path.join(CARTELLA, FILE_REGISTRO)
+    with open(percorso, encoding='utf-8') as f:
+        righe = [json.loads(riga) for riga in f if riga.strip()]
+    print(f"{len(righe)} esecuzioni")
+    for fase, (n, p50, p99) in riepilogo(righe).items():
+        print(f"{fase:24} n={n:<6} p50={p50:>9.2f} ms  p99={p99:>9.2f} ms")
@@ -0,0 +1,225 @@
+"""Rendering lato server dei cheatsheet Markdown in HTML statico.
+
+Formule ($...$ e $$...$$) convertite in MathML e blocchi di codice colorati
+con Pygments una volta sola: il browser riceve HTML pronto invece di
+ritipografare tutto ad ogni visita. L'HTML è salvato in .cache/html/ con
+chiave SHA-256 del sorgente, quindi vale anche per i file caricati.
+
+Il Markdown è reso con l'HTML grezzo disabilitato (i tag nel sorgente vengono
+mostrati come testo) e i link pericolosi rifiutati da markdown-it: l'output
+contiene solo markup generato dal renderer.
+
+I blocchi di codice portano le classi di Pygments: l'HTML in cache non
+dipende dal tema e i colori sono nello stile aggiunto a ogni richiesta, per
+il tema attivo di Streamlit (chiaro o scuro, vedi `html_markdown`) su uno
+sfondo semitrasparente. Se il tema non è noto decide prefers-color-scheme.
+
+Dipendenze opzionali: markdown-it-py, mdit-py-plugins, latex2mathml, pygments.
+Se mancano, `disponibile()` è False e l'app usa st.markdown.
+
+Uso offline:  python prerender.py [file.md ...]
+"""
+import hashlib
+import html
+import logging
+import os
+import sys
+import threading
+from collections import OrderedDict
+
+from cheatsheet import MIN_PARTI, SOGLIA_SEZIONI, sezioni_markdown
+
+try:
+    import latex2mathml.exceptions
+    from latex2mathml.converter import convert as latex_in_mathml
+    from markdown_it import MarkdownIt
+    from mdit_py_plugins.dollarmath import dollarmath_plugin
+    from pygments import highlight
+    from pygments.formatters import HtmlFormatter
+    from pygments.lexers import get_lexer_by_name
+    from pygments.util import ClassNotFound
+except ImportError:
+    MarkdownIt = None
+
+# latex2mathml non ha un'eccezione base comune: le sue classi più gli errori del tokenizer
+ERRORI_FORMULA = (ValueError, IndexError, KeyError, TypeError) + tuple(
+    c for c in vars(latex2mathml.exceptions).values()
+    if isinstance(c, type) and issubclass(c, Exception)
+) if MarkdownIt is not None else ()
+
+CARTELLA_CACHE = os.path.join('.cache', 'html')
+VERSIONE_RENDER = '3'
+MAX_HTML_IN_MEMORIA = 256
+# Stili Pygments dei blocchi di codice per tema chiaro e scuro
+STILE_CODICE_CHIARO = 'default'
+STILE_CODICE_SCURO = 'monokai'
+
+_log = logging.getLogger(__name__)
+
+
+def _colori_codice(stile):
+    """Regole CSS dei token Pygments di `stile`, senza sfondo né colore del blocco."""
+    selettore = '.cheatsheet-html pre'
+    regole = HtmlFormatter(style=stile).get_style_defs(selettore).splitlines()
+    return '\n'.join(
+        r for r in regole
+        if r.startswith(selettore + ' .') and not r.startswith(selettore + ' .hll')
+    )
+
+
+_STILE_BASE = """<style>
+.cheatsheet-html table { border-collapse: collapse; margin: 1em 0; }
+.cheatsheet-html th, .cheatsheet-html td { border: 1px solid rgba(128, 128, 128, 0.3); padding: 0.25em 0.6em; }
+.cheatsheet-html pre { padding: 0.8em 1em; border-radius: 0.5rem; overflow-x: auto; font-size: 0.9em;
+  background: rgba(128, 128, 128, 0.12); color: inherit; }
+.cheatsheet-html math[display="block"] { display: block; margin: 0.8em 0; overflow-x: auto; }
+"""
+
+
+def _stile(tema):
+    """Blocco <style> per il tema 'light' o 'dark'; con None segue prefers-color-scheme."""
+    if MarkdownIt is None:
+        colori = ''
+    elif tema == 'light':
+        colori = _colori_codice(STILE_CODICE_CHIARO)
+    elif tema == 'dark':
+        colori = _colori_codice(STILE_CODICE_SCURO)
+    else:
+        colori = (
+            _colori_codice(STILE_CODICE_CHIARO)
+            + "\n@media (prefers-color-scheme: dark) {\n" + _colori_codice(STILE_CODICE_SCURO) + "\n}"
+        )
+    return f"{_STILE_BASE}{colori}\n</style>"
+
+
+STILI = {tema: _stile(tema) for tema in ('light', 'dark', None)}
+
+
+def disponibile():
+    return MarkdownIt is not None
+
+
+def _formula(latex, opzioni):
+    blocco = opzioni.get('display_mode', False)
+    try:
+        return latex_in_mathml(latex, display='block' if blocco else 'inline')
+    except ERRORI_FORMULA as e:
+        # Formula non convertibile: si registra e si mostra il sorgente
+        _log.warning("Formula non convertibile in MathML (%s): %r", type(e).__name__, latex)
+        return f"<code>{html.escape(latex)}</code>"
+
+
+def _codice(codice, linguaggio, _attributi):
+    try:
+        lexer = get_lexer_by_name(linguaggio.split()[0]) if linguaggio else None
+    except ClassNotFound:
+        lexer = None
+    if lexer is None:
+        corpo = html.escape(codice)
+    else:
+        corpo = highlight(codice, lexer, HtmlFormatter(nowrap=True))
+    # Inizia con <pre>: markdown-it non lo avvolge di nuovo; i colori sono in STILE
+    return f'<pre><code>{corpo}</code></pre>'
+
+
+_renderer = None
+_renderer_lock = threading.Lock()
+
+
+def _markdown_it():
+    global _renderer
+    with _renderer_lock:
+        if _renderer is None:
+            _renderer = (
+                MarkdownIt('commonmark', {'html': False, 'highlight': _codice})
+                .enable('table')
+                .enable('strikethrough')
+                .use(dollarmath_plugin, double_inline=True, renderer=_formula)
+            )
+        return _renderer
+
+
+def _corpo(testo):
+    """HTML di un testo Markdown, senza stile: è la parte che va in cache."""
+    return f'<div class="cheatsheet-html">{_markdown_it().render(testo)}</div>'
+
+
+def render(testo, tema=None):
+    """HTML (con lo stile del tema) di un testo Markdown, senza cache."""
+    return STILI.get(tema, STILI[None]) + _corpo(testo)
+
+
+_memoria = OrderedDict()
+_memoria_lock = threading.Lock()
+stats = {'memoria': 0, 'disco': 0, 'render': 0}
+
+
+def chiave(testo):
+    return hashlib.sha256((VERSIONE_RENDER + '\0' + testo).encode('utf-8')).hexdigest()
+
+
+def html_markdown(testo, cartella=CARTELLA_CACHE, tema=None):
+    """HTML pre-renderizzato di `testo`, dalla cache in memoria, su disco o nuovo.
+
+    `tema` ('light', 'dark' o None) sceglie solo lo stile dei blocchi di
+    codice: il corpo in cache è lo stesso per tutti i temi.
+    """
+    return STILI.get(tema, STILI[None]) + _corpo_in_cache(testo, cartella)
+
+
+def _corpo_in_cache(testo, cartella):
+    sha = chiave(testo)
+    with _memoria_lock:
+        risultato = _memoria.get(sha)
+        if risultato is not None:
+            _memoria.move_to_end(sha)
+            stats['memoria'] += 1
+            return risultato
+
+    percorso = os.path.join(cartella, f"{sha}.html")
+    try:
+        with open(percorso, 'r', encoding='utf-8') as f:
+            risultato = f.read()
+        stats['disco'] += 1
+    except FileNotFoundError:
+        risultato = _corpo(testo)
+        stats['render'] += 1
+        try:
+            os.makedirs(cartella, exist_ok=True)
+            temporaneo = f"{percorso}.{os.getpid()}.{threading.get_ident()}.tmp"
+            with open(temporaneo, 'w', encoding='utf-8') as f:
+                f.write(risultato)
+            os.replace(temporaneo, percorso)
+        except OSError:
+            pass
+
+    with _memoria_lock:
+        _memoria[sha] = risultato
+        while len(_memoria) > MAX_HTML_IN_MEMORIA:
+            _memoria.popitem(last=False)
+    return risultato
+
+
+def prerenderizza(testo, cartella=CARTELLA_CACHE):
+    """HTML delle stesse unità che mostra l'app: documento intero o sezioni."""
+    documento = sezioni_markdown(testo)
+    if len(testo) >= SOGLIA_SEZIONI and len(documento.parti) >= MIN_PARTI:
+        for parte in (documento.testo_completo(), documento.preambolo, *(p.testo for p in documento.parti)):
+            if parte:
+                html_markdown(parte, cartella)
+    else:
+        html_markdown(testo, cartella)
+
+
+if __name__ == '__main__':
+    if not disponibile():
+        sys.exit("Installare markdown-it-py, mdit-py-plugins, latex2mathml e pygments")
+
+    files = sys.argv[1:] or [
+        os.path.join(radice, f) for radice, _, nomi in os.walk('md') for f in nomi if f.endswith('.md')
+    ]
+    for percorso in sorted(files):
+        with open(percorso, 'r', encoding='utf-8') as f:
+            testo = f.read()
+        prerenderizza(testo)
+        print(percorso)
@@ -0,0 +1,200 @@
+"""Preriscaldamento delle cache all'avvio del server (opzionale).
+
+Con la variabile d'ambiente QUIZ_PREWARM impostata (1, oppure il numero di
+thread) la prima esecuzione dello script avvia in background un piccolo pool
+di thread che scorre il catalogo e riempie le cache del processo:
+
+    1. banche compilate e aperte con le loro Question (bank.py), prima le più
+       usate secondo le risposte nell'archivio dei progressi;
+    2. duplicati tra banche (dedup.py);
+    3. cheatsheet analizzati in sezioni e pre-renderizzati (prerender.py);
+    4. indice di ricerca e collegamenti domanda-sezione.
+
+Nessuna esecuzione dello script aspetta il preriscaldamento: anche
+l'elenco dei file e le priorità si calcolano nel thread. I thread lavorano un
+file alla volta e cedono il GIL tra un file e l'altro; chi apre una banca non
+ancora pronta la carica da sé, come senza preriscaldamento. `stato()`
+alimenta l'indicatore nella sidebar.
+
+Uso offline:  python prewarm.py   (stesso lavoro in primo piano, con i tempi)
+"""
+import hashlib
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from bank import load_bank
+from catalog import get_catalog
+from cheatsheet import sezioni_markdown
+from dedup import get_deduplica
+from linking import get_collegamenti
+from prerender import disponibile as prerender_disponibile, prerenderizza
+from progress import get_progress_store
+from search import get_indice
+
+VARIABILE = 'QUIZ_PREWARM'
+THREAD_PREDEFINITI = 2
+# Secondi ceduti alle esecuzioni interattive tra un file e l'altro
+PAUSA = 0.005
+
+
+def thread_richiesti(valore=None):
+    """Thread del pool secondo QUIZ_PREWARM: 0 se il preriscaldamento è spento."""
+    valore = (os.environ.get(VARIABILE, '') if valore is None else valore).strip().lower()
+    if valore in ('', '0', 'no', 'false', 'off'):
+        return 0
+    return int(valore) if valore.isdigit() else THREAD_PREDEFINITI
+
+
+def _sha_file(percorso):
+    with open(percorso, 'rb') as f:
+        return hashlib.sha256(f.read()).hexdigest()
+
+
+def ordina_per_uso(percorsi, uso):
+    """Percorsi dei CSV ordinati per risposte registrate ({sha: n}), poi per nome."""
+    risposte = {}
+    for p in percorsi:
+        try:
+            risposte[p] = uso.get(_sha_file(p), 0)
+        except OSError:
+            risposte[p] = 0
+    return sorted(percorsi, key=lambda p: (-risposte[p], p))
+
+
+def _banca(catalogo, percorso):
+    load_bank(percorso, mtime=catalogo.mtime(percorso))
+
+
+def _cheatsheet(percorso):
+    with open(percorso, 'r', encoding='utf-8', errors='replace') as f:
+        testo = f.read()
+    if prerender_disponibile():
+        prerenderizza(testo)
+    else:
+        sezioni_markdown(testo)
+
+
+def _indici():
+    get_indice().aggiorna()
+    get_collegamenti()
+
+
+class Prewarm:
+    """Lavori di preriscaldamento e loro avanzamento."""
+
+    __slots__ = ('n_thread', 'totale', 'fatti', 'errori', 'inizio', 'fine', '_lock')
+
+    def __init__(self, n_thread=THREAD_PREDEFINITI):
+        self.n_thread = max(int(n_thread), 1)
+        self.totale = 0
+        self.fatti = 0
+        self.errori = 0
+        self.inizio = None
+        self.fine = None
+        self._lock = threading.Lock()
+
+    @property
+    def pronto(self):
+        return self.fine is not None
+
+    def stato(self):
+        """Avanzamento per l'indicatore: lavori fatti, totali, errori e secondi trascorsi."""
+        with self._lock:
+            inizio, fine = self.inizio, self.fine
+            secondi = ((fine or time.monotonic()) - inizio) if inizio is not None else 0.0
+            return {
+                'pronto': fine is not None, 'fatti': self.fatti, 'totale': self.totale,
+                'errori': self.errori, 'secondi': secondi,
+            }
+
+    def lavori(self):
+        """[(descrizione, funzione)] nell'ordine di priorità."""
+        catalogo = get_catalog()
+        _, quizzes, cheatsheets = catalogo.snapshot()
+        try:
+            uso = get_progress_store().uso_banche()
+        except Exception:
+            uso = {}
+        lavori = [(p, lambda p=p: _banca(catalogo, p)) for p in ordina_per_uso(list(quizzes.values()), uso)]
+        lavori.append(("duplicati", get_deduplica))
+        lavori += [(p, lambda p=p: _cheatsheet(p)) for p in sorted(cheatsheets.values())]
+        lavori.append(("indici", _indici))
+        return lavori
+
+    def _esegui(self, descrizione, funzione, verboso=False):
+        inizio = time.perf_counter()
+        try:
+            funzione()
+            errore = None
+        except Exception as e:
+            errore = e
+        with self._lock:
+            self.fatti += 1
+            self.errori += errore is not None
+            if self.fatti == self.totale:
+                self.fine = time.monotonic()
+        if verboso:
+            esito = f"errore: {errore}" if errore is not None else f"{(time.perf_counter() - inizio) * 1000:.0f} ms"
+            print(f"{descrizione}: {esito}")
+        time.sleep(PAUSA)
+
+    def _prepara(self, lavori):
+        with self._lock:
+            self.totale = len(lavori)
+            if not lavori:
+                self.fine = time.monotonic()
+
+    def avvia(self):
+        """Avvia il preriscaldamento in background e torna subito."""
+        with self._lock:
+            if self.inizio is not None:
+                return
+            self.inizio = time.monotonic()
+        threading.Thread(target=self._coordina, name='prewarm', daemon=True).start()
+
+    def _coordina(self):
+        try:
+            lavori = self.lavori()
+        except Exception:
+            lavori = []
+        self._prepara(lavori)
+        # FIFO: i lavori partono nell'ordine di priorità
+        pool = ThreadPoolExecutor(self.n_thread, thread_name_prefix='prewarm')
+        for descrizione, funzione in lavori:
+            pool.submit(self._esegui, descrizione, funzione)
+        pool.shutdown(wait=False)
+
+    def esegui(self, verboso=True):
+        """Stesso lavoro in primo piano (uso offline)."""
+        self.inizio = time.monotonic()
+        lavori = self.lavori()
+        self._prepara(lavori)
+        for descrizione, funzione in lavori:
+            self._esegui(descrizione, funzione, verboso)
+
+
+_prewarm = {}
+_prewarm_lock = threading.Lock()
+
+
+def get_prewarm():
+    """Preriscaldamento del processo, avviato alla prima chiamata; None se QUIZ_PREWARM è spenta."""
+    n_thread = thread_richiesti()
+    if not n_thread:
+        return None
+    chiave = os.getcwd()
+    with _prewarm_lock:
+        prewarm = _prewarm.get(chiave)
+        if prewarm is None:
+            prewarm = _prewarm[chiave] = Prewarm(n_thread)
+    prewarm.avvia()
+    return prewarm
+
+
+if __name__ == '__main__':
+    prewarm = Prewarm()
+    prewarm.esegui()
+    stato = prewarm.stato()
+    print(f"{stato['fatti']} lavori in {stato['secondi']:.1f} s, {stato['errori']} errori")
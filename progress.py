@@ -0,0 +1,341 @@
+"""Stato di avanzamento dell'utente: risposte sbagliate da ripassare.
+
+I progressi sono anche salvati per utente in un archivio SQLite locale
+(.cache/progress.sqlite3, modalità WAL) così sopravvivono a un refresh del
+browser o a un riavvio del server.
+"""
+import atexit
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+
+PERCORSO_DB = os.path.join('.cache', 'progress.sqlite3')
+# Secondi massimi tra una risposta e la sua scrittura su disco
+INTERVALLO_SCRITTURA = 0.5
+MAX_LOTTO = 256
+# Attesa massima (secondi) tra due tentativi dopo un errore del database
+MAX_RITARDO = 30.0
+
+_log = logging.getLogger(__name__)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS risposte (
+    utente TEXT NOT NULL, qid TEXT NOT NULL, banca TEXT, riga INTEGER,
+    esatta INTEGER NOT NULL, istante REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS risposte_utente ON risposte (utente, qid);
+CREATE TABLE IF NOT EXISTS errori (
+    utente TEXT NOT NULL, qid TEXT NOT NULL, banca TEXT, riga INTEGER, aggiunto REAL,
+    PRIMARY KEY (utente, qid)
+);
+CREATE TABLE IF NOT EXISTS stato (
+    utente TEXT PRIMARY KEY, dati TEXT NOT NULL, aggiornato REAL
+);
+"""
+
+
+class WrongAnswerStore:
+    """Insieme ordinato delle domande sbagliate, indicizzato per ID stabile.
+
+    Per ogni domanda si tiene solo il riferimento (sha banca, riga): inserimento,
+    rimozione e appartenenza costano O(1) e le domande vengono risolte dalle
+    banche condivise solo quando servono (modalità pratica).
+
+    Si salva sempre la qid della domanda risposta: la canonica dei duplicati
+    (dedup.py) dipende dal catalogo, quindi viene applicata solo in lettura
+    passando `canonica` ai metodi che la accettano.
+    """
+
+    __slots__ = ('_voci', 'registro', '_indice')
+
+    def __init__(self, voci=None, registro=None):
+        self._voci = dict(voci or {})   # qid -> (sha banca, riga)
+        self.registro = registro        # RegistroUtente per la persistenza, opzionale
+        self._indice = None             # (funzione canonica, {canonica: [qid]}), ricostruito se serve
+
+    def _copie(self, canonica):
+        """{qid canonica: [qid salvate]} secondo `canonica`."""
+        proprietario = getattr(canonica, '__self__', canonica)
+        if self._indice is None or self._indice[0] is not proprietario:
+            copie = {}
+            for qid in self._voci:
+                copie.setdefault(canonica(qid), []).append(qid)
+            self._indice = (proprietario, copie)
+        return self._indice[1]
+
+    def contiene(self, qid, canonica=None):
+        """La domanda, o con `canonica` una sua copia, è tra le sbagliate."""
+        if canonica is None:
+            return qid in self._voci
+        return canonica(qid) in self._copie(canonica)
+
+    def aggiungi(self, domanda, canonica=None):
+        """Registra una domanda sbagliata; restituisce False se era già presente.
+
+        Con `canonica` (vedi dedup.py) la stessa domanda sbagliata in due
+        banche conta una volta.
+        """
+        if self.contiene(domanda.qid, canonica):
+            return False
+        self._voci[domanda.qid] = domanda.riferimento
+        self._indice = None
+        if self.registro is not None:
+            self.registro.errore_aggiunto(domanda.qid, domanda.riferimento)
+        return True
+
+    def rimuovi(self, qid, canonica=None):
+        """Toglie una domanda (con `canonica` anche le sue copie); True se ce n'era almeno una."""
+        if canonica is None:
+            qids = [qid] if qid in self._voci else []
+        else:
+            qids = self._copie(canonica).get(canonica(qid), [])
+        for q in qids:
+            del self._voci[q]
+            if self.registro is not None:
+                self.registro.errore_rimosso(q)
+        if qids:
+            self._indice = None
+        return bool(qids)
+
+    def svuota(self):
+        self._voci.clear()
+        self._indice = None
+        if self.registro is not None:
+            self.registro.errori_svuotati()
+
+    def riferimenti(self, canonica=None):
+        """Riferimenti delle domande sbagliate; con `canonica` uno per gruppo di copie."""
+        if canonica is None:
+            return list(self._voci.values())
+        return [self._voci[qids[0]] for qids in self._copie(canonica).values()]
+
+    def __contains__(self, qid):
+        return qid in self._voci
+
+    def __len__(self):
+        return len(self._voci)
+
+    def __bool__(self):
+        return bool(self._voci)
+
+    def __iter__(self):
+        return iter(self._voci)
+
+
+class RegistroUtente:
+    """Collega un WrongAnswerStore (o una sessione) all'archivio persistente di un utente."""
+
+    __slots__ = ('archivio', 'utente')
+
+    def __init__(self, archivio, utente):
+        self.archivio = archivio
+        self.utente = utente
+
+    def errore_aggiunto(self, qid, riferimento):
+        self.archivio.accoda(('errore+', self.utente, qid, riferimento[0], riferimento[1]))
+
+    def errore_rimosso(self, qid):
+        self.archivio.accoda(('errore-', self.utente, qid))
+
+    def errori_svuotati(self):
+        self.archivio.accoda(('errori0', self.utente))
+
+    def risposta(self, qid, riferimento, esatta):
+        self.archivio.accoda(('risposta', self.utente, qid, riferimento[0], riferimento[1], int(esatta), time.time()))
+
+    def stato(self, dati):
+        self.archivio.salva_stato(self.utente, dati)
+
+
+class ProgressStore:
+    """Archivio SQLite (WAL) dei progressi per utente e qid stabile, con scrittura differita.
+
+    Le operazioni vengono accodate in memoria e scritte a lotti da un thread in
+    background, in una transazione per lotto: il percorso del click non tocca
+    mai il disco. Dello stato di sessione (contatori, quiz scelto...) si
+    tiene solo l'ultimo valore per utente.
+    """
+
+    def __init__(self, percorso=PERCORSO_DB, intervallo=INTERVALLO_SCRITTURA):
+        self.percorso = percorso
+        self.intervallo = intervallo
+        self._coda = []
+        self._stati = {}
+        self._condizione = threading.Condition()
+        self._scritti = 0       # cicli completati, per attendere uno svuotamento
+        self._in_scrittura = False
+        self._chiuso = False
+        self.stats = {'operazioni': 0, 'lotti': 0, 'errori': 0}
+        directory = os.path.dirname(percorso)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with self._connessione() as conn:
+            conn.executescript(SCHEMA)
+        self._thread = threading.Thread(target=self._ciclo, name='progress-writer', daemon=True)
+        self._thread.start()
+        atexit.register(self.chiudi)
+
+    def _connessione(self):
+        conn = sqlite3.connect(self.percorso, timeout=30)
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('PRAGMA synchronous=NORMAL')
+        return conn
+
+    def accoda(self, operazione):
+        with self._condizione:
+            self._coda.append(operazione)
+            if len(self._coda) >= MAX_LOTTO:
+                self._condizione.notify()
+
+    def salva_stato(self, utente, dati):
+        with self._condizione:
+            self._stati[utente] = json.dumps(dati, ensure_ascii=False)
+
+    def _ciclo(self):
+        conn = None
+        ritardo = 0.0
+        while True:
+            with self._condizione:
+                if ritardo:
+                    # Dopo un errore si riprova allo scadere dell'attesa, o alla chiusura
+                    self._condizione.wait_for(lambda: self._chiuso, ritardo)
+                elif not self._chiuso and len(self._coda) < MAX_LOTTO:
+                    self._condizione.wait(self.intervallo)
+                coda, self._coda = self._coda, []
+                stati, self._stati = self._stati, {}
+                chiuso = self._chiuso
+                self._in_scrittura = bool(coda or stati)
+            if coda or stati:
+                try:
+                    if conn is None:
+                        conn = self._connessione()
+                    self._scrivi(conn, coda, stati)
+                    ritardo = 0.0
+                except sqlite3.OperationalError as e:
+                    # Database bloccato, disco pieno...: il lotto torna in testa
+                    # alla coda e si riprova con una connessione nuova
+                    self.stats['errori'] += 1
+                    if conn is not None:
+                        conn.close()
+                        conn = None
+                    if chiuso:
+                        _log.error(
+                            "Progressi non salvati alla chiusura (%s): %d operazioni perse",
+                            e, len(coda) + len(stati),
+                        )
+                    else:
+                        ritardo = min(max(2 * ritardo, self.intervallo), MAX_RITARDO)
+                        _log.warning(
+                            "Scrittura dei progressi non riuscita (%s), nuovo tentativo tra %.1f s",
+                            e, ritardo,
+                        )
+                        with self._condizione:
+                            self._coda[:0] = coda
+                            for utente, dati in stati.items():
+                                # Uno stato più recente accodato nel frattempo vince
+                                self._stati.setdefault(utente, dati)
+                except sqlite3.Error:
+                    # Errore non transitorio (operazione malformata): riprovare non serve
+                    self.stats['errori'] += 1
+                    _log.exception("Lotto di progressi scartato: %d operazioni", len(coda) + len(stati))
+            with self._condizione:
+                self._scritti += 1
+                self._in_scrittura = False
+                self._condizione.notify_all()
+            if chiuso:
+                if conn is not None:
+                    conn.close()
+                return
+
+    def _scrivi(self, conn, coda, stati):
+        with conn:
+            for op in coda:
+                tipo = op[0]
+                if tipo == 'risposta':
+                    conn.execute('INSERT INTO risposte VALUES (?, ?, ?, ?, ?, ?)', op[1:])
+                elif tipo == 'errore+':
+                    conn.execute('INSERT OR REPLACE INTO errori VALUES (?, ?, ?, ?, ?)', (*op[1:], time.time()))
+                elif tipo == 'errore-':
+                    conn.execute('DELETE FROM errori WHERE utente = ? AND qid = ?', op[1:])
+                elif tipo == 'errori0':
+                    conn.execute('DELETE FROM errori WHERE utente = ?', op[1:])
+            conn.executemany(
+                'INSERT OR REPLACE INTO stato VALUES (?, ?, ?)',
+                [(u, dati, time.time()) for u, dati in stati.items()],
+            )
+        self.stats['operazioni'] += len(coda) + len(stati)
+        self.stats['lotti'] += 1
+
+    def svuota(self, attesa=5.0):
+        """Attende che le operazioni accodate finora siano scritte."""
+        with self._condizione:
+            if not (self._coda or self._stati or self._in_scrittura):
+                return
+            obiettivo = self._scritti + 2
+            self._condizione.notify()
+            self._condizione.wait_for(lambda: self._scritti >= obiettivo or self._chiuso, attesa)
+
+    def carica(self, utente):
+        """(errori {qid: (sha, riga)}, stato di sessione o None) di un utente."""
+        self.svuota()
+        conn = self._connessione()
+        try:
+            voci = {
+                qid: (sha, riga)
+                for qid, sha, riga in conn.execute(
+                    'SELECT qid, banca, riga FROM errori WHERE utente = ? ORDER BY aggiunto', (utente,)
+                )
+            }
+            riga = conn.execute('SELECT dati FROM stato WHERE utente = ?', (utente,)).fetchone()
+        finally:
+            conn.close()
+        return voci, (json.loads(riga[0]) if riga else None)
+
+    def storico(self, utente):
+        """{qid: (tentativi, esatte)} delle risposte date da un utente."""
+        self.svuota()
+        conn = self._connessione()
+        try:
+            return {
+                qid: (tentativi, esatte)
+                for qid, tentativi, esatte in conn.execute(
+                    'SELECT qid, COUNT(*), SUM(esatta) FROM risposte WHERE utente = ? GROUP BY qid', (utente,)
+                )
+            }
+        finally:
+            conn.close()
+
+    def uso_banche(self):
+        """{sha banca: risposte registrate} di tutti gli utenti (per il preriscaldamento)."""
+        conn = self._connessione()
+        try:
+            return dict(conn.execute(
+                'SELECT banca, COUNT(*) FROM risposte WHERE banca IS NOT NULL GROUP BY banca'
+            ))
+        finally:
+            conn.close()
+
+    def chiudi(self):
+        with self._condizione:
+            if self._chiuso:
+                return
+            self._chiuso = True
+            self._condizione.notify()
+        self._thread.join(5)
+
+
+_archivi = {}
+_archivi_lock = threading.Lock()
+
+
+def get_progress_store():
+    """Archivio dei progressi condiviso dal processo per la cartella di lavoro corrente."""
+    chiave = os.getcwd()
+    with _archivi_lock:
+        archivio = _archivi.get(chiave)
+        if archivio is None:
+            archivio = _archivi[chiave] = ProgressStore()
+        return archivio
@@ -0,0 +1,46 @@
+"""Componente Streamlit che mostra le domande lato browser.
+
+Il server invia un blocco di domande prefetchate dalla permutazione della
+sessione; il browser mostra opzioni, colori e motivazione senza round trip e
+rimanda i risultati a lotti. Ogni lotto ha un numero di sequenza (`seq`), così
+un lotto già applicato non viene contato due volte. Un lotto incompleto parte
+dopo qualche secondo senza risposte e quando la scheda viene nascosta o
+chiusa, per non perdere le ultime risposte.
+"""
+import os
+import random
+
+import streamlit.components.v1 as components
+
+_CARTELLA = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'componenti', 'quiz_client')
+_componente = components.declare_component('quiz_client', path=_CARTELLA)
+
+# Domande inviate al browser per blocco e risultati per lotto
+PREFETCH = 20
+LOTTO = 10
+
+
+def prepara_domande(domande_per_posizione):
+    """Payload JSON per il browser: [(pos, Question)] -> lista di dizionari.
+
+    Le opzioni vengono mescolate qui, come in nuova_domanda, e portano con sé
+    l'indice originale: il browser restituisce l'indice scelto.
+    """
+    payload = []
+    for pos, q in domande_per_posizione:
+        opzioni = list(enumerate(q.opzioni))
+        random.shuffle(opzioni)
+        payload.append({
+            'pos': int(pos),
+            'qid': q.qid,
+            'testo': q.testo,
+            'opzioni': opzioni,
+            'corretta': q.corretta,
+            'motivazione': q.motivazione,
+        })
+    return payload
+
+
+def quiz_client(domande, seq, key, lotto=LOTTO):
+    """Mostra il componente; restituisce l'ultimo lotto {'seq', 'risultati'} o None."""
+    return _componente(domande=domande, seq=seq, lotto=lotto, key=key, default=None)
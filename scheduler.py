@@ -0,0 +1,127 @@
+"""Ripetizione spaziata (SM-2) per scegliere la prossima domanda.
+
+Il tempo è contato in risposte date (`passo`), non in giorni: una domanda
+sbagliata torna dopo poche domande, una giusta sempre più tardi secondo
+l'intervallo e il fattore di facilità di SM-2. Le domande già viste stanno in
+un heap ordinato per scadenza, quindi scegliere la prossima e riprogrammare
+una risposta costano O(log n) anche su banche di decine di migliaia di
+domande; quelle mai viste vengono prese dalla permutazione della sessione
+solo quando nessuna ripetizione è scaduta.
+"""
+import heapq
+
+# Intervalli in numero di risposte
+PASSI_ERRORE = 3
+PRIMO_INTERVALLO = 8
+SECONDO_INTERVALLO = 20
+FACILITA_INIZIALE = 2.5
+FACILITA_MINIMA = 1.3
+# Qualità SM-2 (0-5) assegnata alle risposte
+QUALITA_ESATTA = 4
+QUALITA_ERRATA = 1
+
+
+class Carta:
+    """Stato SM-2 di una domanda già vista."""
+
+    __slots__ = ('ripetizioni', 'intervallo', 'facilita', 'scadenza', 'versione')
+
+    def __init__(self):
+        self.ripetizioni = 0
+        self.intervallo = 0
+        self.facilita = FACILITA_INIZIALE
+        self.scadenza = 0
+        self.versione = 0
+
+
+class SpacedRepetition:
+    """Coda di ripetizione per le posizioni di una banca.
+
+    L'heap contiene (scadenza, versione, posizione); quando una domanda viene
+    riprogrammata la voce precedente resta nell'heap ma ha una versione
+    vecchia e viene scartata quando emerge (cancellazione pigra).
+    """
+
+    __slots__ = ('_heap', '_carte', '_cursore', 'passo')
+
+    def __init__(self, cursore=0):
+        self._heap = []
+        self._carte = {}            # posizione -> Carta
+        self._cursore = cursore     # prossima posizione mai vista nella permutazione
+        self.passo = 0
+
+    def __len__(self):
+        return len(self._carte)
+
+    def _programma(self, pos, carta, scadenza):
+        carta.versione += 1
+        carta.scadenza = scadenza
+        heapq.heappush(self._heap, (scadenza, carta.versione, pos))
+
+    def _cima(self):
+        """Voce valida più vicina alla scadenza (senza toglierla), None se vuoto."""
+        heap = self._heap
+        while heap:
+            scadenza, versione, pos = heap[0]
+            if self._carte[pos].versione == versione:
+                return heap[0]
+            heapq.heappop(heap)
+        return None
+
+    @property
+    def scaduta(self):
+        """C'è almeno una ripetizione già scaduta."""
+        cima = self._cima()
+        return cima is not None and cima[0] <= self.passo
+
+    def prossima(self, ordine):
+        """Posizione della prossima domanda: ripetizione scaduta, nuova o la più vicina.
+
+        `ordine` è la permutazione della sessione da cui vengono prese le
+        domande nuove. Restituisce None se la banca è vuota.
+        """
+        cima = self._cima()
+        if cima is not None and cima[0] <= self.passo:
+            return cima[2]
+        while self._cursore < len(ordine):
+            pos = int(ordine[self._cursore])
+            self._cursore += 1
+            if pos not in self._carte:
+                return pos
+        return cima[2] if cima is not None else None
+
+    @property
+    def cursore(self):
+        """Domande della permutazione già introdotte."""
+        return self._cursore
+
+    def registra(self, pos, esatta):
+        """Aggiorna intervallo e facilità (SM-2) dopo una risposta e riprogramma."""
+        carta = self._carte.get(pos)
+        if carta is None:
+            carta = self._carte[pos] = Carta()
+        self.passo += 1
+        qualita = QUALITA_ESATTA if esatta else QUALITA_ERRATA
+        if esatta:
+            carta.ripetizioni += 1
+            if carta.ripetizioni == 1:
+                carta.intervallo = PRIMO_INTERVALLO
+            elif carta.ripetizioni == 2:
+                carta.intervallo = SECONDO_INTERVALLO
+            else:
+                carta.intervallo = round(carta.intervallo * carta.facilita)
+        else:
+            carta.ripetizioni = 0
+            carta.intervallo = PASSI_ERRORE
+        carta.facilita = max(
+            FACILITA_MINIMA,
+            carta.facilita + 0.1 - (5 - qualita) * (0.08 + (5 - qualita) * 0.02),
+        )
+        self._programma(pos, carta, self.passo + carta.intervallo)
+
+    def salta(self, pos):
+        """Domanda saltata: torna presto, senza cambiare la facilità."""
+        carta = self._carte.get(pos)
+        if carta is None:
+            carta = self._carte[pos] = Carta()
+        self._programma(pos, carta, self.passo + PASSI_ERRORE)
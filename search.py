@@ -0,0 +1,249 @@
+"""Ricerca full-text (BM25) su cheatsheet e banche di domande.
+
+L'indice invertito è diviso per file sorgente: ogni CSV o Markdown ha il suo
+indice parziale, salvato in .cache/search/ con chiave SHA-256 del contenuto.
+Quando il catalogo segnala un file cambiato si ricostruisce solo quello; le
+statistiche globali (numero documenti, lunghezza media, document frequency)
+sono tenute aggiornate sommando e sottraendo i contributi dei singoli file.
+"""
+import hashlib
+import heapq
+import json
+import math
+import os
+import re
+import threading
+import unicodedata
+from collections import Counter
+
+from bank import load_bank
+from catalog import get_catalog
+from cheatsheet import sezioni_markdown
+
+CARTELLA_CACHE = os.path.join('.cache', 'search')
+VERSIONE_INDICE = 1
+
+# Parametri BM25
+K1 = 1.2
+B = 0.75
+
+_PAROLA = re.compile(r'\w+')
+PAROLE_VUOTE = frozenset("""
+il lo la i gli le un uno una di a da in con su per tra fra e o che non si del della dei delle
+al alla ai alle nel nella nei è sono come anche più the a an of to in on for and or is are be
+by with as at from that this it its not which
+""".split())
+
+
+def tokenizza(testo):
+    """Parole normalizzate: minuscole, senza accenti, senza parole vuote."""
+    testo = unicodedata.normalize('NFKD', testo.lower())
+    testo = ''.join(c for c in testo if not unicodedata.combining(c))
+    return [t for t in _PAROLA.findall(testo) if len(t) > 1 and t not in PAROLE_VUOTE]
+
+
+class IndiceFile:
+    """Indice invertito di un solo file sorgente.
+
+    `documenti` contiene per ogni documento (tipo, titolo, posizione, estratto):
+    la posizione è la riga della banca per le domande e l'indice della parte
+    per le sezioni dei cheatsheet.
+    """
+
+    __slots__ = ('sha', 'documenti', 'lunghezze', 'postings', 'df')
+
+    def __init__(self, sha, documenti, lunghezze, postings):
+        self.sha = sha
+        self.documenti = documenti
+        self.lunghezze = lunghezze
+        self.postings = postings    # termine -> [(documento, tf), ...]
+        self.df = {t: len(p) for t, p in postings.items()}
+
+    @classmethod
+    def costruisci(cls, sha, elementi):
+        """elementi: iterabile di ((tipo, titolo, posizione, estratto), testo)."""
+        documenti, lunghezze, postings = [], [], {}
+        for meta, testo in elementi:
+            n = len(documenti)
+            termini = Counter(tokenizza(testo))
+            documenti.append(list(meta))
+            lunghezze.append(sum(termini.values()))
+            for t, tf in termini.items():
+                postings.setdefault(t, []).append((n, tf))
+        return cls(sha, documenti, lunghezze, postings)
+
+    def salva(self, cartella=CARTELLA_CACHE):
+        os.makedirs(cartella, exist_ok=True)
+        percorso = os.path.join(cartella, f"{self.sha}.json")
+        temporaneo = f"{percorso}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(temporaneo, 'w', encoding='utf-8') as f:
+            json.dump({
+                'versione': VERSIONE_INDICE,
+                'documenti': self.documenti,
+                'lunghezze': self.lunghezze,
+                'postings': self.postings,
+            }, f, ensure_ascii=False, separators=(',', ':'))
+        os.replace(temporaneo, percorso)
+
+    @classmethod
+    def carica(cls, sha, cartella=CARTELLA_CACHE):
+        try:
+            with open(os.path.join(cartella, f"{sha}.json"), 'r', encoding='utf-8') as f:
+                dati = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if dati.get('versione') != VERSIONE_INDICE:
+            return None
+        postings = {t: [tuple(p) for p in lista] for t, lista in dati['postings'].items()}
+        return cls(sha, dati['documenti'], dati['lunghezze'], postings)
+
+
+def _estratto(testo, lunghezza=120):
+    testo = ' '.join(testo.split())
+    return testo if len(testo) <= lunghezza else testo[:lunghezza - 1] + '…'
+
+
+def _elementi_quiz(percorso, mtime):
+    banca = load_bank(percorso, mtime=mtime)
+    for q in banca.domande:
+        testo = ' '.join((q.testo, *q.opzioni, q.motivazione))
+        yield ('quiz', _estratto(q.testo, 80), q.riga, _estratto(q.motivazione or q.testo)), testo
+
+
+def _elementi_md(testo):
+    documento = sezioni_markdown(testo)
+    if documento.preambolo:
+        yield ('md', '', 0, _estratto(documento.preambolo)), documento.preambolo
+    for (_, titolo, parte), sezione in zip(documento.indice(), documento.sezioni):
+        yield ('md', titolo, parte, _estratto(sezione.testo)), sezione.testo
+
+
+class Risultato:
+    __slots__ = ('punteggio', 'tipo', 'percorso', 'titolo', 'posizione', 'estratto')
+
+    def __init__(self, punteggio, tipo, percorso, titolo, posizione, estratto):
+        self.punteggio = punteggio
+        self.tipo = tipo
+        self.percorso = percorso
+        self.titolo = titolo
+        self.posizione = posizione
+        self.estratto = estratto
+
+
+class IndiceRicerca:
+    """Indice BM25 di tutto il catalogo, aggiornato per singolo file."""
+
+    def __init__(self, cartella=CARTELLA_CACHE):
+        self.cartella = cartella
+        self._lock = threading.RLock()
+        self._file = {}        # percorso -> (mtime, IndiceFile)
+        self._df = Counter()
+        self._n_documenti = 0
+        self._lunghezza_totale = 0
+        self.stats = {'ricostruiti': 0, 'da_disco': 0}
+
+    def _rimuovi(self, percorso):
+        _, indice = self._file.pop(percorso)
+        self._df.subtract(indice.df)
+        self._n_documenti -= len(indice.documenti)
+        self._lunghezza_totale -= sum(indice.lunghezze)
+
+    def _aggiungi(self, percorso, mtime, indice):
+        self._file[percorso] = (mtime, indice)
+        self._df.update(indice.df)
+        self._n_documenti += len(indice.documenti)
+        self._lunghezza_totale += sum(indice.lunghezze)
+
+    def _indicizza(self, percorso, mtime):
+        with open(percorso, 'rb') as f:
+            dati = f.read()
+        sha = hashlib.sha256(dati).hexdigest()
+        indice = IndiceFile.carica(sha, self.cartella)
+        if indice is not None:
+            self.stats['da_disco'] += 1
+            return indice
+        if percorso.endswith('.csv'):
+            elementi = _elementi_quiz(percorso, mtime)
+        else:
+            elementi = _elementi_md(dati.decode('utf-8', errors='replace'))
+        indice = IndiceFile.costruisci(sha, elementi)
+        self.stats['ricostruiti'] += 1
+        try:
+            indice.salva(self.cartella)
+        except OSError:
+            pass
+        return indice
+
+    def aggiorna(self, catalogo=None):
+        """Allinea l'indice al catalogo: solo i file nuovi o cambiati vengono rielaborati."""
+        catalogo = catalogo or get_catalog()
+        _, quizzes, cheatsheets = catalogo.snapshot()
+        attuali = set(quizzes.values()) | set(cheatsheets.values())
+        with self._lock:
+            for percorso in list(self._file):
+                if percorso not in attuali:
+                    self._rimuovi(percorso)
+            for percorso in attuali:
+                mtime = catalogo.mtime(percorso)
+                noto = self._file.get(percorso)
+                if noto is not None and noto[0] == mtime:
+                    continue
+                try:
+                    indice = self._indicizza(percorso, mtime)
+                except (OSError, UnicodeDecodeError, ValueError):
+                    continue
+                if noto is not None:
+                    self._rimuovi(percorso)
+                self._aggiungi(percorso, mtime, indice)
+
+    def file(self):
+        """[(percorso, mtime, IndiceFile)] dei file attualmente indicizzati."""
+        with self._lock:
+            return [(p, mtime, indice) for p, (mtime, indice) in sorted(self._file.items())]
+
+    def cerca(self, query, k=10):
+        """I k documenti migliori per BM25."""
+        termini = set(tokenizza(query))
+        if not termini:
+            return []
+        with self._lock:
+            if not self._n_documenti:
+                return []
+            media = self._lunghezza_totale / self._n_documenti
+            punteggi = {}
+            for t in termini:
+                df = self._df.get(t, 0)
+                if df <= 0:
+                    continue
+                idf = math.log(1 + (self._n_documenti - df + 0.5) / (df + 0.5))
+                for percorso, (_, indice) in self._file.items():
+                    lista = indice.postings.get(t)
+                    if not lista:
+                        continue
+                    lunghezze = indice.lunghezze
+                    for doc, tf in lista:
+                        norma = K1 * (1 - B + B * lunghezze[doc] / media)
+                        chiave = (percorso, doc)
+                        punteggi[chiave] = punteggi.get(chiave, 0.0) + idf * tf * (K1 + 1) / (tf + norma)
+
+            migliori = heapq.nlargest(k, punteggi.items(), key=lambda x: x[1])
+            risultati = []
+            for (percorso, doc), punteggio in migliori:
+                tipo, titolo, posizione, estratto = self._file[percorso][1].documenti[doc]
+                risultati.append(Risultato(punteggio, tipo, percorso, titolo, posizione, estratto))
+            return risultati
+
+
+_indici = {}
+_indici_lock = threading.Lock()
+
+
+def get_indice():
+    """Indice di ricerca condiviso dal processo per la cartella di lavoro corrente."""
+    chiave = os.getcwd()
+    with _indici_lock:
+        indice = _indici.get(chiave)
+        if indice is None:
+            indice = IndiceRicerca()
+            _indici[chiave] = indice
+        return indice
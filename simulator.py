@@ -0,0 +1,216 @@
+"""Simulazione Monte Carlo dell'esito di un esame.
+
+Dalle probabilità di risposta esatta (e di salto) di ogni domanda si
+estraggono n_esami esami con le stesse quote per strato e gli stessi pesi di
+exam.genera_esame, tutti insieme come matrici NumPy (n_esami, k): nessun
+ciclo in Python per esame o per domanda. Il punteggio segue le regole
+dell'esame nell'app: +1 esatta, -0.33 errata, 0 saltata, superato con
+almeno 18 punti.
+
+Le domande di un esame sono distinte: si estrae con ripetizione dalle tabelle
+alias degli strati e si riestraggono solo le celle duplicate finché non ce ne
+sono più (pochi giri anche su banche piccole).
+
+Le probabilità si ottengono dallo storico dell'utente per domanda
+(`probabilita_domande`) o per argomento (`probabilita_argomenti`), ammorbiditi
+verso una stima di partenza (per esempio quella di analytics.py).
+"""
+import numpy as np
+
+from exam import numeri_per_strato, tabelle_alias
+
+N_ESAMI = 100_000
+# Esami simulati dall'app a ogni risposta (errore sulla probabilità < 0.4%)
+N_ESAMI_INTERATTIVI = 20_000
+PUNTI_ESATTA = 1.0
+PENALITA_ERRORE = 0.33
+SOGLIA_SUPERAMENTO = 18
+# Tentativi "virtuali" con cui la stima di partenza pesa sullo storico
+PESO_PRIOR = 3.0
+MAX_GIRI = 64
+# Sotto FATTORE_CHIAVI * quota domande per strato si estrae con chiavi casuali
+FATTORE_CHIAVI = 8
+
+
+class Simulazione:
+    """Punteggi degli esami simulati."""
+
+    __slots__ = ('punteggi', 'n_domande')
+
+    def __init__(self, punteggi, n_domande):
+        self.punteggi = punteggi
+        self.n_domande = n_domande
+
+    def __len__(self):
+        return len(self.punteggi)
+
+    @property
+    def media(self):
+        return float(self.punteggi.mean()) if len(self.punteggi) else 0.0
+
+    @property
+    def p_superamento(self):
+        """Frazione di esami superati (punteggio arrotondato come nell'app)."""
+        if not len(self.punteggi):
+            return 0.0
+        return float(np.count_nonzero(np.round(self.punteggi, 2) >= SOGLIA_SUPERAMENTO) / len(self.punteggi))
+
+    def percentili(self, q=(5, 50, 95)):
+        return np.percentile(self.punteggi, q) if len(self.punteggi) else np.zeros(len(q))
+
+    def distribuzione(self):
+        """{punteggio intero: frazione di esami} (punteggi arrotondati per difetto)."""
+        voti, conteggi = np.unique(np.floor(np.round(self.punteggi, 2)).astype(np.int64), return_counts=True)
+        return dict(zip(voti.tolist(), (conteggi / len(self.punteggi)).tolist()))
+
+
+class _Colonne:
+    """Tabelle alias di più strati concatenate: ogni colonna dell'esame estrae dal suo strato."""
+
+    __slots__ = ('prob', 'alias', 'membri', 'dimensioni', 'inizi', 'pesi')
+
+    def __init__(self, strati):
+        # strati: [(membri, tabella, pesi, quota)]
+        inizi = np.cumsum([0] + [len(m) for m, _, _, _ in strati])
+        self.prob = np.concatenate([t.prob for _, t, _, _ in strati]).astype(np.float32)
+        self.alias = np.concatenate([t.alias + i for (_, t, _, _), i in zip(strati, inizi)]).astype(np.int32)
+        self.membri = np.concatenate([m for m, _, _, _ in strati]).astype(np.int32)
+        self.dimensioni = np.repeat([len(m) for m, _, _, _ in strati], [k for _, _, _, k in strati]).astype(np.float32)
+        self.inizi = np.repeat(inizi[:-1], [k for _, _, _, k in strati]).astype(np.int32)
+        self.pesi = [(i, p, k) for (_, _, p, k), i in zip(strati, inizi)]
+
+    def estrai(self, rng, righe, colonne=None):
+        """Indici (nell'ordine concatenato) per le celle date, con ripetizione."""
+        if colonne is None:
+            forma = (righe, len(self.inizi))
+            dimensioni, inizi = self.dimensioni, self.inizi
+        else:
+            forma = len(colonne)
+            dimensioni, inizi = self.dimensioni[colonne], self.inizi[colonne]
+        i = (rng.random(forma, dtype=np.float32) * dimensioni).astype(np.int32)
+        i = np.minimum(i, dimensioni.astype(np.int32) - 1) + inizi
+        return np.where(rng.random(forma, dtype=np.float32) < self.prob[i], i, self.alias[i])
+
+    def estrai_distinte(self, rng, n_esami):
+        """Matrice (n_esami, colonne) di domande, distinte in ogni riga."""
+        indici = self.estrai(rng, n_esami)
+        k = indici.shape[1]
+        righe = np.arange(n_esami)
+        for _ in range(MAX_GIRI):
+            # Ordinando indice * k + colonna le copie diventano adiacenti e la
+            # colonna di ognuna resta leggibile (più veloce di un argsort)
+            chiavi = np.sort(indici[righe].astype(np.int64) * k + np.arange(k), axis=1)
+            doppi = chiavi[:, 1:] // k == chiavi[:, :-1] // k
+            con_doppi = doppi.any(axis=1)
+            if not con_doppi.any():
+                return self.membri[indici]
+            r, c = np.nonzero(doppi)
+            c = (chiavi[r, c + 1] % k).astype(np.int64)
+            indici[righe[r], c] = self.estrai(rng, None, c)
+            righe = righe[con_doppi]
+        # Pesi molto concentrati: le righe ancora con duplicati si ricompongono una per una
+        for riga in righe[(np.diff(np.sort(indici[righe], axis=1), axis=1) == 0).any(axis=1)]:
+            colonna = 0
+            for inizio, p, quota in self.pesi:
+                indici[riga, colonna:colonna + quota] = inizio + rng.choice(len(p), size=quota, replace=False, p=p / p.sum())
+                colonna += quota
+        return self.membri[indici]
+
+
+def _estrai_chiavi(rng, membri, pesi, n_esami, k):
+    """k domande distinte per esame da uno strato piccolo rispetto alla quota.
+
+    Chiavi esponenziali divise per il peso e le k più piccole
+    (Efraimidis-Spirakis), come l'estrazione pesata sequenziale.
+    """
+    if k >= len(membri):
+        return np.broadcast_to(membri.astype(np.int32), (n_esami, len(membri)))
+    chiavi = rng.standard_exponential((n_esami, len(membri)), dtype=np.float32)
+    with np.errstate(divide='ignore'):
+        chiavi /= pesi.astype(np.float32)
+    return membri.astype(np.int32)[np.argpartition(chiavi, k - 1, axis=1)[:, :k]]
+
+
+def simula_esami(
+    p_esatta, p_salto=0.0, n_esami=N_ESAMI, n_domande=33, seme=None, strati=None, pesi=None, quote=None,
+):
+    """Simula n_esami esami sulla banca e restituisce una Simulazione.
+
+    p_esatta: array (n,) con la probabilità di rispondere bene a ogni domanda;
+    p_salto: probabilità di saltare (scalare o array (n,));
+    strati, pesi, quote: come in exam.genera_esame.
+    """
+    p_esatta = np.clip(np.asarray(p_esatta, dtype=np.float64), 0, 1)
+    n = len(p_esatta)
+    p_salto = np.minimum(np.broadcast_to(np.asarray(p_salto, dtype=np.float64), (n,)), 1 - p_esatta)
+    strati = np.zeros(n, dtype=np.int32) if strati is None else np.asarray(strati, dtype=np.int32)
+    pesi = np.ones(n, dtype=np.float64) if pesi is None else np.asarray(pesi, dtype=np.float64)
+    rng = np.random.default_rng(seme)
+    tabelle = tabelle_alias(strati, pesi)
+    quote = numeri_per_strato(tabelle, n_domande, quote)
+
+    # Gli strati grandi rispetto alla quota estraggono insieme dalle tabelle alias,
+    # quelli piccoli con le chiavi casuali
+    grandi, blocchi = [], []
+    for membri, tabella, p, k in zip(tabelle.membri, tabelle.tabelle, tabelle.pesi, quote.tolist()):
+        if k == 0:
+            continue
+        if len(membri) > FATTORE_CHIAVI * k:
+            grandi.append((membri, tabella, p, k))
+        else:
+            blocchi.append(_estrai_chiavi(rng, membri, p, n_esami, k))
+    if grandi:
+        blocchi.append(_Colonne(grandi).estrai_distinte(rng, n_esami))
+
+    # Soglie cumulative per domanda: u < p esatta, u >= 1 - p salto
+    soglia_esatta = p_esatta.astype(np.float32)
+    soglia_salto = (1 - p_salto).astype(np.float32)
+    esatte = np.zeros(n_esami, dtype=np.int32)
+    salti = np.zeros(n_esami, dtype=np.int32)
+    for domande in blocchi:
+        u = rng.random(domande.shape, dtype=np.float32)
+        esatte += np.count_nonzero(u < soglia_esatta[domande], axis=1).astype(np.int32)
+        salti += np.count_nonzero(u >= soglia_salto[domande], axis=1).astype(np.int32)
+    totale = int(sum(b.shape[1] for b in blocchi))
+    punteggi = PUNTI_ESATTA * esatte - PENALITA_ERRORE * (totale - esatte - salti)
+    return Simulazione(punteggi, totale)
+
+
+def probabilita_domande(p_base, tentativi, esatte, prior=PESO_PRIOR):
+    """Accuratezza per domanda dallo storico, ammorbidita verso p_base."""
+    p_base = np.asarray(p_base, dtype=np.float64)
+    return (np.asarray(esatte, dtype=np.float64) + prior * p_base) / (np.asarray(tentativi, dtype=np.float64) + prior)
+
+
+def probabilita_argomenti(strati, p_base, tentativi, esatte, prior=PESO_PRIOR):
+    """Accuratezza per argomento dallo storico, distribuita sulle sue domande.
+
+    Ogni strato ha accuratezza (esatte + prior * media di p_base) /
+    (tentativi + prior); le domande mantengono la difficoltà relativa di p_base.
+    """
+    strati = np.asarray(strati, dtype=np.int64)
+    p_base = np.asarray(p_base, dtype=np.float64)
+    n = int(strati.max()) + 1 if len(strati) else 0
+    dimensioni = np.bincount(strati, minlength=n)
+    media = np.bincount(strati, weights=p_base, minlength=n) / np.maximum(dimensioni, 1)
+    t = np.bincount(strati, weights=tentativi, minlength=n)
+    e = np.bincount(strati, weights=esatte, minlength=n)
+    p_strato = (e + prior * media) / (t + prior)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        fattore = np.where(media > 0, p_strato / media, 1.0)
+    return np.clip(p_base * fattore[strati], 0, 1)
+
+
+if __name__ == '__main__':
+    import sys
+    import time
+
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 1000
+    rng = np.random.default_rng(0)
+    p = rng.beta(6, 3, n)
+    inizio = time.perf_counter()
+    simulazione = simula_esami(p, p_salto=0.05, seme=1, strati=rng.integers(0, 5, n))
+    durata = time.perf_counter() - inizio
+    print(f"{len(simulazione)} esami su {n} domande in {durata * 1000:.0f} ms: "
+          f"media {simulazione.media:.2f}, superati {simulazione.p_superamento:.1%}, "
+          f"percentili 5/50/95 {np.round(simulazione.percentili(), 2).tolist()}")
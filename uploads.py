@@ -0,0 +1,194 @@
+"""File caricati dalla sidebar (CSV e Markdown), analizzati una volta sola.
+
+Il contenuto di un upload viene letto e analizzato al primo rerun e tenuto in
+una cache LRU condivisa da tutte le sessioni, per SHA-256 dei byte: lo stesso
+file caricato da due utenti (o due volte) costa una sola analisi. In
+`quiz_map` e `cheatsheet_map` finisce solo un `Caricamento`, un riferimento di
+pochi byte; banca o testo si recuperano con `contenuto`. Un CSV mai visto
+arriva come bank.StreamingBank: il quiz parte dal primo blocco di righe.
+
+Finché il file resta nel widget i rerun successivi non rileggono né
+riconvertono i byte: il `file_id` di Streamlit porta direttamente al
+Caricamento. Le banche uscite dalla LRU restano compilate in .cache/banks/ e i
+Markdown in .cache/uploads/, quindi un riferimento rimasto in una sessione
+viene risolto anche dopo l'espulsione.
+
+Uso offline:  python uploads.py file.csv|file.md ...
+"""
+import os
+import threading
+from collections import OrderedDict
+
+from bank import StreamingBank, banca_per_sha, load_bank_stream, rilascia, sha_contenuto
+
+MAX_CARICAMENTI_IN_CACHE = 16
+CARTELLA_CACHE = os.path.join('.cache', 'uploads')
+COLONNE_RICHIESTE = ('domanda', 'opzioneA', 'opzioneB', 'opzioneC', 'soluzione')
+
+
+class Caricamento:
+    """Riferimento a un file caricato: tipo ('csv' o 'md'), SHA e nome originale."""
+
+    __slots__ = ('sha', 'tipo', 'nome')
+
+    def __init__(self, sha, tipo, nome):
+        self.sha = sha
+        self.tipo = tipo
+        self.nome = nome
+
+    def __eq__(self, altro):
+        return isinstance(altro, Caricamento) and (self.sha, self.tipo) == (altro.sha, altro.tipo)
+
+    def __hash__(self):
+        return hash((self.sha, self.tipo))
+
+    def __repr__(self):
+        return self.nome
+
+
+# Contenuti analizzati (sha -> QuestionBank o testo) e upload già visti (file_id -> Caricamento)
+_contenuti = OrderedDict()
+_per_file = OrderedDict()
+_lock = threading.Lock()
+
+
+def _decodifica(dati):
+    try:
+        return dati.decode('utf-8')
+    except UnicodeDecodeError:
+        return dati.decode('latin-1')
+
+
+def _percorso_markdown(sha, cartella=CARTELLA_CACHE):
+    return os.path.join(cartella, f"{sha}.md")
+
+
+def _salva_markdown(sha, testo, cartella=CARTELLA_CACHE):
+    destinazione = _percorso_markdown(sha, cartella)
+    if os.path.exists(destinazione):
+        return
+    try:
+        os.makedirs(cartella, exist_ok=True)
+        temporaneo = f"{destinazione}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(temporaneo, 'w', encoding='utf-8') as f:
+            f.write(testo)
+        os.replace(temporaneo, destinazione)
+    except OSError:
+        # Cartella cache non scrivibile: il testo resta solo nella LRU
+        pass
+
+
+def _memorizza(sha, valore):
+    """Inserisce nella LRU ed espelle i contenuti meno recenti."""
+    espulsi = []
+    with _lock:
+        _contenuti[sha] = valore
+        _contenuti.move_to_end(sha)
+        while len(_contenuti) > MAX_CARICAMENTI_IN_CACHE:
+            espulsi.append(_contenuti.popitem(last=False))
+    for vecchio, v in espulsi:
+        if not isinstance(v, str):
+            rilascia(vecchio)
+
+
+def _analizza(dati, tipo, nome):
+    sha = sha_contenuto(dati)
+    with _lock:
+        presente = sha in _contenuti
+    if not presente:
+        if tipo == 'md':
+            testo = _decodifica(dati)
+            _salva_markdown(sha, testo)
+            _memorizza(sha, testo)
+        else:
+            # Si valida l'intestazione: le righe continuano ad arrivare in background
+            banca = load_bank_stream(dati, sorgente=nome)
+            mancanti = [c for c in COLONNE_RICHIESTE if c not in banca.columns]
+            if mancanti:
+                if isinstance(banca, StreamingBank):
+                    banca.annulla()
+                rilascia(sha)
+                raise ValueError(f"Colonne mancanti. Richieste: {', '.join(COLONNE_RICHIESTE)}")
+            _memorizza(sha, banca)
+    return Caricamento(sha, tipo, nome)
+
+
+def carica(file):
+    """Caricamento per un UploadedFile di Streamlit (o un oggetto con name e getvalue).
+
+    Solleva ValueError se un CSV non ha le colonne richieste; anche l'errore
+    viene ricordato per file_id, così un file sbagliato non viene rianalizzato
+    a ogni rerun.
+    """
+    file_id = getattr(file, 'file_id', None)
+    if file_id is not None:
+        with _lock:
+            esito = _per_file.get(file_id)
+            if esito is not None:
+                _per_file.move_to_end(file_id)
+        if isinstance(esito, Exception):
+            raise esito
+        if esito is not None:
+            return esito
+    tipo = 'md' if file.name.lower().endswith('.md') else 'csv'
+    try:
+        esito = _analizza(file.getvalue(), tipo, file.name)
+    except ValueError as e:
+        esito = e
+    if file_id is not None:
+        with _lock:
+            _per_file[file_id] = esito
+            while len(_per_file) > 4 * MAX_CARICAMENTI_IN_CACHE:
+                _per_file.popitem(last=False)
+    if isinstance(esito, Exception):
+        raise esito
+    return esito
+
+
+def contenuto(caricamento):
+    """QuestionBank (csv) o testo (md) di un Caricamento, None se non più disponibile."""
+    sha = caricamento.sha
+    with _lock:
+        valore = _contenuti.get(sha)
+        if valore is not None:
+            _contenuti.move_to_end(sha)
+            return valore
+    if caricamento.tipo == 'md':
+        try:
+            with open(_percorso_markdown(sha), encoding='utf-8') as f:
+                valore = f.read()
+        except OSError:
+            return None
+    else:
+        valore = banca_per_sha(sha)
+        if valore is None:
+            return None
+    _memorizza(sha, valore)
+    return valore
+
+
+if __name__ == '__main__':
+    import sys
+    import time
+
+    class _File:
+        def __init__(self, percorso):
+            self.name = os.path.basename(percorso)
+            self.file_id = os.path.abspath(percorso)
+            with open(percorso, 'rb') as f:
+                self._dati = f.read()
+
+        def getvalue(self):
+            return self._dati
+
+    for percorso in sys.argv[1:]:
+        file = _File(percorso)
+        inizio = time.perf_counter()
+        caricamento = carica(file)
+        primo = time.perf_counter() - inizio
+        inizio = time.perf_counter()
+        carica(file)
+        contenuto(caricamento)
+        rerun = time.perf_counter() - inizio
+        print(f"{percorso}: {caricamento.tipo} {caricamento.sha[:12]}, "
+              f"primo caricamento {primo * 1000:.1f} ms, rerun {rerun * 1e6:.0f} µs")